@@ -0,0 +1,3 @@
+"""Benchmarks for dpres-specification-migrator. Not installed with the
+package, run from the source directory with ``python -m benchmarks.<name>``.
+"""
@@ -0,0 +1,276 @@
+"""Generator of synthetic METS documents for the benchmarks. Documents
+can be generated for every catalog version the migrator reads, with a
+chosen number of files, MIX and textMD blocks and structMap divs.
+
+Every file has a PREMIS object techMD. In catalog version 1.4 documents
+the MIX and textMD blocks are in the PREMIS object characteristics
+extension, where transform_mets.fix_1_4_mets finds them. In newer
+documents they are techMDs of their own, referenced from the ADMID of
+the file.
+
+Usage::
+
+    python -m benchmarks.generator --version 1.4 --files 10000 \\
+        --mix 10000 --output mets.xml
+"""
+
+import argparse
+import sys
+from uuid import uuid4
+
+from dpres_specification_migrator.transform_mets import get_fi_ns
+
+KDK_PROFILE = 'http://www.kdk.fi/kdk-mets-profile'
+FI_PROFILE = 'http://digitalpreservation.fi/mets-profiles/cultural-heritage'
+
+# Full catalog versions the generator accepts
+VERSIONS = ['1.4', '1.5.0', '1.6.0', '1.6.1', '1.7.0', '1.7.1', '1.7.2',
+            '1.7.3', '1.7.4', '1.7.5', '1.7.6', '1.7.7']
+
+HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<mets:mets OBJID="{objid}" PROFILE="{profile}" LABEL="Benchmark"
+ {catalog}
+ xmlns:mets="http://www.loc.gov/METS/"
+ xmlns:{prefix}="{fi_ns}"
+ xmlns:premis="info:lc/xmlns/premis-v2"
+ xmlns:dc="http://purl.org/dc/elements/1.1/"
+ xmlns:mix="http://www.loc.gov/mix/v20"
+ xmlns:textmd="{textmd_ns}"
+ xmlns:xlink="http://www.w3.org/1999/xlink"
+ xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+ <mets:metsHdr CREATEDATE="2015-06-17T16:00:00" RECORDSTATUS="submission">
+  <mets:agent ROLE="CREATOR" TYPE="ORGANIZATION">
+   <mets:name>Benchmark</mets:name>
+  </mets:agent>
+ </mets:metsHdr>
+ <mets:dmdSec ID="dmd001">
+  <mets:mdWrap MDTYPE="DC">
+   <mets:xmlData><dc:title>Benchmark</dc:title></mets:xmlData>
+  </mets:mdWrap>
+ </mets:dmdSec>
+ <mets:amdSec>
+"""
+
+TECHMD = """  <mets:techMD ID="tech{index}">
+   <mets:mdWrap MDTYPE="PREMIS:OBJECT">
+    <mets:xmlData>
+     <premis:object xsi:type="premis:file">
+      <premis:objectIdentifier>
+       <premis:objectIdentifierType>UUID</premis:objectIdentifierType>
+       <premis:objectIdentifierValue>{uuid}</premis:objectIdentifierValue>
+      </premis:objectIdentifier>
+      <premis:objectCharacteristics>
+       <premis:compositionLevel>0</premis:compositionLevel>
+       <premis:format>
+        <premis:formatDesignation>
+         <premis:formatName>{format_name}</premis:formatName>
+        </premis:formatDesignation>
+       </premis:format>{extension}
+      </premis:objectCharacteristics>
+     </premis:object>
+    </mets:xmlData>
+   </mets:mdWrap>
+  </mets:techMD>
+"""
+
+EXTENSION = """
+       <premis:objectCharacteristicsExtension>
+{content}
+       </premis:objectCharacteristicsExtension>"""
+
+MIX = """        <mix:mix>
+         <mix:BasicDigitalObjectInformation>
+          <mix:byteOrder>little endian</mix:byteOrder>
+          <mix:Compression>
+           <mix:compressionScheme>LZW</mix:compressionScheme>
+          </mix:Compression>
+         </mix:BasicDigitalObjectInformation>
+         <mix:BasicImageInformation>
+          <mix:BasicImageCharacteristics>
+           <mix:imageWidth>{index}</mix:imageWidth>
+           <mix:imageHeight>1271</mix:imageHeight>
+           <mix:PhotometricInterpretation>
+            <mix:colorSpace>RGB</mix:colorSpace>
+           </mix:PhotometricInterpretation>
+          </mix:BasicImageCharacteristics>
+         </mix:BasicImageInformation>
+         <mix:ImageAssessmentMetadata>
+          <mix:ImageColorEncoding>
+           <mix:BitsPerSample>
+            <mix:bitsPerSampleValue>8,8,8</mix:bitsPerSampleValue>
+            <mix:bitsPerSampleUnit>integer</mix:bitsPerSampleUnit>
+           </mix:BitsPerSample>
+           <mix:samplesPerPixel>3</mix:samplesPerPixel>
+          </mix:ImageColorEncoding>
+         </mix:ImageAssessmentMetadata>
+        </mix:mix>"""
+
+TEXTMD = """        <textmd:textMD>
+         <textmd:character_info>
+          <textmd:charset>UTF-8</textmd:charset>
+         </textmd:character_info>
+        </textmd:textMD>"""
+
+MDTECHMD = """  <mets:techMD ID="{id}">
+   <mets:mdWrap MDTYPE="{mdtype}">
+    <mets:xmlData>
+{content}
+    </mets:xmlData>
+   </mets:mdWrap>
+  </mets:techMD>
+"""
+
+DIGIPROVMD = """  <mets:rightsMD ID="rights001">
+   <mets:mdWrap MDTYPE="METSRIGHTS">
+    <mets:xmlData/>
+   </mets:mdWrap>
+  </mets:rightsMD>
+  <mets:digiprovMD ID="event001">
+   <mets:mdWrap MDTYPE="PREMIS:EVENT">
+    <mets:xmlData>
+     <premis:event>
+      <premis:eventType>creation</premis:eventType>
+     </premis:event>
+    </mets:xmlData>
+   </mets:mdWrap>
+  </mets:digiprovMD>
+ </mets:amdSec>
+ <mets:fileSec>
+  <mets:fileGrp>
+"""
+
+FILE = """   <mets:file ID="file{index}" ADMID="{admid}">
+    <mets:FLocat LOCTYPE="URL" xlink:href="file://data/file{index}.{ext}"/>
+   </mets:file>
+"""
+
+STRUCTMAP = """  </mets:fileGrp>
+ </mets:fileSec>
+ <mets:structMap>
+  <mets:div TYPE="package">
+"""
+
+DIV = """   <mets:div TYPE="section" ORDER="{order}">
+{fptrs}
+   </mets:div>
+"""
+
+FPTR = """    <mets:fptr FILEID="file{index}"/>"""
+
+FOOTER = """  </mets:div>{extra_div}
+ </mets:structMap>
+</mets:mets>
+"""
+
+# Catalog version 1.4 documents with more than one top level div get a
+# wrapper div from transform_mets.update_divs
+EXTRA_DIV = """
+  <mets:div TYPE="extra"/>"""
+
+
+def generate(version='1.7.0', files=100, mix=0, textmd=0, divs=None):
+    """Returns a synthetic METS document.
+
+    :param version: Full catalog version of the document, see VERSIONS
+    :param files: Number of files, each with a PREMIS object techMD
+    :param mix: Number of files with a MIX block, at most `files`
+    :param textmd: Number of files with a textMD block, at most `files`
+                   minus `mix`
+    :param divs: Number of structMap divs the files are spread over,
+                 one div per file if not given
+
+    :returns: The document as bytes
+    """
+    if version not in VERSIONS:
+        raise ValueError(f"Unknown catalog version {version}.")
+    if mix + textmd > files:
+        raise ValueError("More MIX and textMD blocks than files.")
+    divs = files if divs is None else max(1, min(divs, files))
+    catalog = version[:3]
+    old = catalog == '1.4'
+    kdk = catalog != '1.7'
+
+    if old:
+        attribute = f'kdk:CATALOG="{version}"'
+        prefix = 'kdk'
+        textmd_ns = 'http://www.kdk.fi/standards/textmd'
+    else:
+        attribute = f'fi:CATALOG="{version}"'
+        if not kdk:
+            attribute += ' fi:CONTRACTID="urn:uuid:benchmark"'
+        prefix = 'fi'
+        textmd_ns = 'info:lc/xmlns/textMD-v3'
+
+    parts = [HEADER.format(
+        objid=uuid4(), profile=KDK_PROFILE if kdk else FI_PROFILE,
+        catalog=attribute, prefix=prefix, fi_ns=get_fi_ns(catalog),
+        textmd_ns=textmd_ns)]
+    admids = []
+    for index in range(files):
+        admid = [f'tech{index}']
+        content = None
+        if index < mix:
+            content, mdtype, format_name, ext = (
+                MIX.format(index=index), 'NISOIMG', 'image/tiff', 'tif')
+        elif index < mix + textmd:
+            content, mdtype, format_name, ext = (
+                TEXTMD, 'TEXTMD', 'text/plain', 'txt')
+        else:
+            format_name, ext = 'application/pdf', 'pdf'
+
+        extension = ''
+        if content and old:
+            extension = EXTENSION.format(content=content)
+        parts.append(TECHMD.format(index=index, uuid=uuid4(),
+                                   format_name=format_name,
+                                   extension=extension))
+        if content and not old:
+            parts.append(MDTECHMD.format(id=f'md{index}', mdtype=mdtype,
+                                         content=content))
+            admid.append(f'md{index}')
+        admid.extend(['rights001', 'event001'])
+        admids.append((' '.join(admid), ext))
+
+    parts.append(DIGIPROVMD)
+    parts.extend(FILE.format(index=index, admid=admid, ext=ext)
+                 for index, (admid, ext) in enumerate(admids))
+
+    parts.append(STRUCTMAP)
+    for div in range(divs):
+        indexes = range(div * files // divs, (div + 1) * files // divs)
+        parts.append(DIV.format(order=div + 1, fptrs='\n'.join(
+            FPTR.format(index=index) for index in indexes)))
+    parts.append(FOOTER.format(extra_div=EXTRA_DIV if old else ''))
+    return ''.join(parts).encode('utf-8')
+
+
+def main(arguments=None):
+    """Writes a synthetic METS document."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--version', choices=VERSIONS, default='1.7.0',
+                        help='Catalog version of the document')
+    parser.add_argument('--files', type=int, default=100,
+                        help='Number of files')
+    parser.add_argument('--mix', type=int, default=0,
+                        help='Number of files with a MIX block')
+    parser.add_argument('--textmd', type=int, default=0,
+                        help='Number of files with a textMD block')
+    parser.add_argument('--divs', type=int,
+                        help='Number of structMap divs, one per file by '
+                             'default')
+    parser.add_argument('--output', default='-',
+                        help='Path of the document, "-" writes it to '
+                             'stdout')
+    args = parser.parse_args(arguments)
+
+    data = generate(args.version, files=args.files, mix=args.mix,
+                    textmd=args.textmd, divs=args.divs)
+    if args.output == '-':
+        sys.stdout.buffer.write(data)
+    else:
+        with open(args.output, 'wb') as outfile:
+            outfile.write(data)
+
+
+if __name__ == '__main__':
+    main()
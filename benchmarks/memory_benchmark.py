@@ -0,0 +1,156 @@
+"""Memory benchmark of the catalog version 1.4 fix-up steps on a synthetic
+package from benchmarks.generator with tens of thousands of techMD
+blocks, each with a MIX block in the PREMIS object characteristics
+extension.
+
+transform_mets.fix_1_4_mets moves the MIX blocks and reorders the amdSec
+children in place. The benchmark compares it with the earlier
+implementation, which deep-copied every MIX block and every amdSec child.
+Each variant is run in a fresh interpreter, so that the peak resident
+set sizes can be compared. The tracemalloc peak only covers the Python
+allocations: the copies of the elements are allocated by libxml2, which
+tracemalloc does not see, so the resident set size growth is the figure
+that shows the copies.
+
+Usage::
+
+    python -m benchmarks.memory_benchmark [--techmds 20000]
+"""
+
+import argparse
+import copy
+import gc
+import json
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from unittest import mock
+from uuid import uuid4
+
+import mets
+import lxml.etree as ET
+
+from benchmarks.generator import generate
+from dpres_specification_migrator import transform_mets, xpaths
+from dpres_specification_migrator.context import MigrationContext
+
+
+def copying_move_mix(root, premis_mix, context=None):
+    """The earlier implementation of transform_mets.move_mix, which
+    deep-copies the MIX block.
+    """
+    index = transform_mets.get_admid_index(root, context)
+    mix_id = '_' + str(uuid4())
+    techmd_id = xpaths.ANCESTOR_TECHMD(premis_mix)[0].get('ID')
+    amdsec = xpaths.AMDSEC(root)[0]
+
+    xml_data = mets.xmldata(child_elements=[copy.deepcopy(premis_mix)])
+    md_wrap = mets.mdwrap('NISOIMG', '2.0', child_elements=[xml_data])
+    techmd = mets.techmd(mix_id, child_elements=[md_wrap])
+    amdsec.append(techmd)
+
+    for mets_file in index.files(techmd_id):
+        index.add_admid(mets_file, mix_id)
+
+    premis_extension = xpaths.ANCESTOR_EXTENSION(premis_mix)[0]
+    premis_extension.getparent().remove(premis_extension)
+    return root
+
+
+def copying_update_divs(root, context=None):
+    """The earlier implementation of transform_mets.update_divs, which
+    deep-copies every amdSec child.
+    """
+    list_amdsec = []
+    mets_amdsec = xpaths.AMDSEC(root)[0]
+    for elem in mets_amdsec:
+        list_amdsec.append(copy.deepcopy(elem))
+        mets_amdsec.remove(elem)
+
+    list_amdsec.sort(key=mets.order)
+
+    for elem in list_amdsec:
+        mets_amdsec.append(elem)
+
+    structmap = xpaths.STRUCTMAP(root)[0]
+    if len(xpaths.STRUCTMAP_DIVS(root)) > 1:
+        div_elements = []
+        for div in structmap:
+            div_elements.append(div)
+            div.getparent().remove(div)
+        div1 = mets.div(type_attr='WRAPPER', div_elements=div_elements)
+        structmap.append(div1)
+    return root
+
+
+def max_rss():
+    """Returns the peak resident set size of the process in bytes."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def measure(variant, techmds):
+    """Runs fix_1_4_mets on a synthetic document in this process.
+
+    :param variant: 'in_place' or 'copying'
+    :param techmds: Number of techMD blocks
+
+    :returns: Dictionary of the measurements
+    """
+    root = ET.fromstring(generate('1.4', files=techmds, mix=techmds, divs=1),
+                         ET.XMLParser(huge_tree=True))
+    gc.collect()
+    rss_before = max_rss()
+
+    patches = []
+    if variant == 'copying':
+        patches = [mock.patch.object(transform_mets, 'move_mix',
+                                     copying_move_mix),
+                   mock.patch.object(transform_mets, 'update_divs',
+                                     copying_update_divs)]
+    for patch in patches:
+        patch.start()
+    tracemalloc.start()
+    start = time.perf_counter()
+    transform_mets.fix_1_4_mets(root, context=MigrationContext(echo=False))
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    for patch in patches:
+        patch.stop()
+
+    return {'variant': variant, 'seconds': elapsed,
+            'tracemalloc_peak': peak, 'rss_growth': max_rss() - rss_before}
+
+
+def main(arguments=None):
+    """Runs the benchmark and prints the results."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--techmds', type=int, default=20000,
+                        help='Number of techMD blocks in the document')
+    parser.add_argument('--variant', choices=['in_place', 'copying'],
+                        help='Measure a single variant in this process '
+                             'and print the result as JSON')
+    args = parser.parse_args(arguments)
+
+    if args.variant:
+        print(json.dumps(measure(args.variant, args.techmds)))
+        return
+
+    print(f"{'variant':10} {'seconds':>8} {'tracemalloc MiB':>16} "
+          f"{'RSS growth MiB':>15}")
+    for variant in ['copying', 'in_place']:
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.memory_benchmark',
+             '--techmds', str(args.techmds), '--variant', variant],
+            check=True, stdout=subprocess.PIPE).stdout
+        result = json.loads(output)
+        print(f"{variant:10} {result['seconds']:8.2f} "
+              f"{result['tracemalloc_peak'] / 2**20:16.1f} "
+              f"{result['rss_growth'] / 2**20:15.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""Benchmark of memory-mapped input, see dpres_specification_migrator.
+mapped, against the current reader on a large synthetic METS document
+from benchmarks.generator.
+
+Two steps are timed: parsing the whole document for the DOM path, with
+xml_helpers.utils.readfile against mapped.parse, and reading the catalog
+version before a streaming migration, with
+streaming.read_catalog_version against mapped.read_catalog_version.
+The document is read once before the timing runs, so both readers work
+from the page cache. Each reader is run in a fresh interpreter, so that
+the peak resident set sizes can be compared.
+
+Usage::
+
+    python -m benchmarks.mmap_benchmark [--files 100000] [--repeat 5]
+"""
+
+import argparse
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import xml_helpers.utils
+
+from benchmarks.generator import generate
+from dpres_specification_migrator import mapped, streaming
+
+# Functions of each reader for the parse and the catalog version steps
+READERS = {
+    'file': (xml_helpers.utils.readfile, streaming.read_catalog_version),
+    'mmap': (mapped.parse, mapped.read_catalog_version)}
+
+# Catalog versions read per timing run, since a single read is short
+VERSION_READS = 1000
+
+
+def max_rss():
+    """Returns the peak resident set size of the process in bytes."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def best_time(function, repeat):
+    """Returns the best wall-clock time of `repeat` runs in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def measure(reader, path, repeat):
+    """Runs both steps with a reader in this process.
+
+    :param reader: 'file' or 'mmap'
+    :param path: Path to the METS document
+    :param repeat: Number of timing runs
+
+    :returns: Dictionary of the measurements
+    """
+    parse, read_catalog_version = READERS[reader]
+    with open(path, 'rb') as infile:
+        while infile.read(1024 * 1024):
+            pass
+    gc.collect()
+    rss_before = max_rss()
+
+    def parse_once():
+        """Parses the document and drops the tree."""
+        parse(path).getroot()
+
+    def read_versions():
+        """Reads the catalog version VERSION_READS times."""
+        for _ in range(VERSION_READS):
+            read_catalog_version(path)
+
+    return {'reader': reader,
+            'parse_seconds': best_time(parse_once, repeat),
+            'version_us': best_time(read_versions, repeat)
+            / VERSION_READS * 1e6,
+            'rss_growth': max_rss() - rss_before}
+
+
+def main(arguments=None):
+    """Runs the benchmark and prints the results."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--files', type=int, default=100000,
+                        help='Number of files in the document')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of timing runs per step')
+    parser.add_argument('--reader', choices=list(READERS),
+                        help='Measure a single reader in this process '
+                             'and print the result as JSON')
+    parser.add_argument('--path', type=str,
+                        help='METS document measured with --reader')
+    args = parser.parse_args(arguments)
+
+    if args.reader:
+        print(json.dumps(measure(args.reader, args.path, args.repeat)))
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'mets.xml')
+        with open(path, 'wb') as outfile:
+            outfile.write(generate('1.7.0', files=args.files))
+        print(f"document: {os.path.getsize(path) / 2**20:.1f} MiB, "
+              f"mmap parsing supported: {mapped.SUPPORTED}\n")
+        print(f"{'reader':6} {'parse s':>8} {'version us':>11} "
+              f"{'RSS growth MiB':>15}")
+        for reader in READERS:
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.mmap_benchmark',
+                 '--reader', reader, '--path', path,
+                 '--repeat', str(args.repeat)],
+                check=True, stdout=subprocess.PIPE).stdout
+            result = json.loads(output)
+            print(f"{reader:6} {result['parse_seconds']:8.2f} "
+                  f"{result['version_us']:11.1f} "
+                  f"{result['rss_growth'] / 2**20:15.1f}")
+
+
+if __name__ == '__main__':
+    main()
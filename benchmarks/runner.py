@@ -0,0 +1,219 @@
+"""Benchmark runner for the migration of synthetic METS documents, see
+benchmarks.generator. For every case, a catalog version and a document
+size, the document is parsed, migrated with
+transform_mets.migrate_mets, optionally turned into a dissemination
+information package with transform_mets.transform_to_dip and serialized
+with transform_mets.serialize_mets.
+
+The report is JSON with the throughput, the median latency of each phase
+and of each migration step function, and the peak resident set size of
+every case, so that the results of different commits can be compared.
+Each case is run in a fresh interpreter, so that the peak resident set
+sizes do not depend on the earlier cases.
+
+Usage::
+
+    python -m benchmarks.runner [--versions 1.4 1.6.1 1.7.0] \\
+        [--files 100 1000 10000] [--repeat 5] [--output results.json]
+"""
+
+import argparse
+import functools
+import io
+import json
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from unittest import mock
+
+import xml_helpers.utils
+import lxml.etree as ET
+
+from benchmarks.generator import VERSIONS, generate
+from dpres_specification_migrator import transform_mets
+from dpres_specification_migrator.context import MigrationContext
+
+# Functions of transform_mets timed as the steps of the migration. The
+# helpers of fix_1_4_mets are included in its time, and the functions
+# called for every MIX block or section are summed per run.
+STEPS = ['fix_1_4_mets', 'add_mdtypeversion', 'set_charset_from_textmd',
+         'move_mix', 'update_divs', 'update_metsrights',
+         'update_root_attributes', 'set_contractid', 'set_mdtype',
+         'update_no_file_format_validation_key']
+
+# Steps called directly from migrate_mets. The rest of its time, the
+# numbered steps that are not functions of their own, such as building
+# the new root, is reported as migrate_mets_other.
+TOP_LEVEL_STEPS = ['fix_1_4_mets', 'update_root_attributes', 'set_mdtype',
+                   'update_no_file_format_validation_key']
+
+CONTRACTID = 'urn:uuid:benchmark'
+
+
+def max_rss():
+    """Returns the peak resident set size of the process in bytes."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def timed(function, timings):
+    """Wraps a function so that its wall-clock time is added to
+    `timings` under the name of the function.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timings[function.__name__] = timings.get(
+                function.__name__, 0.0) + time.perf_counter() - start
+    return wrapper
+
+
+def run_once(data, version, to_version, record_status):
+    """Migrates a document once.
+
+    :param data: The METS document
+    :param version: Full catalog version of the document
+    :param to_version: The intended catalog version
+    :param record_status: The intended RECORDSTATUS
+
+    :returns: Tuple of the phase timings and the step timings
+    """
+    phases = {}
+    steps = {}
+    patches = [mock.patch.object(transform_mets, name,
+                                 timed(getattr(transform_mets, name), steps))
+               for name in STEPS]
+    for patch in patches:
+        patch.start()
+    try:
+        start = time.perf_counter()
+        root = xml_helpers.utils.readfile(io.BytesIO(data)).getroot()
+        phases['parse'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        context = MigrationContext(echo=False)
+        root, _ = transform_mets.migrate_mets(
+            root, to_version, version, contract=CONTRACTID, context=context)
+        phases['migrate_mets'] = time.perf_counter() - start
+        steps['migrate_mets_other'] = phases['migrate_mets'] - sum(
+            steps.get(name, 0.0) for name in TOP_LEVEL_STEPS)
+
+        if record_status == 'dissemination':
+            start = time.perf_counter()
+            root, _ = transform_mets.transform_to_dip(
+                root, cur_catalog=version[:3], to_catalog=to_version,
+                context=context)
+            phases['transform_to_dip'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        transform_mets.serialize_mets(root)
+        phases['serialize_mets'] = time.perf_counter() - start
+    finally:
+        for patch in patches:
+            patch.stop()
+    phases['total'] = sum(phases.values())
+    return phases, steps
+
+
+def measure(case, repeat):
+    """Runs a case in this process.
+
+    :param case: Dictionary of the generator arguments, `to_version` and
+                 `record_status`
+    :param repeat: Number of runs
+
+    :returns: Dictionary of the measurements
+    """
+    data = generate(case['version'], files=case['files'], mix=case['mix'],
+                    textmd=case['textmd'], divs=case['divs'])
+    runs = [run_once(data, case['version'], case['to_version'],
+                     case['record_status']) for _ in range(repeat)]
+
+    latency = {name: statistics.median(run[0][name] for run in runs)
+               for name in runs[0][0]}
+    steps = {name: statistics.median(run[1].get(name, 0.0) for run in runs)
+             for name in sorted({name for run in runs for name in run[1]})}
+    return dict(case, size=len(data),
+                documents_per_second=1 / latency['total'],
+                megabytes_per_second=len(data) / 2**20 / latency['total'],
+                latency=latency, steps=steps, peak_rss=max_rss())
+
+
+def main(arguments=None):
+    """Runs the benchmark and writes the report."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--versions', nargs='+', choices=VERSIONS,
+                        default=['1.4', '1.6.1', '1.7.0'],
+                        help='Catalog versions of the documents')
+    parser.add_argument('--files', nargs='+', type=int,
+                        default=[100, 1000, 10000],
+                        help='Numbers of files in the documents')
+    parser.add_argument('--mix_share', type=float, default=0.5,
+                        help='Share of the files with a MIX block')
+    parser.add_argument('--textmd_share', type=float, default=0.25,
+                        help='Share of the files with a textMD block')
+    parser.add_argument('--files_per_div', type=int, default=10,
+                        help='Number of files in each structMap div')
+    parser.add_argument('--to_version', default='1.7',
+                        help='Catalog version to migrate to')
+    parser.add_argument('--record_status',
+                        help='RECORDSTATUS to migrate to, "dissemination" '
+                             'includes transform_to_dip')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of runs of each case')
+    parser.add_argument('--output', default='-',
+                        help='Path of the JSON report, "-" writes it to '
+                             'stdout')
+    parser.add_argument('--case',
+                        help='Run a single case given as JSON in this '
+                             'process and print the result as JSON')
+    args = parser.parse_args(arguments)
+
+    if args.case:
+        print(json.dumps(measure(json.loads(args.case), args.repeat)))
+        return
+
+    results = []
+    for version in args.versions:
+        for files in args.files:
+            case = {'version': version, 'files': files,
+                    'mix': int(files * args.mix_share),
+                    'textmd': int(files * args.textmd_share),
+                    'divs': max(1, files // args.files_per_div),
+                    'to_version': args.to_version,
+                    'record_status': args.record_status}
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.runner', '--repeat',
+                 str(args.repeat), '--case', json.dumps(case)],
+                check=True, stdout=subprocess.PIPE).stdout
+            result = json.loads(output)
+            results.append(result)
+            print(f"{version:6} {files:7} files "
+                  f"{result['size'] / 2**20:8.1f} MiB "
+                  f"{result['latency']['total']:8.3f} s "
+                  f"{result['megabytes_per_second']:7.1f} MiB/s "
+                  f"{result['peak_rss'] / 2**20:8.1f} MiB peak RSS",
+                  file=sys.stderr)
+
+    report = {'python': platform.python_version(),
+              'lxml': '.'.join(str(part) for part in ET.LXML_VERSION),
+              'libxml2': '.'.join(str(part) for part in
+                                  ET.LIBXML_VERSION),
+              'platform': platform.platform(),
+              'repeat': args.repeat,
+              'cases': results}
+    if args.output == '-':
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, 'w', encoding='utf-8') as outfile:
+            json.dump(report, outfile, indent=2)
+
+
+if __name__ == '__main__':
+    main()
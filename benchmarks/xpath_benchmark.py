@@ -0,0 +1,109 @@
+"""Micro-benchmark of the precompiled XPath queries in
+dpres_specification_migrator.xpaths against evaluating the same XPath
+expressions from strings, which lxml parses and compiles on every call.
+
+The queries are run on the test METS documents the way transform_mets
+runs them: root level queries once per document and element level
+queries once per metadata section. The per-document cost is then scaled
+up to the given number of documents.
+
+Usage::
+
+    python -m benchmarks.xpath_benchmark [--count 5000] [--repeat 5]
+"""
+
+import argparse
+import glob
+import os
+import time
+
+import lxml.etree as ET
+
+from dpres_specification_migrator import xpaths
+from dpres_specification_migrator.dicts import NAMESPACES
+
+TESTDATA = os.path.join(os.path.dirname(__file__), '..', 'tests', 'data',
+                        'mets', '*.xml')
+
+# Queries evaluated once per metadata section instead of from the root
+ELEMENT_QUERIES = ['MDWRAP', 'PREMIS_OBJECT_MDWRAP', 'TEXTMD_MDWRAP',
+                   'MODS_VERSION', 'FORMAT_NAME', 'CHARSET',
+                   'METS_DOCUMENT_IDS', 'AGENTS', 'ANCESTOR_TECHMD',
+                   'ANCESTOR_EXTENSION', 'ANCESTOR_FORMAT_NAME']
+
+
+def workload(root):
+    """Returns the (query, context element) pairs of one document.
+
+    :param root: The METS root element
+
+    :returns: List of (XPath, element) tuples
+    """
+    sections = root.xpath('./mets:metsHdr | ./mets:dmdSec | '
+                          './mets:amdSec/* | .//mets:mdWrap',
+                          namespaces=NAMESPACES)
+    queries = []
+    for name in dir(xpaths):
+        query = getattr(xpaths, name)
+        if not isinstance(query, ET.XPath):
+            continue
+        if name in ELEMENT_QUERIES:
+            queries.extend((query, section) for section in sections)
+        else:
+            queries.append((query, root))
+    return queries
+
+
+def run_strings(queries):
+    """Evaluates the queries from their XPath expression strings."""
+    for query, elem in queries:
+        elem.xpath(query.path, namespaces=NAMESPACES)
+
+
+def run_compiled(queries):
+    """Evaluates the precompiled queries."""
+    for query, elem in queries:
+        query(elem)
+
+
+def best_time(function, queries, repeat):
+    """Returns the best wall-clock time of `repeat` runs in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(queries)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(arguments=None):
+    """Runs the benchmark and prints the results."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--count', type=int, default=5000,
+                        help='Number of documents to extrapolate to')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of timing runs per document')
+    args = parser.parse_args(arguments)
+
+    total_strings = total_compiled = 0.0
+    filepaths = sorted(glob.glob(TESTDATA))
+    print(f"{'document':28} {'queries':>7} {'string us':>10} "
+          f"{'compiled us':>11} {'saving':>7}")
+    for filepath in filepaths:
+        queries = workload(ET.parse(filepath).getroot())
+        strings = best_time(run_strings, queries, args.repeat)
+        compiled = best_time(run_compiled, queries, args.repeat)
+        total_strings += strings
+        total_compiled += compiled
+        print(f"{os.path.basename(filepath):28} {len(queries):7} "
+              f"{strings * 1e6:10.1f} {compiled * 1e6:11.1f} "
+              f"{1 - compiled / strings:7.1%}")
+
+    scale = args.count / len(filepaths)
+    print(f"\n{args.count} documents: {total_strings * scale:.2f} s with "
+          f"string queries, {total_compiled * scale:.2f} s precompiled, "
+          f"saving {(total_strings - total_compiled) * scale:.2f} s")
+
+
+if __name__ == '__main__':
+    main()
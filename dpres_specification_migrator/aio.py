@@ -0,0 +1,181 @@
+"""asyncio front-end for the Migrator API. The migrations, including the
+reading and writing of files, run in an executor, so that the event loop
+is never blocked. The number of migrations in flight is bounded, and a
+cancelled migration keeps its slot until its worker is really free.
+
+Example::
+
+    async with AsyncMigrator(Migrator(contractid='urn:uuid:...'),
+                             max_concurrency=8) as migrator:
+        result = await migrator.migrate(mets_bytes)
+        async for result in migrator.migrate_many(jobs):
+            ...
+"""
+
+from __future__ import annotations
+import asyncio
+import collections
+import concurrent.futures
+
+from dpres_specification_migrator.api import MigrationResult, Migrator
+
+
+def _migrate(migrator: Migrator, source, outfile) -> MigrationResult:
+    """Runs a migration in a worker. A module level function, so that it
+    can be sent to worker processes.
+    """
+    return migrator.migrate(source, outfile=outfile)
+
+
+class AsyncMigrator:
+    """Runs migrations of a Migrator in an executor with a bounded
+    number of migrations in flight.
+    """
+
+    def __init__(self,
+                 migrator: Migrator | None = None,
+                 max_concurrency: int = 4,
+                 executor: concurrent.futures.Executor | None = None):
+        """Initialize the migrator.
+
+        :param migrator: The migrator to run, one with the default options
+                         is created if not given
+        :param max_concurrency: Maximum number of migrations running or
+                                queued in the executor at a time
+        :param executor: Executor to run the migrations in. By default a
+                         thread pool of `max_concurrency` threads is
+                         created, and shut down by close(). With a
+                         process pool the sources and outputs must be
+                         bytes or paths.
+        """
+        self.migrator = migrator or Migrator()
+        self.max_concurrency = max_concurrency
+        self._owns_executor = executor is None
+        self._executor = executor or concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_concurrency)
+        # Created on first use, so that it belongs to the running loop
+        self._semaphore = None
+        self.in_flight = 0
+
+    async def __aenter__(self) -> AsyncMigrator:
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        """Waits for the running migrations and shuts down the executor
+        if it was created by this object.
+        """
+        if self._owns_executor:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self._executor.shutdown)
+
+    async def migrate(self, source, outfile=None) -> MigrationResult:
+        """Migrates a METS document, see api.Migrator.migrate. Waits for a
+        free slot first if `max_concurrency` migrations are in flight.
+
+        If the call is cancelled before the migration has started, the
+        migration is not run. A migration that has already started runs
+        to completion in its worker, and its slot is freed only then.
+
+        :param source: The METS document as bytes, a binary file object,
+                       a path, or a parsed ElementTree or root element
+        :param outfile: Binary file object or path to write the migrated
+                        document to
+
+        :returns: Result of the migration
+        """
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        await self._semaphore.acquire()
+        self.in_flight += 1
+        try:
+            future = self._executor.submit(_migrate, self.migrator, source,
+                                           outfile)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(
+            lambda _: loop.call_soon_threadsafe(self._release))
+        return await asyncio.wrap_future(future)
+
+    async def migrate_many(self, jobs, return_exceptions: bool = False):
+        """Migrates METS documents from an iterable or an asynchronous
+        iterable and yields the results in input order. A new job is
+        taken from `jobs` only when a slot is free, so a slow consumer of
+        the results also slows down the reading of the jobs.
+
+        :param jobs: Iterable of (source, outfile) tuples, where outfile
+                     is None to get the migrated documents in the results
+        :param return_exceptions: Yield the exceptions of failed
+                                  migrations instead of raising them
+
+        :returns: Asynchronous iterator of MigrationResult objects, or
+                  exceptions if `return_exceptions` is True
+        """
+        pending = collections.deque()
+        iterator = _aiter(jobs)
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(pending) < self.max_concurrency:
+                    try:
+                        source, outfile = await iterator.__anext__()
+                    except StopAsyncIteration:
+                        exhausted = True
+                        break
+                    pending.append(asyncio.ensure_future(
+                        self.migrate(source, outfile)))
+                if not pending:
+                    return
+                task = pending.popleft()
+                try:
+                    yield await task
+                except Exception as error:  # pylint: disable=broad-except
+                    if not return_exceptions:
+                        raise
+                    yield error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _release(self) -> None:
+        """Frees the slot of a finished migration."""
+        self.in_flight -= 1
+        self._semaphore.release()
+
+
+async def migrate_async(source,
+                        outfile=None,
+                        migrator: Migrator | None = None,
+                        executor: concurrent.futures.Executor | None = None
+                        ) -> MigrationResult:
+    """Migrates a single METS document in an executor. For many
+    concurrent migrations use AsyncMigrator, which bounds the number of
+    migrations in flight.
+
+    :param source: The METS document as bytes, a binary file object, a
+                   path, or a parsed ElementTree or root element
+    :param outfile: Binary file object or path to write the migrated
+                    document to
+    :param migrator: The migrator to run, one with the default options is
+                     created if not given
+    :param executor: Executor to run the migration in, the default
+                     executor of the event loop if not given
+
+    :returns: Result of the migration
+    """
+    return await asyncio.get_running_loop().run_in_executor(
+        executor, _migrate, migrator or Migrator(), source, outfile)
+
+
+async def _aiter(jobs):
+    """Iterates over an iterable or an asynchronous iterable."""
+    if hasattr(jobs, '__aiter__'):
+        async for job in jobs:
+            yield job
+    else:
+        for job in jobs:
+            yield job
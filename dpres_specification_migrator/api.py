@@ -0,0 +1,452 @@
+"""Python API for migrating METS documents held in memory. A Migrator is
+configured once with the migration options and then migrates any number
+of documents given as bytes, binary file objects, paths or parsed
+trees. Nothing is printed: warnings are returned in the result.
+
+Example::
+
+    migrator = Migrator(to_version='1.7', contractid='urn:uuid:...')
+    result = migrator.migrate(mets_bytes)
+    result.data, result.objid, result.warnings
+"""
+
+from __future__ import annotations
+import contextlib
+import io
+import os
+import time
+
+import xml_helpers.utils
+import lxml.etree as ET
+from dpres_specification_migrator import (fastpath, mapped, streaming,
+                                          xpaths)
+from dpres_specification_migrator.compression import (detect, detect_file,
+                                                      open_input)
+from dpres_specification_migrator.context import MigrationContext
+from dpres_specification_migrator.plan import (MigrationPlan, get_plan,
+                                               is_kdk_profile)
+from dpres_specification_migrator.profiling import Profiler, span
+from dpres_specification_migrator.transform_mets import (check_versions,
+                                                         migrate_mets,
+                                                         transform_to_dip,
+                                                         write_mets)
+from dpres_specification_migrator.writer import AtomicWriter
+
+
+def ignored_objid_warning(objid: str) -> str:
+    """Returns the warning of an OBJID given for a migration that does
+    not create a dissemination information package.
+
+    :param objid: The given OBJID
+
+    :returns: The warning
+    """
+    return (f"Warning: the argument objid with the value {objid} was "
+            "ignored. METS OBJID was not changed in the migration to a "
+            "newer version of the specifications.")
+
+
+class MigrationResult:
+    """Outcome of migrating a single METS document with a Migrator."""
+
+    def __init__(self,
+                 objid: str,
+                 plan: MigrationPlan,
+                 method: str,
+                 data: bytes | None = None,
+                 warnings: list | None = None,
+                 timings: dict | None = None,
+                 profile: dict | None = None):
+        """Initialize the result.
+
+        :param objid: OBJID of the migrated METS document
+        :param plan: Migration plan of the document
+        :param method: How the document was migrated: 'fast_path',
+                       'streaming' or 'dom'
+        :param data: The migrated METS document, or None if it was
+                     written to the given output
+        :param warnings: Warning messages of the migration
+        :param timings: Wall-clock times of the migration phases in
+                        seconds
+        :param profile: Spans, counts and details recorded by the
+                        profiler, see profiling.Profiler.as_dict, or None
+                        if the migration was not profiled
+        """
+        self.objid = objid
+        self.plan = plan
+        self.method = method
+        self.data = data
+        self.warnings = warnings or []
+        self.timings = timings or {}
+        self.profile = profile
+
+
+class Migrator:
+    """Migrates METS documents with fixed migration options. The object
+    holds no state of the documents it has migrated, so it can be
+    shared between threads. Migration plans and the compiled XPath
+    queries are shared by all calls.
+    """
+
+    def __init__(self,
+                 to_version: str = '1.7',
+                 contractid: str | None = None,
+                 record_status: str | None = None,
+                 objid: str | None = None,
+                 streaming: bool = False,
+                 fast_path: bool = False,
+                 compress: str | None = None,
+                 durability: str = 'none',
+                 mmap: bool = False,
+                 profile: bool = False,
+                 profile_detail: str | None = None,
+                 on_span=None):
+        """Initialize the migrator.
+
+        :param to_version: The intended catalog version of the METS
+                           documents
+        :param contractid: The CONTRACTID of the METS documents
+        :param record_status: The intended RECORDSTATUS, 'dissemination'
+                              creates dissemination information packages
+        :param objid: OBJID of the dissemination information packages, a
+                      new one is generated for every document if not
+                      given. Ignored for other migrations.
+        :param streaming: Migrate the documents section by section, see
+                          the streaming module
+        :param fast_path: Patch the start tags of 1.7 documents when
+                          possible, see the fastpath module. Only used
+                          for documents given as paths.
+        :param compress: Compress the documents written to a path with
+                         'gzip', 'xz' or 'bz2'. Compressed documents are
+                         read whatever this is, see the compression
+                         module.
+        :param durability: Durability of the documents written to a
+                            path: 'none', 'file' or 'batch', see the
+                            writer module. The documents are always
+                            written under a temporary name and renamed.
+        :param mmap: Parse the documents given as paths, and read their
+                     catalog versions, from a memory mapping of the
+                     file, see the mapped module
+        :param profile: Record the time of every migration step, see the
+                        profiling module. The spans are returned in the
+                        `profile` of the result.
+        :param profile_detail: Also capture 'cprofile' function statistics
+                               or the 'memory' allocations of the
+                               migration. Implies `profile`. Only one
+                               migration at a time captures details,
+                               concurrent ones raise
+                               profiling.ProfilerBusyError.
+        :param on_span: Function called with the name and the wall-clock
+                        time in seconds at the end of every migration
+                        step. Implies `profile`.
+        """
+        self.to_version = to_version
+        self.contractid = contractid
+        self.record_status = record_status
+        self.objid = objid
+        self.streaming = streaming
+        self.fast_path = fast_path
+        self.compress = compress
+        self.writer = AtomicWriter(durability)
+        self.mmap = mmap
+        self.profile = profile or bool(profile_detail) or bool(on_span)
+        self.profile_detail = profile_detail
+        self.on_span = on_span
+
+    @classmethod
+    def from_arguments(cls, args) -> Migrator:
+        """Creates a migrator from parsed transform_mets arguments.
+
+        :param args: Parsed command line arguments
+
+        :returns: The migrator
+        """
+        return cls(to_version=args.to_version, contractid=args.contractid,
+                   record_status=args.record_status, objid=args.objid,
+                   streaming=args.streaming, fast_path=args.fast_path,
+                   compress=args.compress, durability=args.durability,
+                   mmap=args.mmap,
+                   # The step histograms of the metrics are built from
+                   # the profiles
+                   profile=bool(args.profile or args.metrics
+                                or args.metrics_port is not None),
+                   profile_detail=args.profile_detail)
+
+    def migrate(self, source, outfile=None) -> MigrationResult:
+        """Migrates a METS document.
+
+        A parsed document is migrated in place, so the given tree can not
+        be used afterwards.
+
+        :param source: The METS document as bytes, a binary file object,
+                       a path, or a parsed ElementTree or root element.
+                       Documents compressed with gzip, xz or bzip2 are
+                       decompressed while they are read.
+        :param outfile: Binary file object or path to write the migrated
+                        document to. A path is opened only when the
+                        document is written, and its directory is
+                        created if needed. If not given, the document is
+                        returned in the `data` of the result.
+
+        :raises transform_mets.MigrationError: If the document can not be
+                                               migrated with the options
+        :returns: Result of the migration
+        """
+        with _input(source) as source:
+            if not self.profile:
+                return self._migrate(source, outfile,
+                                     MigrationContext(echo=False))
+
+            profiler = Profiler(detail=self.profile_detail,
+                                callback=self.on_span)
+            try:
+                profiler.start()
+                result = self._migrate(
+                    source, outfile,
+                    MigrationContext(echo=False, profiler=profiler))
+            finally:
+                profiler.stop()
+        result.profile = profiler.as_dict()
+        return result
+
+    def _migrate(self, source, outfile,
+                 context: MigrationContext) -> MigrationResult:
+        """Migrates a METS document, see migrate.
+
+        :param source: The METS document
+        :param outfile: Binary file object, path or None
+        :param context: Migration context
+
+        :returns: Result of the migration
+        """
+        timings = {}
+        start = time.perf_counter()
+        filepath = source if isinstance(source, (str, os.PathLike)) else None
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+        if isinstance(source, ET._ElementTree):
+            source = source.getroot()
+
+        root = source if isinstance(source, ET._Element) else None
+        if root is None and not (self.streaming or self.fast_path):
+            with span(context, 'parse'):
+                root = self._parse(source)
+        if root is not None:
+            full_version = xpaths.CATALOG_VERSION(root)[0]
+            if context.profiler is not None:
+                context.profiler.count_elements(root)
+        else:
+            with span(context, 'read_catalog_version'):
+                full_version, source = _read_catalog_version(
+                    source, mmap=self.mmap)
+        check_versions(full_version[:3], self.to_version, self.contractid)
+        plan = get_plan(full_version, self.to_version, self.record_status)
+        timings['read'] = time.perf_counter() - start
+
+        if self.objid and not plan.dissemination:
+            context.warn(ignored_objid_warning(self.objid))
+
+        step = time.perf_counter()
+        patch = None
+        if self.fast_path and filepath and not plan.dissemination:
+            patch_context = MigrationContext(echo=False)
+            try:
+                with span(context, 'fast_path_scan'):
+                    patch = fastpath.prepare(filepath, self.to_version,
+                                             contract=self.contractid,
+                                             context=patch_context)
+                context.warnings.extend(patch_context.warnings)
+                context.profile = patch_context.profile
+            except fastpath.FastPathNotApplicable:
+                pass
+
+        with _output(outfile, self.compress, self.writer) as (output,
+                                                              buffer):
+            if patch:
+                method = 'fast_path'
+                with span(context, 'fast_path_write'):
+                    patch.write(output())
+                objid = patch.objid
+                timings['migrate'] = time.perf_counter() - step
+            elif self.streaming and root is None and not plan.fix_old:
+                method = 'streaming'
+                with span(context, 'migrate_stream'):
+                    objid = streaming.migrate_stream(
+                        source, output(), to_catalog=self.to_version,
+                        contract=self.contractid,
+                        dissemination=plan.dissemination, objid=self.objid,
+                        context=context)
+                timings['migrate'] = time.perf_counter() - step
+            else:
+                method = 'dom'
+                if root is None:
+                    with span(context, 'parse'):
+                        root = self._parse(source)
+                    if context.profiler is not None:
+                        context.profiler.count_elements(root)
+                with span(context, 'migrate_mets'):
+                    migrated, objid = migrate_mets(
+                        root, self.to_version, full_version,
+                        contract=self.contractid, context=context)
+                if plan.dissemination:
+                    with span(context, 'transform_to_dip'):
+                        migrated, objid = transform_to_dip(
+                            migrated, cur_catalog=plan.cur_catalog,
+                            to_catalog=self.to_version, objid=self.objid,
+                            context=context)
+                timings['migrate'] = time.perf_counter() - step
+
+                step = time.perf_counter()
+                with span(context, 'serialize'):
+                    write_mets(migrated, output())
+                timings['write'] = time.perf_counter() - step
+
+        # The PROFILE is known only after the root has been migrated
+        plan = get_plan(full_version, self.to_version, self.record_status,
+                        is_kdk_profile(context.profile))
+        return MigrationResult(
+            objid, plan, method,
+            data=buffer.getvalue() if buffer is not None else None,
+            warnings=context.warnings, timings=timings)
+
+    def _parse(self, source) -> ET._Element:
+        """Parses a METS document, from a memory mapping of the file if
+        `mmap` is set and the document is given as a path.
+
+        :param source: Path or binary file object
+
+        :returns: The METS root element
+        """
+        if self.mmap and isinstance(source, (str, os.PathLike)):
+            return mapped.parse(source).getroot()
+        return xml_helpers.utils.readfile(source).getroot()
+
+
+def _read_catalog_version(source, mmap: bool = False) -> tuple[str, object]:
+    """Reads the catalog version from the start of the METS document.
+    The bytes read from a file object are kept and read again before
+    the rest of the file, so that also a stream that can not be rewound,
+    such as a pipe or a decompressed pipe, can be migrated.
+
+    :param source: Path or binary file object
+    :param mmap: Read the catalog version of a path from a memory
+                 mapping of the file
+
+    :returns: Tuple of the full catalog version and the source to read
+              the whole document from
+    """
+    if isinstance(source, (str, os.PathLike)):
+        if mmap:
+            return mapped.read_catalog_version(source), source
+        return streaming.read_catalog_version(os.fspath(source)), source
+    recorder = _Recorder(source)
+    version = streaming.read_catalog_version(recorder)
+    return version, _Prefixed(b''.join(recorder.chunks), source)
+
+
+class _Recorder:
+    """Keeps the bytes read from a binary file object."""
+
+    def __init__(self, source):
+        """Initialize the recorder.
+
+        :param source: Binary file object
+        """
+        self.source = source
+        self.chunks = []
+
+    def read(self, size: int = -1) -> bytes:
+        """Reads and keeps the next block.
+
+        :param size: Maximum number of bytes to read
+        """
+        data = self.source.read(size)
+        self.chunks.append(data)
+        return data
+
+
+class _Prefixed:
+    """Reads the bytes of `head` before the rest of a binary file
+    object.
+    """
+
+    def __init__(self, head: bytes, source):
+        """Initialize the reader.
+
+        :param head: Bytes to read first
+        :param source: Binary file object
+        """
+        self.head = head
+        self.source = source
+
+    def read(self, size: int = -1) -> bytes:
+        """Reads the next block.
+
+        :param size: Maximum number of bytes to read
+        """
+        if not self.head:
+            return self.source.read(size)
+        if size is None or size < 0:
+            data, self.head = self.head + self.source.read(), b''
+        else:
+            data, self.head = self.head[:size], self.head[size:]
+        return data
+
+
+@contextlib.contextmanager
+def _input(source):
+    """Opens a compressed METS document for decompression. Other sources
+    are returned as they are.
+
+    :param source: The METS document, see Migrator.migrate
+
+    :returns: The source or a binary file object of the decompressed
+              document
+    """
+    compression = None
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        compression = detect(bytes(source[:6]))
+    elif isinstance(source, (str, os.PathLike)) or hasattr(source, 'read'):
+        compression = detect_file(source)
+    if compression is None:
+        yield source
+        return
+    with open_input(source, compression) as infile:
+        yield infile
+
+
+@contextlib.contextmanager
+def _output(outfile, compress: str | None = None,
+            writer: AtomicWriter | None = None):
+    """Opens the output of a migration lazily. An output path is written
+    atomically, so a failed migration leaves no partial document behind.
+
+    :param outfile: Binary file object, path or None
+    :param compress: Compression of an output written to a path
+    :param writer: Writer of an output path, a writer without fsync is
+                   used if not given
+
+    :returns: Tuple of a function returning the binary file object to
+              write to, and a BytesIO holding the output if `outfile` is
+              None
+    """
+    if outfile is None:
+        buffer = io.BytesIO()
+        yield (lambda: buffer), buffer
+        return
+    if not isinstance(outfile, (str, os.PathLike)):
+        yield (lambda: outfile), None
+        return
+
+    writer = writer or AtomicWriter()
+    with contextlib.ExitStack() as stack:
+        opened = []
+
+        def output():
+            """Opens the output file on the first call."""
+            if not opened:
+                opened.append(stack.enter_context(
+                    writer.open(outfile, compress)))
+            return opened[0]
+
+        yield output, None
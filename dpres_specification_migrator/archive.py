@@ -0,0 +1,239 @@
+"""Migration of METS documents inside tar and zip packages. The METS
+document is read straight from the archive member into the parser,
+without extracting the package. A migrated package is written as a new
+archive of the same format, with the migrated METS document in place of
+the original member and every other member copied through.
+
+Members of a tar archive are copied as raw bytes. A compressed tar
+archive is compressed as a whole, so it is decompressed and compressed
+again once, as a stream. Members of a zip archive are compressed one by
+one, and zipfile has no way to copy the compressed bytes, so they are
+streamed through with their original compression.
+"""
+
+from __future__ import annotations
+import contextlib
+import copy
+import fnmatch
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
+
+from dpres_specification_migrator.writer import AtomicWriter
+
+# Archive file name suffixes with the tarfile compression, or 'zip'
+SUFFIXES = {'.tar': '', '.tar.gz': 'gz', '.tgz': 'gz', '.tar.xz': 'xz',
+            '.txz': 'xz', '.tar.bz2': 'bz2', '.tbz2': 'bz2', '.zip': 'zip'}
+
+# Migrated METS documents larger than this are spooled to a temporary
+# file before they are written into the new archive
+SPOOL_SIZE = 64 * 1024 * 1024
+
+
+class ArchiveError(Exception):
+    """Raised when the METS document is not found in an archive, or the
+    archive can not be copied.
+    """
+
+
+def archive_suffix(path: str) -> str | None:
+    """Returns the archive suffix of a path.
+
+    :param path: Path to a file
+
+    :returns: One of SUFFIXES, or None if the path is not an archive
+    """
+    name = path.lower()
+    for suffix in sorted(SUFFIXES, key=len, reverse=True):
+        if name.endswith(suffix):
+            return suffix
+    return None
+
+
+def archive_stem(path: str) -> str:
+    """Returns the file name of an archive without the archive suffix.
+
+    :param path: Path to an archive
+    """
+    name = os.path.basename(path)
+    return name[:len(name) - len(archive_suffix(path) or '')]
+
+
+def find_member(names: list, pattern: str) -> str:
+    """Returns the name of the METS document in an archive, the
+    shallowest member matching the pattern.
+
+    :param names: Names of the file members in archive order
+    :param pattern: File name pattern of METS documents
+
+    :raises ArchiveError: If no member matches
+    """
+    matches = [name for name in names
+               if fnmatch.fnmatch(name.rstrip('/').split('/')[-1], pattern)]
+    if not matches:
+        raise ArchiveError(f"No member matching {pattern} found.")
+    return min(matches, key=lambda name: name.strip('/').count('/'))
+
+
+@contextlib.contextmanager
+def open_member(path: str, pattern: str = 'mets.xml'):
+    """Opens the METS document in an archive for reading.
+
+    :param path: Path to a tar or zip archive
+    :param pattern: File name pattern of the METS document
+
+    :raises ArchiveError: If no member matches
+    :returns: Tuple of the member name and a binary file object
+    """
+    if SUFFIXES[archive_suffix(path)] == 'zip':
+        with zipfile.ZipFile(path) as package:
+            name = find_member([info.filename for info in package.infolist()
+                                if not info.is_dir()], pattern)
+            with package.open(name) as infile:
+                yield name, infile
+    else:
+        with tarfile.open(path) as package:
+            members = {}
+            for member in package:
+                if member.isfile():
+                    members[member.name] = member
+                    # A match at the top level is the shallowest, so a
+                    # compressed archive is not read any further
+                    if '/' not in member.name.lstrip('./') and \
+                            fnmatch.fnmatch(member.name.split('/')[-1],
+                                            pattern):
+                        break
+            name = find_member(list(members), pattern)
+            yield name, package.extractfile(members[name])
+
+
+def migrate_archive(migrator,
+                    path: str,
+                    outpath: str,
+                    pattern: str = 'mets.xml',
+                    output_archive: bool = False):
+    """Migrates the METS document of a tar or zip package.
+
+    :param migrator: api.Migrator object
+    :param path: Path to the archive
+    :param outpath: Path where the migrated METS document, or the new
+                    archive, is written
+    :param pattern: File name pattern of the METS document
+    :param output_archive: Write a copy of the archive with the migrated
+                           METS document, see write_archive, instead of
+                           the plain METS document
+
+    :raises ArchiveError: If no member matches
+    :returns: api.MigrationResult object
+    """
+    if not output_archive:
+        with open_member(path, pattern) as (_, infile):
+            return migrator.migrate(infile, outfile=outpath)
+
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as buffer:
+        with open_member(path, pattern) as (name, infile):
+            result = migrator.migrate(infile, outfile=buffer)
+        write_archive(path, outpath, name, buffer, writer=migrator.writer)
+    return result
+
+
+def write_archive(path: str,
+                  outpath: str,
+                  name: str,
+                  mets_file,
+                  writer: AtomicWriter | None = None) -> None:
+    """Writes a copy of an archive with a member replaced by the
+    migrated METS document. The archive is written atomically, see the
+    writer module.
+
+    :param path: Path to the original archive
+    :param outpath: Path of the new archive, in the same format
+    :param name: Name of the METS document member
+    :param mets_file: Seekable binary file object holding the migrated
+                      METS document
+    :param writer: Writer of the new archive, a writer without fsync is
+                   used if not given
+
+    :raises ArchiveError: If a member name occurs more than once. The
+                          new archive is not written in this case.
+    """
+    compression = SUFFIXES[archive_suffix(path)]
+    with (writer or AtomicWriter()).open(outpath) as outfile:
+        if compression == 'zip':
+            _write_zip(path, outfile, name, mets_file)
+        else:
+            _write_tar(path, outfile, compression, name, mets_file)
+
+
+def _write_tar(path, outfile, compression, name, mets_file):
+    """Writes a copy of a tar archive, see write_archive."""
+    size = mets_file.seek(0, os.SEEK_END)
+    mets_file.seek(0)
+    with tarfile.open(path) as package, \
+            tarfile.open(fileobj=outfile, mode=f'w:{compression}',
+                         format=package.format) as output:
+        names = set()
+        for member in package:
+            _check_duplicate(names, member.name)
+            if member.name == name:
+                member = copy.copy(member)
+                member.size = size
+                member.mtime = int(time.time())
+                output.addfile(member, mets_file)
+            elif member.isfile():
+                output.addfile(member, package.extractfile(member))
+            else:
+                output.addfile(member)
+
+
+def _write_zip(path, outfile, name, mets_file):
+    """Writes a copy of a zip archive, see write_archive."""
+    size = mets_file.seek(0, os.SEEK_END)
+    mets_file.seek(0)
+    with zipfile.ZipFile(path) as package, \
+            zipfile.ZipFile(outfile, 'w') as output:
+        output.comment = package.comment
+        names = set()
+        for info in package.infolist():
+            _check_duplicate(names, info.filename)
+            # The extra fields are left out, since zipfile adds its own
+            # ZIP64 field to large members
+            member = zipfile.ZipInfo(info.filename, info.date_time)
+            member.compress_type = info.compress_type
+            member.external_attr = info.external_attr
+            member.create_system = info.create_system
+            member.comment = info.comment
+            if info.is_dir():
+                output.writestr(member, b'')
+                continue
+            if info.filename == name:
+                member.date_time = time.localtime()[:6]
+                source = contextlib.nullcontext(mets_file)
+                member_size = size
+            else:
+                source = package.open(info)
+                member_size = info.file_size
+            with source as infile, output.open(
+                    member, 'w',
+                    force_zip64=member_size >= zipfile.ZIP64_LIMIT
+            ) as outfile:
+                shutil.copyfileobj(infile, outfile, 1024 * 1024)
+
+
+def _check_duplicate(names: set, name: str) -> None:
+    """Adds a member name to the names copied so far. A repeated name
+    would be extracted over the earlier member, so it could hide the
+    migrated METS document or be replaced by it.
+
+    :param names: Names of the members copied so far
+    :param name: Name of the next member
+
+    :raises ArchiveError: If the name has already been copied
+    """
+    key = name.rstrip('/')
+    if key in names:
+        raise ArchiveError(f"Duplicate member {key} in the archive.")
+    names.add(key)
@@ -0,0 +1,228 @@
+"""Dispatch table for removing the attributes of ATTRIBS_TO_DELETE.
+The paths of ATTRIBS_TO_DELETE are parsed once, and the attributes to
+remove are resolved once per state of the path matching and cached, so
+the attributes of a whole document are removed in a single walk of the
+tree instead of one XPath search per path.
+
+A path is a tuple of the tags of an element and its ancestors below the
+METS root, e.g. ('{http://www.loc.gov/METS/}amdSec',
+'{http://www.loc.gov/METS/}techMD'). The METS root itself is ().
+
+The state of a path is the set of steps of the parsed paths reached by
+it. All paths in the same state, e.g. the divs of a structMap at any
+depth, share one entry of the table, and all tags not named in
+ATTRIBS_TO_DELETE lead to the same state. The table therefore depends
+only on ATTRIBS_TO_DELETE, not on the documents, and it does not grow
+with arbitrary nesting or tags in the documents.
+"""
+
+from __future__ import annotations
+
+import lxml.etree as ET
+from dpres_specification_migrator.dicts import ATTRIBS_TO_DELETE, NAMESPACES
+
+
+def parse_path(key: str) -> tuple:
+    """Parses a path of ATTRIBS_TO_DELETE.
+
+    :param key: Path relative to the METS root, e.g. 'mets:structMap//
+                mets:div'
+
+    :returns: Tuple of (descendant, tag) steps, where tag is '*' for
+              any element
+    """
+    if key == '.':
+        return ()
+    steps = []
+    descendant = False
+    for part in key.split('/'):
+        if not part:
+            descendant = True
+            continue
+        if part == '*':
+            tag = '*'
+        else:
+            prefix, name = part.split(':')
+            tag = '{%s}%s' % (NAMESPACES[prefix], name)
+        steps.append((descendant, tag))
+        descendant = False
+    return tuple(steps)
+
+
+# Parsed paths of ATTRIBS_TO_DELETE with their attributes
+RULES = [(parse_path(key), tuple(attribs))
+         for key, attribs in ATTRIBS_TO_DELETE.items()]
+
+
+# Tags named in the parsed paths. The children with any other tag get
+# the same entry, so they share one key in the table.
+RULE_TAGS = frozenset(tag for steps, _ in RULES for _, tag in steps
+                      if tag != '*')
+
+
+def advance(state: frozenset, tag: str) -> frozenset:
+    """Returns the state of a child element.
+
+    :param state: State of the element, a set of (rule, position)
+                  tuples, where position is the number of steps of the
+                  parsed path of RULES[rule] matched
+    :param tag: Tag of the child element
+
+    :returns: State of the child element
+    """
+    child_state = set()
+    for rule, position in state:
+        steps = RULES[rule][0]
+        if position == len(steps):
+            continue
+        descendant, step_tag = steps[position]
+        if descendant:
+            child_state.add((rule, position))
+        if step_tag in ('*', tag):
+            child_state.add((rule, position + 1))
+    return frozenset(child_state)
+
+
+class DispatchEntry:
+    """Entry of the dispatch table for one state. Tells the attributes
+    to remove from the elements in the state and which of their children
+    need to be visited. The entries of the children are created when
+    they are first needed and kept for later documents.
+    """
+
+    def __init__(self, state: frozenset):
+        """Initialize the entry.
+
+        :param state: Set of (rule, position) tuples, see advance
+        """
+        self.state = state
+        attribs = []
+        child_tags = frozenset()
+        for rule, position in sorted(state):
+            steps, names = RULES[rule]
+            if position == len(steps):
+                attribs.extend(names)
+            elif child_tags is not None:
+                descendant, tag = steps[position]
+                child_tags = None if descendant or tag == '*' else \
+                    child_tags | {tag}
+        self.attribs = tuple(attribs)
+        # Tags of the children to visit, None for all children
+        self.child_tags = None if child_tags is None else \
+            tuple(sorted(child_tags))
+        self.descend = child_tags is None or bool(child_tags)
+        self.children = {}
+
+    def child(self, tag: str) -> DispatchEntry:
+        """Returns the entry of a child element.
+
+        :param tag: Tag of the child element
+        """
+        key = tag if tag in RULE_TAGS else None
+        entry = self.children.get(key)
+        if entry is None:
+            entry = self.children[key] = get_state_entry(
+                advance(self.state, tag))
+        return entry
+
+
+# Entry of the elements no path can match, nor any of their descendants
+NO_RULES = DispatchEntry(frozenset())
+
+# Entries by state
+ENTRIES = {NO_RULES.state: NO_RULES}
+
+
+def get_state_entry(state: frozenset) -> DispatchEntry:
+    """Returns the dispatch table entry of a state.
+
+    :param state: Set of (rule, position) tuples, see advance
+    """
+    entry = ENTRIES.get(state)
+    if entry is None:
+        entry = ENTRIES.setdefault(state, DispatchEntry(state))
+    return entry
+
+
+ROOT = get_state_entry(frozenset((rule, 0) for rule in range(len(RULES))))
+
+
+def get_entry(path: tuple) -> DispatchEntry:
+    """Returns the dispatch table entry of a path.
+
+    :param path: Tags of the element and its ancestors below the root
+    """
+    entry = ROOT
+    for tag in path:
+        entry = entry.child(tag)
+    return entry
+
+
+def attribs_to_delete(path: tuple) -> tuple[tuple, bool]:
+    """Returns the attributes removed from an element in the DIP
+    migration.
+
+    :param path: Tags of the element and its ancestors below the root
+
+    :returns: Tuple of (attribute names, whether descendants can have
+              attributes to remove)
+    """
+    entry = get_entry(path)
+    return entry.attribs, entry.descend
+
+
+def strip_attributes(elem: ET._Element,
+                     path: tuple = (),
+                     recursive: bool = True) -> None:
+    """Removes the attributes of ATTRIBS_TO_DELETE from the element and,
+    if `recursive`, from its descendants in a single walk of the tree.
+    Only the children that can be on a matching path are visited.
+
+    :param elem: The element, by default the METS root
+    :param path: Tags of the element and its ancestors below the root
+    :param recursive: Also remove the attributes from the descendants
+    """
+    entry = get_entry(path)
+    if recursive:
+        _strip(elem, entry)
+    else:
+        _strip_element(elem, entry)
+
+
+def _strip_element(elem: ET._Element, entry: DispatchEntry) -> None:
+    """Removes the attributes of a single element.
+
+    :param elem: The element
+    :param entry: Dispatch table entry of the element
+    """
+    attrib = elem.attrib
+    for name in entry.attribs:
+        if name in attrib:
+            del attrib[name]
+
+
+def _strip(elem: ET._Element, entry: DispatchEntry) -> None:
+    """Removes the attributes of the element and its descendants. The
+    tree is walked with an explicit stack, so that deeply nested
+    elements do not exhaust the recursion limit.
+
+    :param elem: The element
+    :param entry: Dispatch table entry of the element
+    """
+    stack = [(elem, entry)]
+    while stack:
+        elem, entry = stack.pop()
+        if entry.attribs:
+            _strip_element(elem, entry)
+        if not entry.descend:
+            continue
+        if entry.child_tags:
+            # The children are filtered by lxml, and the entry is looked
+            # up once per tag instead of once per child
+            for tag in entry.child_tags:
+                child_entry = entry.child(tag)
+                stack.extend((child, child_entry)
+                             for child in elem.iterchildren(tag))
+        else:
+            stack.extend((child, entry.child(child.tag))
+                         for child in elem.iterchildren(ET.Element))
@@ -0,0 +1,315 @@
+"""Batch mode support for transform_mets. Collects the METS documents
+to migrate from the command line arguments and reports the outcome of
+the whole run.
+"""
+
+from __future__ import annotations
+import argparse
+import concurrent.futures
+import fnmatch
+import glob
+import itertools
+import json
+import os
+import sys
+from concurrent.futures.process import BrokenProcessPool
+
+from dpres_specification_migrator.plan import get_plan, plan_counts
+
+
+class FileResult:
+    """Outcome of migrating a single METS document."""
+
+    def __init__(self,
+                 filepath: str,
+                 outpath: str | None = None,
+                 objid: str | None = None,
+                 status: str = 'ok',
+                 message: str | None = None,
+                 error: str | None = None,
+                 plan: tuple | None = None,
+                 elapsed: float = 0.0,
+                 timings: dict | None = None,
+                 profile: dict | None = None,
+                 fingerprint: dict | None = None,
+                 messages: list | None = None,
+                 bytes_written: int | None = None):
+        """Initialize the result. The result is kept small, since it is
+        sent back from the worker processes in parallel runs.
+
+        :param filepath: Path to the input METS document
+        :param outpath: Path to the written METS document
+        :param objid: OBJID of the written METS document
+        :param status: 'ok', 'failed' or 'skipped' if the METS document
+                       was migrated in an earlier run
+        :param message: Error message if the migration failed
+        :param error: Class name of the error if the migration failed
+        :param plan: Key of the migration plan, see plan.get_plan, or
+                     None if the catalog version was not read
+        :param elapsed: Wall-clock time of the migration in seconds
+        :param timings: Wall-clock times of the migration phases
+        :param profile: Profile of the migration, see
+                        profiling.Profiler.as_dict, if it was profiled
+        :param fingerprint: Size, modification time and SHA-256 of the
+                            input, see journal.fingerprint, if the run is
+                            journaled
+        :param messages: List of (level, text) tuples to report, where
+                         level is 'info', 'warning' or 'error'
+        :param bytes_written: Number of bytes written to the output, if
+                              counted
+        """
+        self.filepath = filepath
+        self.outpath = outpath
+        self.objid = objid
+        self.status = status
+        self.message = message
+        self.error = error
+        self.plan = plan
+        self.elapsed = elapsed
+        self.timings = timings or {}
+        self.profile = profile
+        self.fingerprint = fingerprint
+        self.messages = messages or []
+        self.bytes_written = bytes_written
+
+    @property
+    def ok(self) -> bool:
+        """True if the METS document was migrated successfully, in this
+        run or an earlier one.
+        """
+        return self.status in ('ok', 'skipped')
+
+
+def collect_inputs(filepaths: list,
+                   manifest: str | None = None,
+                   pattern: str = 'mets.xml'
+                   ) -> list[tuple[str, str]]:
+    """Collects the METS documents to migrate. Each given path can be a
+    METS file, a glob pattern or a directory which is walked recursively
+    for files matching `pattern`.
+
+    Every document is paired with the directory, relative to the
+    workspace, where the migrated document is written. This mirrors its
+    location below the closest common directory of the inputs: the
+    walked directories and the directories of the other documents. A
+    single walked directory is therefore mirrored below the workspace,
+    sibling directories keep their names and a single METS file is
+    written straight into the workspace.
+
+    :param filepaths: List of METS files, directories or glob patterns
+    :param manifest: Path to a file listing one input path per line,
+                     '-' reads the list from stdin
+    :param pattern: File name pattern used when walking directories
+
+    :returns: List of (filepath, relative output directory) tuples in
+              input order
+    """
+    paths = list(filepaths or [])
+    if manifest:
+        paths.extend(read_manifest(manifest))
+
+    collected = []
+    seen = set()
+    for path in paths:
+        if os.path.isdir(path):
+            anchor = os.path.abspath(path)
+            found = [(filepath, anchor)
+                     for filepath in walk_directory(path, pattern)]
+        elif any(char in path for char in '*?['):
+            found = [(filepath, None) for filepath
+                     in sorted(glob.glob(path, recursive=True))
+                     if os.path.isfile(filepath)]
+        else:
+            found = [(path, None)]
+
+        for filepath, anchor in found:
+            key = os.path.normpath(os.path.abspath(filepath))
+            if key not in seen:
+                seen.add(key)
+                collected.append(
+                    (filepath, os.path.dirname(key), anchor or
+                     os.path.dirname(key)))
+
+    if not collected:
+        return []
+    base = os.path.commonpath([anchor for _, _, anchor in collected])
+    return [(filepath, os.path.relpath(dirpath, base))
+            for filepath, dirpath, _ in collected]
+
+
+def read_manifest(manifest: str) -> list:
+    """Reads a newline-separated list of input paths.
+
+    :param manifest: Path to the manifest file, '-' for stdin
+
+    :returns: List of paths, blank lines are skipped
+    """
+    if manifest == '-':
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(manifest, 'r', encoding='utf-8') as infile:
+            lines = infile.read().splitlines()
+    return [line.strip() for line in lines if line.strip()]
+
+
+def walk_directory(path: str, pattern: str) -> list:
+    """Walks the directory recursively in a stable order.
+
+    :param path: Directory to walk
+    :param pattern: File name pattern to match
+
+    :returns: List of matching file paths
+    """
+    filepaths = []
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if fnmatch.fnmatch(filename, pattern):
+                filepaths.append(os.path.join(dirpath, filename))
+    return filepaths
+
+
+def run_tasks(function,
+              tasks: list,
+              args,
+              jobs: int = 1,
+              failed=None):
+    """Calls `function(*task, args)` for every task. With more than one
+    job the tasks are fanned out to a pool of worker processes. Either
+    way the results are yielded in task order. If a worker process dies,
+    e.g. killed by the out-of-memory killer, the pool can not be used
+    anymore, and the tasks without a result are yielded as failed.
+
+    :param function: Module level function returning a FileResult
+    :param tasks: List of argument tuples
+    :param args: Parsed command line arguments, passed to every call
+    :param jobs: Number of worker processes, at least 1
+    :param failed: Function called with a task and the error to return
+                   the result of a task that failed with the pool,
+                   failed_result by default
+
+    :raises ValueError: If `jobs` is less than 1
+    :returns: Iterator of results in task order
+    """
+    if jobs < 1:
+        raise ValueError(f"Number of jobs must be at least 1, got {jobs}.")
+    failed = failed or failed_result
+    jobs = min(jobs, len(tasks))
+
+    if jobs <= 1:
+        for task in tasks:
+            yield function(*task, args)
+        return
+
+    # Send tasks in chunks to keep the inter-process overhead low, but
+    # small enough that the work is evenly spread between the workers
+    chunksize = max(1, min(64, len(tasks) // (jobs * 4)))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        results = executor.map(function, *zip(*tasks),
+                               itertools.repeat(args, len(tasks)),
+                               chunksize=chunksize)
+        for position in range(len(tasks)):
+            try:
+                yield next(results)
+            except BrokenProcessPool as error:
+                for task in tasks[position:]:
+                    yield failed(task, error)
+                return
+
+
+def failed_result(task: tuple, error: Exception) -> FileResult:
+    """Returns the result of a migration task that failed with the pool
+    of worker processes, see run_tasks.
+
+    :param task: Arguments of the task, starting with the path to the
+                 METS document
+    :param error: The error of the pool
+
+    :returns: Failed result
+    """
+    message = f"{type(error).__name__}: {error}"
+    return FileResult(task[0], status='failed', message=message,
+                      error=type(error).__name__,
+                      messages=[('error', f"Error: {task[0]}: {message}")])
+
+
+def positive_int(value: str) -> int:
+    """Converts a command line argument to an integer of at least 1,
+    e.g. the number of worker processes.
+
+    :param value: The argument
+
+    :raises argparse.ArgumentTypeError: If the argument is not an
+                                        integer of at least 1
+    :returns: The integer
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"invalid int value: {value!r}") from None
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            f"must be at least 1, got {number}")
+    return number
+
+
+def report_messages(result: FileResult, file=None) -> None:
+    """Prints the status lines and warnings of a result. Errors are
+    printed to stderr, everything else to `file`.
+
+    :param result: FileResult object
+    :param file: Stream to print to, defaults to stdout
+    """
+    file = file or sys.stdout
+    for level, text in result.messages:
+        print(text, file=sys.stderr if level == 'error' else file)
+
+
+def write_status(result: FileResult, file) -> None:
+    """Writes the outcome of a METS document as a JSON line. The line is
+    flushed at once, so that a reader of the file descriptor sees every
+    outcome as soon as it is known.
+
+    :param result: FileResult object
+    :param file: Text stream to write to
+    """
+    file.write(json.dumps({
+        'filepath': result.filepath,
+        'outpath': result.outpath,
+        'objid': result.objid,
+        'status': result.status,
+        'error': result.error,
+        'message': result.message,
+        'warnings': [text for level, text in result.messages
+                     if level == 'warning']}) + '\n')
+    file.flush()
+
+
+def print_summary(results: list, file=None) -> None:
+    """Prints a status summary of the run: the number of documents
+    migrated with each migration plan and the status of every file.
+
+    :param results: List of FileResult objects
+    :param file: Stream to print to, defaults to stdout
+    """
+    file = file or sys.stdout
+    failed = len([result for result in results if not result.ok])
+    skipped = len([result for result in results
+                   if result.status == 'skipped'])
+    print(
+        f"Summary: {len(results)} METS documents, "
+        f"{len(results) - failed - skipped} migrated, "
+        + (f"{skipped} skipped, " if skipped else "")
+        + f"{failed} failed",
+        file=file
+    )
+    for key, count in plan_counts(results).items():
+        print(f"plan\t{get_plan(*key).name}\t{count} METS documents",
+              file=file)
+    for result in results:
+        if result.ok:
+            detail = f"{result.outpath} OBJID: {result.objid}"
+        else:
+            detail = result.message
+        print(f"{result.status}\t{result.filepath}\t{detail}", file=file)
@@ -0,0 +1,280 @@
+"""Content-addressed cache of migrated METS documents. A migrated
+document is stored under a key made of the SHA-256 of the input, the
+version of the migrator with a hash of its source and the normalized
+migration and output options, so a
+byte-identical input migrated again with the same options is copied
+from the cache instead of being parsed and migrated.
+
+A migrated document is not fully determined by its key: the metsHdr gets
+the time of the migration as LASTMODDATE, or as CREATEDATE in a
+dissemination information package, and a dissemination information
+package gets a new OBJID unless one is given. On a hit these are set
+again by patching the METS root and metsHdr start tags of the cached
+document, see fastpath.patch_start_tag, while the rest is copied
+through unchanged. The other generated values, the IDs of the techMDs
+created from the MIX blocks of 1.4 documents, only need to be unique
+within the document and are reused. The OBJID is not a part of the key
+of a migration that does not create a dissemination information package,
+so the warning of an ignored OBJID is not cached but given again on a
+hit. A document with several metsHdr elements is never cached, since
+only the first start tag is patched.
+
+Every entry is a pair of files, ``<key>.xml`` and ``<key>.json`` with
+the OBJID, migration plan and warnings, in a subdirectory named by the
+first two characters of the key. Both are written under temporary
+names and renamed, see the writer module, so worker processes can share
+the cache. The
+modification time of the ``.xml`` file is the time of the last use,
+and the least recently used entries are evicted first.
+"""
+
+from __future__ import annotations
+import argparse
+import datetime
+import functools
+import glob
+import hashlib
+import importlib.metadata
+import json
+import mmap
+import os
+import re
+import shutil
+from uuid import uuid4
+
+from dpres_specification_migrator.api import ignored_objid_warning
+from dpres_specification_migrator.journal import migration_options
+from dpres_specification_migrator.fastpath import (PROLOG, START_TAG,
+                                                   WHITESPACE,
+                                                   StartTagPatch,
+                                                   patch_start_tag)
+from dpres_specification_migrator.writer import AtomicWriter
+
+
+# Options of a batch run that change the bytes of the migrated METS
+# documents, but not their content
+OUTPUT_OPTION_NAMES = ('streaming', 'fast_path')
+
+# Name of the distribution of the migrator
+DISTRIBUTION = 'dpres-specification-migrator'
+
+# Start of a metsHdr element, with or without a prefix
+METSHDR_TAG = re.compile(rb'<(?:[^\s<>/:]+:)?metsHdr[\s/>]')
+
+
+class CacheMiss(Exception):
+    """Raised when a cached document can not be used."""
+
+
+def cache_options(args: argparse.Namespace) -> dict:
+    """Returns the options of a run that change the migrated documents,
+    including the options that only change their bytes.
+
+    :param args: Parsed command line arguments
+
+    :returns: Dictionary of the options
+    """
+    options = migration_options(args)
+    options.update({name: getattr(args, name)
+                    for name in OUTPUT_OPTION_NAMES})
+    return options
+
+
+@functools.lru_cache(maxsize=None)
+def migrator_version() -> str:
+    """Returns the version of the migrator code: the version of the
+    installed distribution and a hash of the source of the package,
+    which includes the version tables of the specifications. The hash
+    changes with any change of the code, also when the package is run
+    from a source tree that is not installed.
+
+    :returns: The version as a string
+    """
+    try:
+        version = importlib.metadata.version(DISTRIBUTION)
+    except importlib.metadata.PackageNotFoundError:
+        version = 'unknown'
+    digest = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(__file__),
+                                              '*.py'))):
+        digest.update(os.path.basename(path).encode('utf-8') + b'\0')
+        with open(path, 'rb') as infile:
+            digest.update(infile.read())
+    return f'{version}+{digest.hexdigest()[:16]}'
+
+
+def cache_key(sha256: str, options: dict) -> str:
+    """Returns the cache key of a migration.
+
+    :param sha256: SHA-256 of the input METS document
+    :param options: Migration options, see cache_options
+
+    :returns: The key as a hexadecimal string
+    """
+    options = dict(options)
+    if options.get('record_status') != 'dissemination':
+        # The OBJID is only set in dissemination information packages
+        options['objid'] = None
+    content = json.dumps({'sha256': sha256, 'migrator': migrator_version(),
+                          'options': options}, sort_keys=True)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """On-disk cache of migrated METS documents."""
+
+    def __init__(self, directory: str, writer: AtomicWriter | None = None):
+        """Initialize the cache.
+
+        :param directory: Cache directory, created if needed
+        :param writer: Writer of the restored documents, a writer
+                       without fsync is used if not given. The cache
+                       entries can be rebuilt, so they are never fsynced.
+        """
+        self.directory = directory
+        self.writer = writer or AtomicWriter()
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, key: str) -> tuple[str, str]:
+        """Returns the paths of the document and metadata of an entry."""
+        base = os.path.join(self.directory, key[:2], key)
+        return base + '.xml', base + '.json'
+
+    def restore(self, key: str, outpath: str, options: dict) -> dict | None:
+        """Writes a cached migrated document to `outpath`, with the
+        time-dependent attributes set again.
+
+        :param key: Cache key, see cache_key
+        :param outpath: Path where the migrated document is written
+        :param options: Migration options, see cache_options
+
+        :returns: The metadata of the entry with the OBJID of the
+                  written document, or None on a miss
+        """
+        path, metapath = self._paths(key)
+        try:
+            with open(metapath, 'r', encoding='utf-8') as infile:
+                meta = json.load(infile)
+            dissemination = options.get('record_status') == 'dissemination'
+            if dissemination and not options.get('objid'):
+                meta['objid'] = str(uuid4())
+            patch = _restamp(path, meta['objid'], dissemination)
+        except (OSError, ValueError, CacheMiss):
+            return None
+        meta['warnings'] = _objid_warnings(options) + meta['warnings']
+
+        try:
+            with self.writer.open(outpath) as outfile:
+                patch.write(outfile)
+            # The modification time tells the last use for the eviction
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another run, the output is written again by the
+            # migration
+            return None
+        return meta
+
+    def store(self, key: str, outpath: str, meta: dict,
+              options: dict | None = None) -> None:
+        """Stores a migrated document. Documents that can not be
+        restamped on a hit are not stored.
+
+        :param key: Cache key, see cache_key
+        :param outpath: Path of the migrated document
+        :param meta: Dictionary of the 'objid', 'plan' and 'warnings' of
+                     the migration
+        :param options: Migration options, see cache_options
+        """
+        try:
+            _restamp(outpath, meta['objid'], False)
+        except (ValueError, CacheMiss):
+            return
+        objid_warnings = _objid_warnings(options or {})
+        meta = dict(meta, warnings=[warning for warning in meta['warnings']
+                                    if warning not in objid_warnings])
+        path, metapath = self._paths(key)
+        writer = AtomicWriter()
+        # Copied rather than hard-linked, since a later run writing to
+        # the same output path would replace the shared file
+        with open(outpath, 'rb') as infile, writer.open(path) as outfile:
+            shutil.copyfileobj(infile, outfile)
+        writer.write_file(metapath, json.dumps(meta).encode('utf-8'))
+
+    def evict(self, max_size: int) -> int:
+        """Removes the least recently used entries until the cached
+        documents take at most `max_size` bytes.
+
+        :param max_size: Largest total size of the cached documents
+
+        :returns: Number of removed entries
+        """
+        entries = []
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename.endswith('.xml'):
+                    stat = os.stat(os.path.join(dirpath, filename))
+                    entries.append((stat.st_mtime, stat.st_size,
+                                    os.path.join(dirpath, filename)))
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= max_size:
+                break
+            for entry_path in (path, path[:-len('.xml')] + '.json'):
+                try:
+                    os.unlink(entry_path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            removed += 1
+        return removed
+
+
+def _objid_warnings(options: dict) -> list:
+    """Returns the warnings that depend on the given OBJID, which is not
+    a part of the cache key of every migration.
+
+    :param options: Migration options, see cache_options
+
+    :returns: List of warnings
+    """
+    if options.get('objid') and \
+            options.get('record_status') != 'dissemination':
+        return [ignored_objid_warning(options['objid'])]
+    return []
+
+
+def _restamp(path: str, objid: str, dissemination: bool) -> StartTagPatch:
+    """Prepares the patch of the METS root and metsHdr start tags of a
+    cached document.
+
+    :param path: Path to the cached document
+    :param objid: OBJID of the document
+    :param dissemination: True for a dissemination information package
+
+    :raises CacheMiss: If the start tags are not found, or there are
+                       several metsHdr elements
+    :returns: The patch
+    """
+    date = datetime.datetime.now(datetime.timezone.utc).replace(
+        microsecond=0).isoformat()
+    root_changes = [('OBJID', objid)] if dissemination else []
+    hdr_changes = [('CREATEDATE' if dissemination else 'LASTMODDATE',
+                    date)]
+    with open(path, 'rb') as infile, \
+            mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        root_tag = START_TAG.match(data, PROLOG.match(data).end())
+        if not root_tag:
+            raise CacheMiss("The METS root was not found.")
+        hdr_start = WHITESPACE.match(data, root_tag.end()).end()
+        hdr_tag = START_TAG.match(data, hdr_start)
+        if not hdr_tag or not hdr_tag.group(1).endswith(b'metsHdr'):
+            raise CacheMiss("The metsHdr was not found.")
+        if METSHDR_TAG.search(data, hdr_tag.end()):
+            raise CacheMiss("The document has several metsHdr elements.")
+        chunks = [(0, root_tag.start()),
+                  patch_start_tag(root_tag.group(0), {}, root_changes, {}),
+                  (root_tag.end(), hdr_start),
+                  patch_start_tag(hdr_tag.group(0), {}, hdr_changes, {}),
+                  (hdr_tag.end(), len(data))]
+    return StartTagPatch(path, objid, chunks)
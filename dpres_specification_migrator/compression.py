@@ -0,0 +1,84 @@
+"""Compressed METS documents. Documents compressed with gzip, xz or
+bzip2 are recognized by their magic bytes, whatever their file names,
+and decompressed as a stream while they are parsed. Migrated documents
+can be compressed the same way while they are serialized, so a large
+document is never held decompressed on disk.
+"""
+
+from __future__ import annotations
+import bz2
+import gzip
+import io
+import lzma
+import os
+
+# Compressions with their magic bytes and file name suffixes
+MAGIC = {'gzip': b'\x1f\x8b', 'xz': b'\xfd7zXZ\x00', 'bz2': b'BZh'}
+SUFFIXES = {'gzip': '.gz', 'xz': '.xz', 'bz2': '.bz2'}
+
+_OPEN = {'gzip': gzip.open, 'xz': lzma.open, 'bz2': bz2.open}
+
+
+def detect(data: bytes) -> str | None:
+    """Returns the compression of data by its magic bytes.
+
+    :param data: At least the first six bytes of the data
+
+    :returns: 'gzip', 'xz', 'bz2' or None if not compressed
+    """
+    for compression, magic in MAGIC.items():
+        if data.startswith(magic):
+            return compression
+    return None
+
+
+def detect_file(source) -> str | None:
+    """Returns the compression of a file or a binary file object. A
+    seekable file object is rewound, and the start of a stream, such as
+    standard input, is peeked at without consuming it. A file object
+    with only a read method, which can not be peeked at either, is
+    taken as not compressed.
+
+    :param source: Path or binary file object
+
+    :returns: 'gzip', 'xz', 'bz2' or None if not compressed
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as infile:
+            return detect(infile.read(6))
+    if not getattr(source, 'seekable', lambda: False)():
+        if hasattr(source, 'peek'):
+            return detect(source.peek(6)[:6])
+        return None
+    position = source.tell()
+    data = source.read(6)
+    source.seek(position)
+    return detect(data)
+
+
+def open_input(source, compression: str):
+    """Opens a compressed METS document for reading.
+
+    :param source: Path, bytes or binary file object
+    :param compression: 'gzip', 'xz' or 'bz2'
+
+    :returns: Binary file object of the decompressed document
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    return _OPEN[compression](source, 'rb')
+
+
+def open_output(path, compression: str | None):
+    """Opens a file for writing a METS document.
+
+    :param path: Path to the file, or a binary file object to compress
+                 into, such as standard output. The file object is left
+                 open when the returned one is closed.
+    :param compression: 'gzip', 'xz', 'bz2' or None for no compression
+
+    :returns: Binary file object
+    """
+    if compression is None:
+        return open(path, 'wb+')
+    return _OPEN[compression](path, 'wb')
@@ -0,0 +1,70 @@
+"""Per-migration state for transform_mets."""
+
+from __future__ import annotations
+
+from dpres_specification_migrator.dicts import NAMESPACES
+
+TEXTMD_1_4_NS = 'http://www.kdk.fi/standards/textmd'
+
+
+class MigrationContext:
+    """State of a single METS migration. Every migration gets its own
+    namespace map, version information and warnings, so that several
+    migrations can run concurrently in the same process without
+    affecting each other. The shared NAMESPACES dict from dicts.py is
+    never modified.
+    """
+
+    def __init__(self,
+                 full_cur_catalog: str | None = None,
+                 to_catalog: str | None = None,
+                 contract: str | None = None,
+                 echo: bool = True,
+                 profiler=None):
+        """Initialize the context.
+
+        :param full_cur_catalog: The current full catalog version of the
+                                 METS document
+        :param to_catalog: The intended catalog version of the METS
+                           document
+        :param contract: The CONTRACTID of the METS document
+        :param echo: Print warnings as they are issued. The warnings are
+                     collected to `warnings` in any case.
+        :param profiler: profiling.Profiler recording the steps of the
+                         migration, or None
+        """
+        self.namespaces = dict(NAMESPACES)
+        self.full_cur_catalog = full_cur_catalog
+        self.to_catalog = to_catalog
+        self.contract = contract
+        # PROFILE of the METS document before the migration, see
+        # transform_mets.update_root_attributes
+        self.profile = None
+        self.echo = echo
+        self.warnings = []
+        self.profiler = profiler
+        # ADMID index of the document being migrated, see
+        # transform_mets.get_admid_index
+        self.admid_index = None
+
+    @property
+    def cur_catalog(self) -> str | None:
+        """The current catalog version of the METS document, e.g. 1.6."""
+        if self.full_cur_catalog is None:
+            return None
+        return self.full_cur_catalog[:3]
+
+    def use_1_4_namespaces(self) -> None:
+        """Switches the textmd prefix to the textMD namespace used in
+        catalog version 1.4 documents.
+        """
+        self.namespaces['textmd'] = TEXTMD_1_4_NS
+
+    def warn(self, message: str) -> None:
+        """Issues a warning about the migration.
+
+        :param message: The warning message
+        """
+        self.warnings.append(message)
+        if self.echo:
+            print(message)
@@ -7,6 +7,9 @@ RECORD_STATUS_TYPES = [
     'dissemination'
 ]
 
+# PROFILE of the METS documents of the KDK specifications
+KDK_PROFILE = 'http://www.kdk.fi/kdk-mets-profile'
+
 
 NAMESPACES = {
     'mets': 'http://www.loc.gov/METS/',
@@ -72,6 +75,15 @@ VERSIONS = {
 }
 
 
+# Specifications where no-file-format-validation without a prefix is
+# the key of the digital preservation service
+OLD_NO_VALIDATION_KEY_VERSIONS = ['1.7.0', '1.7.1', '1.7.2']
+
+# Catalog versions of migrated documents, where the declaration of the
+# fi prefix is replaced with the FI extension namespace when serialized
+FI_NAMESPACE_VERSIONS = ['1.7.0', '1.7.1', '1.7.2', '1.7.3', '1.7.4',
+                         '1.7.5', '1.7.6', '1.7.7']
+
 MDTYPEVERSIONS = {'PREMIS:OBJECT': '2.3', 'PREMIS:RIGHTS': '2.3',
                   'PREMIS:EVENT': '2.3', 'PREMIS:AGENT': '2.3',
                   'TEXTMD': '3.01', 'DC': '2008', 'NISOIMG': '2.0',
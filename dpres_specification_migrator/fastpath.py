@@ -0,0 +1,327 @@
+"""Byte-level migration of catalog version 1.7 METS documents to the
+newest 1.7 specification. Such a migration only changes attributes of
+the METS root and the first metsHdr element, so instead of parsing and
+serializing the whole document, the two start tags are patched and the
+rest of the file is copied through unchanged.
+
+A pre-scan of the raw bytes checks that no other step of
+transform_mets.migrate_mets could change the document. Documents that
+fail the pre-scan are migrated with the normal path.
+"""
+
+from __future__ import annotations
+import datetime
+import io
+import mmap
+import os
+import re
+import shutil
+from xml.sax.saxutils import escape
+
+import lxml.etree as ET
+from dpres_specification_migrator import xpaths
+from dpres_specification_migrator.context import MigrationContext
+from dpres_specification_migrator.dicts import NAMESPACES
+from dpres_specification_migrator.transform_mets import (
+    get_fi_ns, has_old_no_validation_key, update_root_attributes)
+
+# Optional UTF-8 byte order mark, XML declaration and whitespace
+PROLOG = re.compile(rb'(?:\xef\xbb\xbf)?(<\?xml\s[^?]*\?>)?\s*')
+ENCODING = re.compile(rb'encoding\s*=\s*["\']([^"\']*)["\']')
+START_TAG = re.compile(
+    rb'<([^\s/>!?]+)((?:\s+[^\s=/>]+\s*=\s*(?:"[^"]*"|\'[^\']*\'))*)\s*(/?)>')
+WHITESPACE = re.compile(rb'\s*')
+
+# Byte strings that show that some other step of migrate_mets applies
+# to the document: KDK preservation plans, MARC metadata, the old
+# fi-preservation- prefix and the namespaces of the KDK specifications
+UNSUPPORTED = [b'KDKPreservationPlan',
+               b'marc=finmarc',
+               b'fi-preservation-no-file-format-validation',
+               b'http://www.kdk.fi/standards/textmd',
+               b'http://www.kdk.fi/standards/mets/kdk-extensions']
+
+DECLARATION = b"<?xml version='1.0' encoding='UTF-8'?>\n"
+
+
+class FastPathNotApplicable(Exception):
+    """Raised when the METS document can not be migrated by patching its
+    start tags.
+    """
+
+
+class StartTagPatch:
+    """Migration of a METS document by patching the start tags of the
+    METS root and the first metsHdr element.
+    """
+
+    def __init__(self, filepath: str, objid: str, chunks: list):
+        """Initialize the patch.
+
+        :param filepath: Path to the METS document
+        :param objid: OBJID of the METS document
+        :param chunks: List of byte strings and (start, end) ranges of
+                       the METS document, which make up the migrated
+                       document
+        """
+        self.filepath = filepath
+        self.objid = objid
+        self.chunks = chunks
+
+    def write(self, outfile) -> None:
+        """Writes the migrated METS document. The unchanged ranges are
+        copied with os.sendfile when both files support it.
+
+        :param outfile: Binary file object
+        """
+        with open(self.filepath, 'rb') as infile:
+            for chunk in self.chunks:
+                if isinstance(chunk, bytes):
+                    outfile.write(chunk)
+                else:
+                    _copy_range(infile, outfile, *chunk)
+
+
+def prepare(filepath: str,
+            to_catalog: str,
+            contract: str | None = None,
+            context: MigrationContext | None = None) -> StartTagPatch:
+    """Pre-scans the METS document and prepares the patch of its start
+    tags. Nothing is written before the patch is known to apply.
+
+    :param filepath: Path to the METS document
+    :param to_catalog: The intended catalog version of the METS document
+    :param contract: The CONTRACTID of the METS document
+    :param context: Migration context, a new one is created if not
+                    given
+
+    :raises FastPathNotApplicable: If the document can not be migrated
+                                   by patching
+    :returns: The patch
+    """
+    context = context or MigrationContext()
+    if to_catalog != '1.7':
+        raise FastPathNotApplicable(
+            f"Catalog version {to_catalog} is not supported.")
+    if os.path.getsize(filepath) == 0:
+        raise FastPathNotApplicable("The file is empty.")
+
+    with open(filepath, 'rb') as infile, \
+            mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return _prepare(filepath, data, to_catalog, contract, context)
+
+
+def _prepare(filepath, data, to_catalog, contract, context):
+    """Pre-scans the mapped METS document, see prepare."""
+    prolog = PROLOG.match(data)
+    if prolog.group(1):
+        encoding = ENCODING.search(prolog.group(1))
+        if encoding and encoding.group(1).lower() not in (b'utf-8',
+                                                          b'utf8'):
+            raise FastPathNotApplicable("The document is not UTF-8.")
+
+    root_tag = START_TAG.match(data, prolog.end())
+    if not root_tag or root_tag.group(3):
+        raise FastPathNotApplicable("The METS root was not found after "
+                                    "the XML declaration.")
+    root = _parse_tag(root_tag, b'')
+
+    full_cur_catalog = xpaths.CATALOG_VERSION(root)[0]
+    if full_cur_catalog[:3] != '1.7':
+        raise FastPathNotApplicable(
+            f"Catalog version {full_cur_catalog} is not supported.")
+
+    for marker in UNSUPPORTED:
+        if data.find(marker) != -1:
+            raise FastPathNotApplicable(f"The document contains {marker}.")
+    if has_old_no_validation_key(full_cur_catalog) and \
+            data.find(b'no-file-format-validation') != -1:
+        raise FastPathNotApplicable(
+            "The document contains no-file-format-validation.")
+
+    hdr_start = WHITESPACE.match(data, root_tag.end()).end()
+    hdr_tag = START_TAG.match(data, hdr_start)
+    if not hdr_tag:
+        raise FastPathNotApplicable(
+            "The metsHdr is not the first child of the METS root.")
+    hdr = _parse_tag(hdr_tag, root_tag.group(2))
+    if hdr.tag != '{%s}metsHdr' % NAMESPACES['mets']:
+        raise FastPathNotApplicable(
+            "The metsHdr is not the first child of the METS root.")
+
+    root_end = data.rfind(b'<')
+    if not re.match(rb'</%s\s*>\s*$' % re.escape(root_tag.group(1)),
+                    data[root_end:]):
+        raise FastPathNotApplicable(
+            "The document has content after the METS root.")
+
+    if 'OBJID' not in root.attrib:
+        raise FastPathNotApplicable("The METS root has no OBJID.")
+    if contract is None and '{%s}CONTRACTID' % get_fi_ns(
+            full_cur_catalog[:3]) not in root.attrib:
+        raise FastPathNotApplicable("The METS root has no CONTRACTID.")
+
+    original = dict(root.attrib)
+    update_root_attributes(root, to_catalog, full_cur_catalog, contract,
+                           context=context)
+    changes = [(key, value) for key, value in root.attrib.items()
+               if original.get(key) != value]
+
+    lastmoddate = datetime.datetime.now(datetime.timezone.utc).replace(
+        microsecond=0).isoformat()
+
+    chunks = [DECLARATION,
+              patch_start_tag(root_tag.group(0), root.nsmap, changes,
+                              context.namespaces),
+              (root_tag.end(), hdr_start),
+              patch_start_tag(hdr_tag.group(0), hdr.nsmap,
+                              [('LASTMODDATE', lastmoddate)],
+                              context.namespaces),
+              (hdr_tag.end(), data.find(b'>', root_end) + 1),
+              b'\n']
+    return StartTagPatch(filepath, root.attrib['OBJID'], chunks)
+
+
+def _parse_tag(match: re.Match, declarations: bytes) -> ET._Element:
+    """Parses a start tag into an element without children.
+
+    :param match: Match of START_TAG
+    :param declarations: Attributes of the parent start tag, which
+                         declare the namespaces in scope
+
+    :returns: The element
+    """
+    if b'&' in match.group(0):
+        raise FastPathNotApplicable("The start tag contains references.")
+    name = match.group(1)
+    try:
+        if declarations:
+            parent = ET.fromstring(b'<parent%s><%s%s/></parent>' % (
+                declarations, name, match.group(2)))
+            return parent[0]
+        return ET.fromstring(b'<%s%s/>' % (name, match.group(2)))
+    except ET.XMLSyntaxError as error:
+        raise FastPathNotApplicable(
+            f"The start tag can not be parsed: {error}") from error
+
+
+def patch_start_tag(tag: bytes,
+                    nsmap: dict,
+                    changes: list[tuple[str, str]],
+                    namespaces: dict) -> bytes:
+    """Sets attributes in a start tag, leaving the rest of the tag as it
+    is. Attributes in a namespace use a prefix declared in scope, or a
+    declaration of the prefix in `namespaces` is added to the tag.
+
+    :param tag: The start tag
+    :param nsmap: Namespaces in scope of the element
+    :param changes: List of (attribute name, value) tuples, where the
+                    name is in the {namespace}name form for namespaced
+                    attributes
+    :param namespaces: Prefixes for the namespaces that are not in scope
+
+    :raises FastPathNotApplicable: If a prefix for the namespace of an
+                                   attribute is not available
+    :returns: The patched start tag
+    """
+    for key, value in changes:
+        qname = ET.QName(key)
+        name = qname.localname
+        if qname.namespace:
+            prefixes = [prefix for prefix, uri in nsmap.items()
+                        if uri == qname.namespace and prefix]
+            if prefixes:
+                prefix = prefixes[0]
+            else:
+                prefix = [prefix for prefix, uri in namespaces.items()
+                          if uri == qname.namespace][0]
+                if prefix in nsmap:
+                    raise FastPathNotApplicable(
+                        f"The prefix {prefix} is already in use.")
+                tag = _set_attribute(tag, f'xmlns:{prefix}', qname.namespace)
+                nsmap = dict(nsmap, **{prefix: qname.namespace})
+            name = f'{prefix}:{name}'
+        tag = _set_attribute(tag, name, value)
+    return tag
+
+
+def _set_attribute(tag: bytes, name: str, value: str) -> bytes:
+    """Replaces the value of an attribute in a start tag, or appends the
+    attribute to the tag.
+
+    :param tag: The start tag
+    :param name: Qualified name of the attribute
+    :param value: New value of the attribute
+
+    :returns: The patched start tag
+    """
+    quoted = b'"%s"' % escape(value, {'"': '&quot;', '\n': '&#10;',
+                                      '\r': '&#13;', '\t': '&#9;'}
+                              ).encode('utf-8')
+    pattern = re.compile(rb'(\s%s\s*=\s*)("[^"]*"|\'[^\']*\')' %
+                         re.escape(name.encode('utf-8')))
+    if pattern.search(tag):
+        return pattern.sub(lambda match: match.group(1) + quoted, tag,
+                           count=1)
+    end = re.search(rb'\s*/?>$', tag).start()
+    return b'%s %s=%s%s' % (tag[:end], name.encode('utf-8'), quoted,
+                            tag[end:])
+
+
+def _copy_range(infile, outfile, start: int, end: int) -> None:
+    """Copies a byte range of the input file to the output file.
+
+    :param infile: Binary file object opened for reading
+    :param outfile: Binary file object
+    :param start: Start offset of the range
+    :param end: End offset of the range
+    """
+    # Only plain files: the fileno of a compressing file object, such as
+    # a GzipFile, is that of the compressed file underneath
+    infd = outfd = None
+    if isinstance(outfile, (io.FileIO, io.BufferedWriter,
+                            io.BufferedRandom)):
+        try:
+            infd = infile.fileno()
+            outfd = outfile.fileno()
+        except (AttributeError, OSError, ValueError):
+            infd = outfd = None
+
+    if infd is not None and hasattr(os, 'sendfile'):
+        outfile.flush()
+        offset = start
+        while offset < end:
+            sent = os.sendfile(outfd, infd, offset, end - offset)
+            if sent == 0:
+                break
+            offset += sent
+        if offset == end:
+            return
+        start = offset
+
+    infile.seek(start)
+    shutil.copyfileobj(_LimitedReader(infile, end - start), outfile)
+
+
+class _LimitedReader:
+    """Reads at most `size` bytes from a file object."""
+
+    def __init__(self, infile, size: int):
+        """Initialize the reader.
+
+        :param infile: Binary file object
+        :param size: Number of bytes to read
+        """
+        self.infile = infile
+        self.size = size
+
+    def read(self, size: int = -1) -> bytes:
+        """Reads the next block.
+
+        :param size: Maximum number of bytes to read
+        """
+        if size < 0 or size > self.size:
+            size = self.size
+        data = self.infile.read(size)
+        self.size -= len(data)
+        return data
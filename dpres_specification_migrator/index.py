@@ -0,0 +1,62 @@
+"""Index of the administrative metadata references in the METS
+fileSec.
+"""
+
+from __future__ import annotations
+
+import lxml.etree as ET
+from dpres_specification_migrator import xpaths
+
+
+class AdmidIndex:
+    """Maps metadata IDs, such as techMD IDs, to the mets:file elements
+    that list them in their ADMID attribute. The index is built in one
+    pass over the fileSec and ADMID values are matched as whole tokens,
+    so looking up the files of a metadata block does not scan the whole
+    fileSec again.
+
+    Steps that change ADMID attributes must do it with `add_admid` to
+    keep the index up to date.
+    """
+
+    def __init__(self, root: ET._Element):
+        """Builds the index.
+
+        :param root: The mets root as xml
+        """
+        self.root = root
+        self._files = {}
+        for mets_file in xpaths.FILES(root):
+            for admid in (mets_file.get('ADMID') or '').split():
+                self._add(admid, mets_file)
+
+    def _add(self, admid: str, mets_file: ET._Element) -> None:
+        """Adds a file to the index of an ID, once.
+
+        :param admid: Metadata ID
+        :param mets_file: mets:file element
+        """
+        files = self._files.setdefault(admid, [])
+        if not files or files[-1] is not mets_file:
+            files.append(mets_file)
+
+    def files(self, admid: str) -> tuple:
+        """Returns the files referring to the given metadata ID.
+
+        :param admid: Metadata ID
+
+        :returns: Tuple of mets:file elements in document order
+        """
+        return tuple(self._files.get(admid, ()))
+
+    def add_admid(self, mets_file: ET._Element, admid: str) -> None:
+        """Appends a metadata ID to the ADMID attribute of a file.
+
+        :param mets_file: mets:file element
+        :param admid: Metadata ID to append
+        """
+        if mets_file.get('ADMID'):
+            mets_file.set('ADMID', mets_file.get('ADMID') + ' ' + admid)
+        else:
+            mets_file.set('ADMID', admid)
+        self._add(admid, mets_file)
@@ -0,0 +1,303 @@
+"""Inventory of a corpus of METS documents before a migration campaign.
+Only the start tags of the METS root and the metsHdr element of each
+document are parsed, which is enough to tell the catalog version of the
+document and the migration steps it would get.
+
+Run as ``transform-mets inventory [input ...] [options]``.
+"""
+
+from __future__ import annotations
+import argparse
+import csv
+import json
+import sys
+
+import lxml.etree as ET
+from dpres_specification_migrator import xpaths
+from dpres_specification_migrator.batch import (collect_inputs,
+                                                positive_int, run_tasks)
+from dpres_specification_migrator.dicts import (NAMESPACES,
+                                                RECORD_STATUS_TYPES, VERSIONS)
+from dpres_specification_migrator.plan import get_plan, is_kdk_profile
+from dpres_specification_migrator.transform_mets import (MigrationError,
+                                                         check_versions,
+                                                         get_fi_ns)
+
+METSHDR = '{%s}metsHdr' % NAMESPACES['mets']
+
+# Amount of data fed to the parser at a time. The start tags are usually
+# within the first few kilobytes, and parsing a larger block than needed
+# is the largest cost of reading the header.
+BLOCK_SIZE = 1024
+
+# Columns of the CSV report and keys of the file entries of the JSON
+# report
+FIELDS = ['filepath', 'version', 'profile', 'objid', 'contractid',
+          'record_status', 'status', 'steps', 'message']
+
+
+class InventoryRecord:
+    """Catalog version and migration steps of a single METS document."""
+
+    def __init__(self,
+                 filepath: str,
+                 version: str | None = None,
+                 profile: str | None = None,
+                 objid: str | None = None,
+                 contractid: bool = False,
+                 record_status: str | None = None,
+                 status: str = 'ok',
+                 steps: list | None = None,
+                 message: str | None = None):
+        """Initialize the record.
+
+        :param filepath: Path to the METS document
+        :param version: Full catalog version of the METS document
+        :param profile: PROFILE of the METS document
+        :param objid: OBJID of the METS document
+        :param contractid: True if the METS document has a CONTRACTID
+        :param record_status: RECORDSTATUS of the metsHdr element
+        :param status: 'ok', or 'failed' if the document can not be
+                       migrated with the given options
+        :param steps: Names of the migration steps the document would
+                      get, see plan.MigrationPlan
+        :param message: Error message if the status is 'failed'
+        """
+        self.filepath = filepath
+        self.version = version
+        self.profile = profile
+        self.objid = objid
+        self.contractid = contractid
+        self.record_status = record_status
+        self.status = status
+        self.steps = steps or []
+        self.message = message
+
+    def as_dict(self) -> dict:
+        """Returns the record as a dict with the keys in FIELDS."""
+        return {field: getattr(self, field) for field in FIELDS}
+
+
+class Counts:
+    """Per-version, per-step and per-status document counts."""
+
+    def __init__(self):
+        """Initialize the counts."""
+        self.total = 0
+        self.versions = {}
+        self.steps = {}
+        self.statuses = {}
+
+    def add(self, record: InventoryRecord) -> None:
+        """Counts a record.
+
+        :param record: InventoryRecord object
+        """
+        self.total += 1
+        version = record.version or 'unknown'
+        self.versions[version] = self.versions.get(version, 0) + 1
+        for step in record.steps:
+            self.steps[step] = self.steps.get(step, 0) + 1
+        self.statuses[record.status] = self.statuses.get(record.status,
+                                                         0) + 1
+
+    def as_dict(self) -> dict:
+        """Returns the counts as a dict with sorted keys."""
+        return {'total': self.total,
+                'versions': dict(sorted(self.versions.items())),
+                'steps': dict(sorted(self.steps.items())),
+                'statuses': dict(sorted(self.statuses.items()))}
+
+
+def read_header(source) -> tuple[ET._Element, ET._Element | None]:
+    """Reads the METS root and metsHdr start tags. The document is fed
+    to the parser in small blocks, and parsing stops at the start of the
+    second element of the document, so the rest of the file is not
+    read.
+
+    :param source: Path to the METS document or a binary file object
+
+    :returns: Tuple of the METS root and the metsHdr element, or None if
+              the first child of the root is not a metsHdr element. Only
+              the attributes of the elements are available.
+    """
+    if isinstance(source, str):
+        with open(source, 'rb') as infile:
+            return read_header(infile)
+
+    parser = ET.XMLPullParser(events=('start',), resolve_entities=False,
+                              no_network=True)
+    root = None
+    while True:
+        data = source.read(BLOCK_SIZE)
+        if not data:
+            return root, None
+        parser.feed(data)
+        for _, elem in parser.read_events():
+            if root is None:
+                root = elem
+                continue
+            return root, elem if elem.tag == METSHDR else None
+
+
+def inventory_file(filepath: str,
+                   args: argparse.Namespace) -> InventoryRecord:
+    """Classifies a single METS document.
+
+    :param filepath: Path to the METS document
+    :param args: Parsed command line arguments
+
+    :returns: Inventory record of the document
+    """
+    record = InventoryRecord(filepath)
+    try:
+        root, hdr = read_header(filepath)
+        if root is None:
+            raise MigrationError("No METS root element found.")
+        versions = xpaths.CATALOG_VERSION(root)
+        if not versions:
+            raise MigrationError("No catalog version found.")
+        record.version = versions[0]
+        record.profile = root.get('PROFILE')
+        record.objid = root.get('OBJID')
+        if hdr is not None:
+            record.record_status = hdr.get('RECORDSTATUS')
+        if record.version[:3] not in VERSIONS:
+            raise MigrationError(
+                f"Unknown catalog version {record.version}.")
+
+        record.contractid = '{%s}CONTRACTID' % get_fi_ns(
+            record.version[:3]) in root.attrib
+        record.steps = list(get_plan(
+            record.version, args.to_version, args.record_status,
+            is_kdk_profile(record.profile)).steps)
+        check_versions(record.version[:3], args.to_version,
+                       args.contractid)
+    except (MigrationError, OSError, ET.XMLSyntaxError) as error:
+        record.status = 'failed'
+        record.message = str(error)
+    return record
+
+
+def failed_record(task: tuple, error: Exception) -> InventoryRecord:
+    """Returns the record of a document whose task failed with the pool
+    of worker processes, see batch.run_tasks.
+
+    :param task: Arguments of the task, the path to the METS document
+    :param error: The error of the pool
+
+    :returns: Failed inventory record
+    """
+    return InventoryRecord(task[0], status='failed',
+                           message=f"{type(error).__name__}: {error}")
+
+
+def parse_arguments(arguments: list) -> argparse.Namespace:
+    """Create arguments parser and return parsed command line arguments.
+
+    :param arguments: List of arguments
+
+    :returns: Parsed arguments
+    """
+    parser = argparse.ArgumentParser(
+        prog='transform-mets inventory',
+        description='Report the catalog versions of METS documents and '
+        'the migration steps they would get')
+    parser.add_argument('filepath', type=str, nargs='*',
+                        help='Path to METS file, a directory walked '
+                        'recursively for METS files or a glob pattern')
+    parser.add_argument('--manifest', dest='manifest', type=str,
+                        help='File listing one input path per line, '
+                        '"-" reads the list from stdin')
+    parser.add_argument('--jobs', dest='jobs', type=positive_int, default=1,
+                        help='Number of worker processes')
+    parser.add_argument('--pattern', dest='pattern', type=str,
+                        default='mets.xml', help='File name pattern of '
+                        'METS files when walking directories')
+    parser.add_argument('--to_version', dest='to_version', type=str,
+                        default='1.7', choices=sorted(VERSIONS),
+                        help='Catalog version of the planned migration')
+    parser.add_argument('--contractid', dest='contractid', type=str,
+                        help='ContractID of the planned migration')
+    parser.add_argument('--record_status', dest='record_status',
+                        choices=RECORD_STATUS_TYPES, type=str,
+                        help='RECORDSTATUS of the planned migration')
+    parser.add_argument('--format', dest='format', type=str,
+                        choices=['json', 'csv'], default='json',
+                        help='Format of the report')
+    parser.add_argument('--report', dest='report', type=str, default='-',
+                        help='Path of the report, "-" writes it to stdout')
+    return parser.parse_args(arguments)
+
+
+def main(arguments=None):
+    """The main method for the inventory command."""
+    args = parse_arguments(arguments)
+
+    inputs = collect_inputs(args.filepath, manifest=args.manifest,
+                            pattern=args.pattern)
+    if not inputs:
+        print("Error: No METS documents to inventory.", file=sys.stderr)
+        return 117
+
+    records = run_tasks(inventory_file,
+                        [(filepath,) for filepath, _ in inputs], args,
+                        jobs=args.jobs, failed=failed_record)
+    if args.report == '-':
+        counts = write_report(records, sys.stdout, args.format,
+                              args.to_version)
+    else:
+        with open(args.report, 'w', encoding='utf-8', newline='') as outfile:
+            counts = write_report(records, outfile, args.format,
+                                  args.to_version)
+        print_counts(counts)
+    if counts['statuses'].get('failed'):
+        return 117
+    return 0
+
+
+def write_report(records, outfile, report_format: str,
+                 to_version: str) -> dict:
+    """Writes the report as the records arrive, so that the records of
+    a large corpus are not all kept in memory.
+
+    :param records: Iterator of InventoryRecord objects
+    :param outfile: Text file object
+    :param report_format: 'json' or 'csv'
+    :param to_version: The catalog version of the planned migration
+
+    :returns: The counts of the report, see Counts.as_dict
+    """
+    counts = Counts()
+    if report_format == 'csv':
+        writer = csv.DictWriter(outfile, fieldnames=FIELDS)
+        writer.writeheader()
+        for record in records:
+            counts.add(record)
+            row = record.as_dict()
+            row['steps'] = ' '.join(record.steps)
+            writer.writerow(row)
+        return counts.as_dict()
+
+    outfile.write('{"to_version": %s, "files": [' % json.dumps(to_version))
+    for position, record in enumerate(records):
+        counts.add(record)
+        outfile.write(',\n  ' if position else '\n  ')
+        outfile.write(json.dumps(record.as_dict()))
+    summary = counts.as_dict()
+    outfile.write('\n], "counts": %s}\n' % json.dumps(summary, indent=2))
+    return summary
+
+
+def print_counts(counts: dict, file=None) -> None:
+    """Prints the counts of the report.
+
+    :param counts: Counts as returned by write_report
+    :param file: Stream to print to, defaults to stdout
+    """
+    file = file or sys.stdout
+    print(f"Inventory: {counts['total']} METS documents", file=file)
+    for title, label in [('versions', 'version'), ('steps', 'step'),
+                         ('statuses', 'status')]:
+        for key, count in counts[title].items():
+            print(f"{label}\t{key}\t{count}", file=file)
@@ -0,0 +1,165 @@
+"""Journal of batch runs, for resuming an interrupted run. Every migrated
+or failed METS document is appended to the journal as a line of JSON as
+soon as its result arrives, with the size, modification time and SHA-256
+of the input, the migration options, the output path, the OBJID and the
+status.
+
+When a run is resumed, the journal is read into a dictionary keyed by
+the input path, so that an input is checked with a lookup and a stat
+call. An input is skipped if its last entry succeeded with the same
+options and output path, the input has the same size and modification
+time and the output still exists. The last line of a journal of a run
+that was killed can be cut short, and it is ignored.
+"""
+
+from __future__ import annotations
+import argparse
+import hashlib
+import json
+import os
+import time
+
+# Options of a batch run that change the migrated METS documents
+OPTION_NAMES = ('to_version', 'contractid', 'record_status', 'objid')
+
+# Size of the blocks read when hashing an input
+CHUNK_SIZE = 1024 * 1024
+
+
+def migration_options(args: argparse.Namespace) -> dict:
+    """Returns the options of a run that change the migrated documents.
+
+    :param args: Parsed command line arguments
+
+    :returns: Dictionary of the options
+    """
+    return {name: getattr(args, name) for name in OPTION_NAMES}
+
+
+def fingerprint(filepath: str) -> dict:
+    """Returns the size, modification time and SHA-256 of a file. The
+    file is stat'ed before it is read, so that a file modified while it
+    is migrated is migrated again on resume.
+
+    :param filepath: Path to the file
+
+    :returns: Dictionary with 'size', 'mtime' in nanoseconds and
+              'sha256'
+    """
+    stat = os.stat(filepath)
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+            'sha256': digest.hexdigest()}
+
+
+def _key(filepath: str) -> str:
+    """Returns the journal key of an input path."""
+    return os.path.normpath(os.path.abspath(filepath))
+
+
+class Journal:
+    """Append-only journal of the results of batch runs."""
+
+    def __init__(self, path: str):
+        """Initialize the journal and read the existing entries.
+
+        :param path: Path to the journal file, created if it does not
+                     exist
+        """
+        self.path = path
+        self.entries = {}
+        self._partial = False
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as infile:
+                for line in infile:
+                    self._partial = not line.endswith('\n')
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Cut short by a killed run
+                        continue
+                    self.entries[entry['key']] = entry
+        self._file = None
+
+    def finished(self,
+                 filepath: str,
+                 outpath: str,
+                 options: dict) -> dict | None:
+        """Returns the entry of an input that was already migrated.
+
+        :param filepath: Path to the input METS document
+        :param outpath: Path where the migrated document is written
+        :param options: Migration options, see migration_options
+
+        :returns: The last entry of the input if it was migrated to the
+                  same output with the same options and neither the
+                  input nor the output has changed, otherwise None
+        """
+        entry = self.entries.get(_key(filepath))
+        if entry is None or entry['status'] != 'ok' or \
+                entry['options'] != options or \
+                entry['outpath'] != os.path.abspath(outpath):
+            return None
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+        if stat.st_size != entry['size'] or \
+                stat.st_mtime_ns != entry['mtime'] or \
+                not os.path.exists(outpath):
+            return None
+        return entry
+
+    def failed(self, filepath: str) -> bool:
+        """Returns True if the last migration of an input failed.
+
+        :param filepath: Path to the input METS document
+        """
+        entry = self.entries.get(_key(filepath))
+        return entry is not None and entry['status'] == 'failed'
+
+    def record(self, result, options: dict) -> None:
+        """Appends the result of a migration to the journal. The line is
+        flushed at once, so that a killed run loses at most the line
+        being written.
+
+        :param result: batch.FileResult object
+        :param options: Migration options, see migration_options
+        """
+        source = result.fingerprint or {}
+        entry = {'key': _key(result.filepath),
+                 'filepath': result.filepath,
+                 'size': source.get('size'),
+                 'mtime': source.get('mtime'),
+                 'sha256': source.get('sha256'),
+                 'options': options,
+                 'outpath': (os.path.abspath(result.outpath)
+                             if result.outpath else None),
+                 'objid': result.objid,
+                 'status': result.status,
+                 'error': result.error,
+                 'message': result.message,
+                 'time': time.time()}
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+            if self._partial:
+                # End the line cut short, so the entry is not lost in it
+                self._file.write('\n')
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+        self.entries[entry['key']] = entry
+
+    def close(self) -> None:
+        """Closes the journal file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
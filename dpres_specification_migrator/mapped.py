@@ -0,0 +1,89 @@
+"""Memory-mapped input of METS documents. The file is mapped into memory
+and lxml parses the mapping as a buffer, so the pages are read through
+the page cache straight into the parser, without the read calls and
+the user-space buffers of a file object.
+
+Mapped parsing needs an lxml that accepts buffers in fromstring. With an
+older lxml the documents are parsed from the path as before.
+"""
+
+from __future__ import annotations
+import contextlib
+import mmap
+import os
+
+import lxml.etree as ET
+from dpres_specification_migrator import streaming, xpaths
+from dpres_specification_migrator.fastpath import PROLOG, START_TAG
+
+
+def _accepts_buffers() -> bool:
+    """Returns True if lxml parses buffers, such as a memoryview."""
+    try:
+        ET.fromstring(memoryview(b'<mets/>'))
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+SUPPORTED = _accepts_buffers()
+
+
+@contextlib.contextmanager
+def map_file(path: str):
+    """Maps a file into memory read-only.
+
+    :param path: Path to the file
+
+    :returns: mmap object, or empty bytes for an empty file, which can
+              not be mapped
+    """
+    with open(path, 'rb') as infile:
+        if os.fstat(infile.fileno()).st_size == 0:
+            yield b''
+            return
+        with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+
+def parse(path: str) -> ET._ElementTree:
+    """Parses a METS document from a memory mapping of the file. The
+    parsed tree does not refer to the mapping, which is closed before
+    returning.
+
+    :param path: Path to the METS document
+
+    :returns: The parsed document
+    """
+    path = os.fspath(path)
+    parser = ET.XMLParser(huge_tree=True, no_network=True)
+    if not SUPPORTED:
+        return ET.parse(path, parser)
+    with map_file(path) as data:
+        if hasattr(mmap, 'MADV_SEQUENTIAL') and data:
+            # The parser reads the mapping once from start to end
+            data.madvise(mmap.MADV_SEQUENTIAL)
+        return ET.ElementTree(ET.fromstring(data, parser, base_url=path))
+
+
+def read_catalog_version(path: str) -> str | None:
+    """Reads the full catalog version from the METS root start tag of a
+    memory mapping of the file. Only the start tag is parsed. Documents
+    whose root is not right after the XML declaration, e.g. after a
+    comment, are read with streaming.read_catalog_version.
+
+    :param path: Path to the METS document
+
+    :returns: The current full catalog version of the METS document
+    """
+    path = os.fspath(path)
+    with map_file(path) as data:
+        root_tag = START_TAG.match(data, PROLOG.match(data).end())
+        if root_tag:
+            try:
+                root = ET.fromstring(b'<%s%s/>' % root_tag.group(1, 2))
+            except ET.XMLSyntaxError:
+                root = None
+            if root is not None and xpaths.CATALOG_VERSION(root):
+                return xpaths.CATALOG_VERSION(root)[0]
+    return streaming.read_catalog_version(path)
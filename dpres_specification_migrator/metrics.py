@@ -0,0 +1,298 @@
+"""Operational metrics of batch runs and of the migration service in the
+Prometheus text exposition format. The metrics are kept in memory and
+either written to a file for the textfile collector of the Prometheus
+node exporter, or served on a local HTTP endpoint.
+
+Metrics:
+
+``transform_mets_documents_total{version, status}``
+    Migrated and failed METS documents per full catalog version. The
+    versions not in KNOWN_VERSIONS are counted as ``unknown``.
+``transform_mets_failures_total{error}``
+    Failures per error class, e.g. ContractIdRequiredError.
+``transform_mets_bytes_read_total``, ``transform_mets_bytes_written_total``
+    Sizes of the input and output documents.
+``transform_mets_document_duration_seconds``
+    Histogram of the wall-clock time of a migration.
+``transform_mets_step_duration_seconds{step}``
+    Histogram of the wall-clock time of each migration step, see the
+    profiling module.
+``transform_mets_documents_per_second``
+    Documents per second since the start of the run or service.
+"""
+
+from __future__ import annotations
+import bisect
+import http.server
+import os
+import threading
+import time
+
+from dpres_specification_migrator.dicts import (
+    FI_NAMESPACE_VERSIONS, OLD_NO_VALIDATION_KEY_VERSIONS, VERSIONS)
+from dpres_specification_migrator.writer import AtomicWriter
+
+PREFIX = 'transform_mets'
+
+# Upper bounds of the histogram buckets in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+           10.0, 30.0, 60.0, 300.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Catalog versions used as values of the version label. The version is
+# read from the document, so any other value is counted as 'unknown' to
+# keep the number of series bounded.
+KNOWN_VERSIONS = frozenset(
+    list(VERSIONS) +
+    [rules[name] for rules in VERSIONS.values()
+     for name in ('catalog_version', 'newest_specification')] +
+    OLD_NO_VALIDATION_KEY_VERSIONS + FI_NAMESPACE_VERSIONS)
+
+
+class Histogram:
+    """Prometheus histogram with fixed buckets."""
+
+    def __init__(self, buckets: tuple = BUCKETS):
+        """Initialize the histogram.
+
+        :param buckets: Upper bounds of the buckets in ascending order
+        """
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """Counts a value.
+
+        :param value: The observed value
+        """
+        position = bisect.bisect_left(self.buckets, value)
+        if position < len(self.buckets):
+            self.counts[position] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name: str, labels: dict) -> list:
+        """Returns the sample lines of the histogram.
+
+        :param name: Name of the metric
+        :param labels: Labels of the histogram
+
+        :returns: List of lines
+        """
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(_sample(f'{name}_bucket',
+                                 dict(labels, le=repr(bound)), cumulative))
+        lines.append(_sample(f'{name}_bucket', dict(labels, le='+Inf'),
+                             self.count))
+        lines.append(_sample(f'{name}_sum', labels, self.sum))
+        lines.append(_sample(f'{name}_count', labels, self.count))
+        return lines
+
+
+class Metrics:
+    """Counters and histograms of the migrations of a run or a service.
+    Observations can come from several threads.
+    """
+
+    def __init__(self):
+        """Initialize the metrics."""
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.documents = {}
+        self.failures = {}
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.durations = Histogram()
+        self.steps = {}
+
+    def observe(self,
+                status: str,
+                elapsed: float,
+                version: str | None = None,
+                error: str | None = None,
+                bytes_read: int = 0,
+                bytes_written: int = 0,
+                profile: dict | None = None) -> None:
+        """Counts a migrated or failed METS document.
+
+        :param status: 'ok' or 'failed'
+        :param elapsed: Wall-clock time of the migration in seconds
+        :param version: Full catalog version of the document, if known,
+                        see KNOWN_VERSIONS
+        :param error: Class name of the error if the migration failed
+        :param bytes_read: Size of the input document
+        :param bytes_written: Size of the output document
+        :param profile: Profile of the migration with the step times,
+                        see profiling.Profiler.as_dict
+        """
+        key = (version if version in KNOWN_VERSIONS else 'unknown', status)
+        with self.lock:
+            self.documents[key] = self.documents.get(key, 0) + 1
+            if error:
+                self.failures[error] = self.failures.get(error, 0) + 1
+            self.bytes_read += bytes_read
+            self.bytes_written += bytes_written
+            self.durations.observe(elapsed)
+            for entry in (profile or {}).get('spans', []):
+                if entry['name'] not in self.steps:
+                    self.steps[entry['name']] = Histogram()
+                self.steps[entry['name']].observe(entry['seconds'])
+
+    def observe_failure(self, error: str) -> None:
+        """Counts a failure of the whole run, e.g. no inputs.
+
+        :param error: Class name of the error
+        """
+        with self.lock:
+            self.failures[error] = self.failures.get(error, 0) + 1
+
+    def observe_result(self, result) -> None:
+        """Counts the outcome of a batch migration.
+
+        :param result: batch.FileResult object
+        """
+        self.observe(result.status, result.elapsed,
+                     version=result.plan[0] if result.plan else None,
+                     error=result.error,
+                     bytes_read=_size(result.filepath),
+                     bytes_written=_written(result),
+                     profile=result.profile)
+
+    def render(self) -> str:
+        """Returns the metrics in the Prometheus text format."""
+        with self.lock:
+            total = sum(self.documents.values())
+            uptime = max(time.time() - self.started, 1e-9)
+            lines = _header('documents_total', 'counter',
+                            'METS documents by catalog version and status')
+            lines += [_sample(f'{PREFIX}_documents_total',
+                              {'version': version, 'status': status}, count)
+                      for (version, status), count
+                      in sorted(self.documents.items())]
+            lines += _header('failures_total', 'counter',
+                             'Failures by error class')
+            lines += [_sample(f'{PREFIX}_failures_total', {'error': error},
+                              count)
+                      for error, count in sorted(self.failures.items())]
+            lines += _header('bytes_read_total', 'counter',
+                             'Bytes of input METS documents')
+            lines.append(_sample(f'{PREFIX}_bytes_read_total', {},
+                                 self.bytes_read))
+            lines += _header('bytes_written_total', 'counter',
+                             'Bytes of migrated METS documents')
+            lines.append(_sample(f'{PREFIX}_bytes_written_total', {},
+                                 self.bytes_written))
+            lines += _header('document_duration_seconds', 'histogram',
+                             'Wall-clock time of a migration')
+            lines += self.durations.lines(
+                f'{PREFIX}_document_duration_seconds', {})
+            lines += _header('step_duration_seconds', 'histogram',
+                             'Wall-clock time of a migration step')
+            for step, histogram in sorted(self.steps.items()):
+                lines += histogram.lines(f'{PREFIX}_step_duration_seconds',
+                                         {'step': step})
+            lines += _header('documents_per_second', 'gauge',
+                             'METS documents per second since the start')
+            lines.append(_sample(f'{PREFIX}_documents_per_second', {},
+                                 total / uptime))
+            lines += _header('start_time_seconds', 'gauge',
+                             'Start time of the run since the epoch')
+            lines.append(_sample(f'{PREFIX}_start_time_seconds', {},
+                                 self.started))
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self,
+                       path: str,
+                       writer: AtomicWriter | None = None) -> None:
+        """Writes the metrics for the textfile collector. The file is
+        written atomically, so that the collector never reads a partial
+        file.
+
+        :param path: Path of the .prom file
+        :param writer: Writer with the durability of the run, a writer
+                       without fsync is used if not given
+        """
+        (writer or AtomicWriter()).write_file(
+            path, self.render().encode('utf-8'))
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """Serves GET /metrics."""
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Serves the metrics."""
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Does not log the scrapes."""
+
+
+def serve_metrics(metrics: Metrics,
+                  port: int,
+                  host: str = '127.0.0.1') -> http.server.HTTPServer:
+    """Serves the metrics on /metrics in a background thread.
+
+    :param metrics: The metrics to serve
+    :param port: TCP port, 0 picks a free port
+    :param host: Address to listen on
+
+    :returns: The server, stopped with shutdown()
+    """
+    server = http.server.ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    server.metrics = metrics
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _header(name: str, metric_type: str, description: str) -> list:
+    """Returns the HELP and TYPE lines of a metric."""
+    return [f'# HELP {PREFIX}_{name} {description}.',
+            f'# TYPE {PREFIX}_{name} {metric_type}']
+
+
+def _sample(name: str, labels: dict, value) -> str:
+    """Returns a sample line."""
+    if not labels:
+        return f'{name} {value}'
+    escaped = ','.join(
+        '{}="{}"'.format(key, str(label).replace('\\', '\\\\').replace(
+            '"', '\\"').replace('\n', '\\n'))
+        for key, label in labels.items())
+    return f'{name}{{{escaped}}} {value}'
+
+
+def _written(result) -> int:
+    """Returns the number of bytes written for a batch result. The
+    size of the output file is used for the results that did not count
+    the bytes, e.g. those skipped as migrated in an earlier run.
+
+    :param result: batch.FileResult object
+    """
+    if not result.ok:
+        return 0
+    if result.bytes_written is not None:
+        return result.bytes_written
+    return _size(result.outpath) if result.outpath != '-' else 0
+
+
+def _size(path: str | None) -> int:
+    """Returns the size of a file, or 0 if it can not be read."""
+    try:
+        return os.path.getsize(path) if path else 0
+    except OSError:
+        return 0
@@ -0,0 +1,154 @@
+"""Migration plans. The steps a METS document gets in a migration depend
+only on its full catalog version, the intended catalog version, the
+record status and whether it has the PROFILE of the KDK specifications.
+A plan is built once for each combination of these and shared by all
+documents with the same combination.
+"""
+
+from __future__ import annotations
+import functools
+import sys
+
+from dpres_specification_migrator.dicts import (
+    KDK_PROFILE, OLD_NO_VALIDATION_KEY_VERSIONS, VERSIONS)
+
+
+class MigrationPlan:
+    """The version rules of a migration, resolved from VERSIONS, and the
+    steps of transform_mets.migrate_mets and transform_to_dip that apply.
+    """
+
+    def __init__(self,
+                 full_cur_catalog: str,
+                 to_catalog: str,
+                 record_status: str | None = None,
+                 kdk_profile: bool = False):
+        """Initialize the plan.
+
+        :param full_cur_catalog: The current full catalog version of the
+                                 METS documents
+        :param to_catalog: The intended catalog version of the METS
+                           documents
+        :param record_status: The intended RECORDSTATUS, 'dissemination'
+                              creates a dissemination information package
+        :param kdk_profile: True if the METS documents have the PROFILE of
+                            the KDK specifications
+        """
+        self.full_cur_catalog = full_cur_catalog
+        self.to_catalog = to_catalog
+        self.record_status = record_status
+        self.kdk_profile = kdk_profile
+        self.cur_catalog = full_cur_catalog[:3]
+
+        cur_version = VERSIONS[self.cur_catalog]
+        to_version = VERSIONS[to_catalog]
+        self.fix_old = cur_version['fix_old']
+        self.from_kdk = cur_version['KDK']
+        self.to_kdk = to_version['KDK']
+        self.catalog_version = to_version['catalog_version']
+        self.newest_specification = to_version['newest_specification']
+        self.old_no_validation_key = (
+            self.from_kdk or
+            full_cur_catalog in OLD_NO_VALIDATION_KEY_VERSIONS)
+        self.dissemination = record_status == 'dissemination'
+        self.steps = self._steps()
+
+    @property
+    def key(self) -> tuple[str, str, str | None, bool]:
+        """The arguments the plan was built from, see get_plan."""
+        return (self.full_cur_catalog, self.to_catalog, self.record_status,
+                self.kdk_profile)
+
+    @property
+    def name(self) -> str:
+        """A short name of the plan, without the steps."""
+        record_status = self.record_status or 'unchanged'
+        profile = ', KDK profile' if self.kdk_profile else ''
+        return (f"{self.full_cur_catalog} -> {self.to_catalog} "
+                f"(record status: {record_status}{profile})")
+
+    def _steps(self) -> tuple[str, ...]:
+        """Returns the names of the steps that apply, in the order they
+        are run.
+        """
+        steps = []
+        if self.fix_old:
+            steps.append('fix_1_4_mets')
+        if self.kdk_profile and not self.to_kdk:
+            steps.append('update_profile')
+        steps.append('update_root_attributes')
+        if not self.to_kdk:
+            steps.append('set_contractid')
+        steps.append('set_lastmoddate')
+        if not self.to_kdk:
+            steps.append('set_mdtype')
+        if self.old_no_validation_key:
+            steps.append('update_no_file_format_validation_key')
+        steps.append('fix_preservation_prefix')
+        if self.dissemination:
+            steps.append('transform_to_dip')
+        return tuple(steps)
+
+    def describe(self) -> str:
+        """Returns a description of the plan for audit output."""
+        return f"{self.name}: {', '.join(self.steps)}"
+
+
+@functools.lru_cache(maxsize=None)
+def get_plan(full_cur_catalog: str,
+             to_catalog: str,
+             record_status: str | None = None,
+             kdk_profile: bool = False) -> MigrationPlan:
+    """Returns the migration plan for the versions. Plans are built once
+    per process and shared, so they must not be modified.
+
+    :param full_cur_catalog: The current full catalog version of the
+                             METS document
+    :param to_catalog: The intended catalog version of the METS document
+    :param record_status: The intended RECORDSTATUS
+    :param kdk_profile: True if the METS document has the PROFILE of the
+                        KDK specifications, see is_kdk_profile
+
+    :returns: The migration plan
+    """
+    return MigrationPlan(full_cur_catalog, to_catalog, record_status,
+                         kdk_profile)
+
+
+def is_kdk_profile(profile: str | None) -> bool:
+    """Tells whether a PROFILE is the one of the KDK specifications.
+
+    :param profile: PROFILE of the METS document, or None
+
+    :returns: True for the KDK profile
+    """
+    return profile == KDK_PROFILE
+
+
+def plan_counts(results: list) -> dict:
+    """Counts the documents of a run migrated with each plan.
+
+    :param results: List of FileResult objects
+
+    :returns: Dictionary of plan keys and counts, in the order the plans
+              first occur in the results
+    """
+    counts = {}
+    for result in results:
+        if result.plan is not None:
+            key = tuple(result.plan)
+            counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def print_plans(results: list, file=None) -> None:
+    """Prints the migration plans of a run with the number of documents
+    migrated with each plan.
+
+    :param results: List of FileResult objects
+    :param file: Stream to print to, defaults to stdout
+    """
+    file = file or sys.stdout
+    for key, count in plan_counts(results).items():
+        print(f"Plan: {get_plan(*key).describe()} [{count} METS "
+              "documents]", file=file)
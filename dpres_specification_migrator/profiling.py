@@ -0,0 +1,201 @@
+"""Instrumentation of the migration steps. The steps of migrate_mets,
+fix_1_4_mets and transform_to_dip run in named spans, which a Profiler
+set to the migration context records. Without a profiler every span is
+the same shared no-op context manager, so the instrumentation costs a
+few attribute lookups per step.
+
+A Profiler records the wall-clock time and the number of calls of each
+span, keyed by the names of the enclosing spans, e.g.
+``migrate_mets/fix_1_4_mets/move_mix``. It can also run cProfile or
+tracemalloc for the duration of the migration. Both hook into the whole
+interpreter, so a profiler with details runs only one at a time in a
+process: starting another one, e.g. from a second thread sharing a
+Migrator, raises ProfilerBusyError. The spans have no such limit.
+"""
+
+from __future__ import annotations
+import contextlib
+import cProfile
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+
+import lxml.etree as ET
+
+# Details a Profiler can capture in addition to the spans
+DETAILS = ['cprofile', 'memory']
+
+# Number of functions and allocation sites listed in the details
+TOP = 25
+
+NULL_SPAN = contextlib.nullcontext()
+
+# Held by the Profiler capturing details, see Profiler.start
+_DETAIL_LOCK = threading.Lock()
+
+
+class ProfilerBusyError(RuntimeError):
+    """Raised when a profiler with details is started while another
+    one is running.
+    """
+
+
+def span(context, name: str):
+    """Returns a context manager for a named step of a migration.
+
+    :param context: Migration context or None
+    :param name: Name of the step
+
+    :returns: Context manager recording the step if the context has a
+              profiler, otherwise a no-op context manager
+    """
+    profiler = getattr(context, 'profiler', None)
+    if profiler is None:
+        return NULL_SPAN
+    return profiler.span(name)
+
+
+class Profiler:
+    """Records the spans of a single migration."""
+
+    def __init__(self, detail: str | None = None, callback=None):
+        """Initialize the profiler.
+
+        :param detail: 'cprofile' to run cProfile or 'memory' to trace
+                       the Python memory allocations between start and
+                       stop, see DETAILS
+        :param callback: Function called with the name and the
+                         wall-clock time in seconds at the end of every
+                         span
+        """
+        if detail not in [None] + DETAILS:
+            raise ValueError(f"Unknown profiling detail {detail}.")
+        self.detail = detail
+        self.callback = callback
+        self.spans = {}
+        self.counts = {}
+        self._names = []
+        self._cprofile = None
+        self._tracing = False
+        self._locked = False
+        self._details = {}
+
+    @contextlib.contextmanager
+    def span(self, name: str):
+        """Records the time of a step.
+
+        :param name: Name of the step
+        """
+        self._names.append(name)
+        path = '/'.join(self._names)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._names.pop()
+            calls, seconds = self.spans.get(path, (0, 0.0))
+            self.spans[path] = (calls + 1, seconds + elapsed)
+            if self.callback is not None:
+                self.callback(path, elapsed)
+
+    def count_elements(self, root: ET._Element) -> None:
+        """Records the number of elements of the METS document.
+
+        :param root: The METS root element
+        """
+        self.counts['elements'] = sum(1 for _ in root.iter(ET.Element))
+
+    def start(self) -> None:
+        """Starts capturing the details.
+
+        :raises ProfilerBusyError: If another profiler is capturing
+                                   details in this process
+        :raises ValueError: If cProfile can not be enabled, e.g. since
+                            another profiling tool is active
+        """
+        if self.detail is None:
+            return
+        if not _DETAIL_LOCK.acquire(blocking=False):
+            raise ProfilerBusyError(
+                f"Can not capture {self.detail} details, another profiler "
+                "with details is running.")
+        self._locked = True
+        try:
+            if self.detail == 'cprofile':
+                profile = cProfile.Profile()
+                profile.enable()
+                self._cprofile = profile
+            elif self.detail == 'memory' and not tracemalloc.is_tracing():
+                # Memory is traced for the whole process, so the
+                # allocations can be told apart only if the tracing is
+                # not already on
+                tracemalloc.start()
+                self._tracing = True
+        except BaseException:
+            # E.g. another profiling tool is active in the thread
+            self._locked = False
+            _DETAIL_LOCK.release()
+            raise
+
+    def stop(self) -> None:
+        """Stops capturing the details and summarizes them."""
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            stats = pstats.Stats(self._cprofile).sort_stats('cumulative')
+            self._details['cprofile'] = [
+                {'function': f"{path}:{line}({function})",
+                 'calls': calls, 'total': total, 'cumulative': cumulative}
+                for (path, line, function), (_, calls, total, cumulative, _)
+                in sorted(stats.stats.items(),
+                          key=lambda item: item[1][3], reverse=True)[:TOP]]
+            self._cprofile = None
+        elif self._tracing:
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            self._tracing = False
+            self._details['memory'] = {
+                'peak': peak,
+                'top': [{'location': str(stat.traceback), 'size': stat.size,
+                         'count': stat.count}
+                        for stat in snapshot.statistics('lineno')[:TOP]]}
+        if self._locked:
+            self._locked = False
+            _DETAIL_LOCK.release()
+
+    def as_dict(self) -> dict:
+        """Returns the recorded spans, counts and details."""
+        profile = {'spans': [{'name': name, 'calls': calls,
+                              'seconds': seconds}
+                             for name, (calls, seconds)
+                             in self.spans.items()],
+                   'counts': dict(self.counts)}
+        profile.update(self._details)
+        return profile
+
+
+def write_profile(results: list, outfile) -> None:
+    """Writes the profiles of a run as JSON, with the spans summed over
+    all METS documents.
+
+    :param results: List of batch.FileResult objects
+    :param outfile: Text file object
+    """
+    totals = {}
+    documents = []
+    for result in results:
+        documents.append({'filepath': result.filepath,
+                          'status': result.status,
+                          'elapsed': result.elapsed,
+                          'profile': result.profile})
+        for entry in (result.profile or {}).get('spans', []):
+            calls, seconds = totals.get(entry['name'], (0, 0.0))
+            totals[entry['name']] = (calls + entry['calls'],
+                                     seconds + entry['seconds'])
+    json.dump({'spans': [{'name': name, 'calls': calls, 'seconds': seconds}
+                         for name, (calls, seconds) in totals.items()],
+               'documents': documents}, outfile, indent=2)
+    outfile.write('\n')
@@ -0,0 +1,71 @@
+"""Output stream that replaces namespace declarations in serialized
+METS data on the fly, see transform_mets.namespace_replacements.
+"""
+
+from __future__ import annotations
+
+
+class NamespaceRewriter:
+    """Writable file-like wrapper that replaces byte strings in the data
+    written through it. The data is buffered in blocks, and the end of a
+    block that could be the start of a replaced string is held back
+    until the next write, so that replacements are also made across
+    write boundaries. The output is identical to replacing the strings
+    in the whole serialized document.
+    """
+
+    def __init__(self,
+                 outfile,
+                 replacements: list[tuple[bytes, bytes]],
+                 block_size: int = 65536):
+        """Initialize the rewriter.
+
+        :param outfile: Binary file-like object to write to
+        :param replacements: List of (old, new) byte strings
+        :param block_size: Amount of data buffered before the
+                           replacements are made
+        """
+        self.outfile = outfile
+        self.replacements = replacements
+        self.block_size = block_size
+        self._buffer = bytearray()
+
+    def write(self, data) -> int:
+        """Writes data through the rewriter.
+
+        :param data: Bytes to write
+
+        :returns: Number of bytes accepted
+        """
+        self._buffer += data
+        if len(self._buffer) >= self.block_size:
+            self._process(final=False)
+        return len(data)
+
+    def flush(self) -> None:
+        """Writes out all buffered data. Must be called after the last
+        write.
+        """
+        self._process(final=True)
+        if hasattr(self.outfile, 'flush'):
+            self.outfile.flush()
+
+    def _process(self, final: bool) -> None:
+        """Makes the replacements in the buffer and writes it out.
+
+        :param final: Write out the whole buffer
+        """
+        data = bytes(self._buffer)
+        for old, new in self.replacements:
+            data = data.replace(old, new)
+
+        cut = len(data)
+        if not final:
+            for old, _ in self.replacements:
+                for length in range(min(len(old) - 1, len(data)), 0, -1):
+                    if data.endswith(old[:length]):
+                        cut = min(cut, len(data) - length)
+                        break
+
+        self.outfile.write(data[:cut])
+        self._buffer = bytearray(data[cut:])
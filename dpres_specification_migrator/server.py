@@ -0,0 +1,534 @@
+"""Local HTTP service for migrating METS documents. The service keeps a
+pool of worker processes with the modules imported and the migration
+plans built, so that a migration costs no interpreter start-up.
+
+Run as ``transform-mets serve [--port PORT | --socket PATH] [options]``.
+
+Endpoints:
+
+``POST /migrate``
+    Migrates the METS document in the request body and returns the
+    migrated document. The migration options are given as query
+    parameters: ``to_version``, ``contractid``, ``record_status`` and
+    ``objid``. The OBJID, migration plan and warnings are returned in
+    the ``X-Objid``, ``X-Migration-Plan`` and ``X-Migration-Warnings``
+    headers. Characters of these headers outside printable ASCII, e.g.
+    in an OBJID or catalog version read from the document, are
+    percent-encoded. Documents that can not be migrated
+    with the options get a 422 response, malformed documents and options
+    a 400 response, both with a JSON body with the error message. If a
+    worker process dies, the pool is restarted and the request gets a
+    503 response, so that it can be retried.
+
+``GET /health``
+    Returns 200 with a JSON body when the service is up.
+
+``GET /stats``
+    Returns request counts, throughput and latency as JSON.
+
+``GET /metrics``
+    Returns the metrics of the migrations in the Prometheus text format,
+    see the metrics module.
+"""
+
+from __future__ import annotations
+import argparse
+import concurrent.futures
+import http.server
+import json
+import os
+import signal
+import socket
+import stat
+import string
+import sys
+import threading
+import time
+import urllib.parse
+from concurrent.futures.process import BrokenProcessPool
+
+import lxml.etree as ET
+from dpres_specification_migrator.api import Migrator
+from dpres_specification_migrator.batch import positive_int
+from dpres_specification_migrator.dicts import RECORD_STATUS_TYPES, VERSIONS
+from dpres_specification_migrator.metrics import CONTENT_TYPE, Metrics
+from dpres_specification_migrator.plan import get_plan
+from dpres_specification_migrator.transform_mets import MigrationError
+
+# Query parameters of /migrate, passed to Migrator
+OPTIONS = ('to_version', 'contractid', 'record_status', 'objid')
+
+# Default largest accepted request body
+MAX_BODY = 512 * 1024 * 1024
+
+# Characters left as they are in header values, see header_value
+HEADER_SAFE = ''.join(
+    char for char in string.printable
+    if char not in string.whitespace + '%') + ' '
+
+
+class RequestError(Exception):
+    """Raised when a migration request can not be served. Carries the
+    HTTP status of the response.
+    """
+
+    def __init__(self, status: int, message: str, error: str | None = None):
+        """Initialize the error.
+
+        :param status: HTTP status code of the response
+        :param message: Error message
+        :param error: Class name of the underlying error, counted in the
+                      metrics
+        """
+        super().__init__(status, message, error)
+        self.status = status
+        self.message = message
+        self.error = error or type(self).__name__
+
+    def __str__(self):
+        return self.message
+
+
+def header_value(value: str) -> str:
+    """Percent-encodes the characters of a header value outside
+    printable ASCII, so that e.g. a line break in an OBJID or a catalog
+    version of the document can not end the header or inject another
+    one.
+
+    :param value: Header value
+
+    :returns: The header value with only printable ASCII characters
+    """
+    return urllib.parse.quote(value, safe=HEADER_SAFE)
+
+
+def warm_up() -> None:
+    """Initializes a worker process: builds the migration plans of all
+    supported version combinations and runs the parser once, so that the
+    first request of the worker is as fast as the others.
+    """
+    for version in VERSIONS:
+        for to_version, rules in VERSIONS.items():
+            if rules['supported']:
+                for record_status in (None,) + tuple(RECORD_STATUS_TYPES):
+                    for kdk_profile in (False, True):
+                        get_plan(version, to_version, record_status,
+                                 kdk_profile)
+    ET.fromstring(b'<mets/>')
+
+
+def migrate_document(data: bytes, options: dict):
+    """Migrates a METS document in a worker.
+
+    :param data: The METS document
+    :param options: Keyword arguments of Migrator
+
+    :raises RequestError: If the document can not be migrated
+    :returns: api.MigrationResult object
+    """
+    try:
+        # The spans are recorded for the step histograms of the metrics
+        return Migrator(profile=True, **options).migrate(data)
+    except MigrationError as error:
+        raise RequestError(422, str(error), type(error).__name__) from None
+    except ET.XMLSyntaxError as error:
+        raise RequestError(400, f"Invalid METS document: {error}",
+                           type(error).__name__) from None
+
+
+def parse_options(query: str) -> dict:
+    """Parses the migration options of a request.
+
+    :param query: Query string of the request
+
+    :raises RequestError: If the options are invalid
+    :returns: Keyword arguments of Migrator
+    """
+    options = {}
+    for key, value in urllib.parse.parse_qsl(query, keep_blank_values=True):
+        if key not in OPTIONS:
+            raise RequestError(400, f"Unknown option {key}.")
+        if any(ord(char) < 32 or ord(char) == 127 for char in value):
+            raise RequestError(
+                400, f"Control characters in option {key}.")
+        options[key] = value or None
+    if options.get('to_version', '1.7') not in VERSIONS:
+        raise RequestError(
+            400, f"Unknown catalog version {options['to_version']}.")
+    if options.get('record_status') not in (None,) + tuple(
+            RECORD_STATUS_TYPES):
+        raise RequestError(
+            400, f"Unknown record status {options['record_status']}.")
+    return options
+
+
+class ServerStats:
+    """Request counts and timings of the service. Updated from the
+    request handler threads.
+    """
+
+    def __init__(self):
+        """Initialize the statistics."""
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.requests = 0
+        self.migrated = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+
+    def start(self) -> None:
+        """Counts a migration request that has been received."""
+        with self.lock:
+            self.requests += 1
+            self.in_flight += 1
+
+    def finish(self, ok: bool, elapsed: float, bytes_in: int,
+               bytes_out: int) -> None:
+        """Counts a migration request that has been answered.
+
+        :param ok: True if the document was migrated
+        :param elapsed: Wall-clock time of the request in seconds
+        :param bytes_in: Size of the request body
+        :param bytes_out: Size of the response body
+        """
+        with self.lock:
+            self.in_flight -= 1
+            if ok:
+                self.migrated += 1
+            else:
+                self.failed += 1
+            self.seconds += elapsed
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+    def as_dict(self) -> dict:
+        """Returns the statistics with throughput and mean latency."""
+        with self.lock:
+            uptime = time.monotonic() - self.started
+            answered = self.migrated + self.failed
+            return {
+                'uptime': uptime,
+                'requests': self.requests,
+                'migrated': self.migrated,
+                'failed': self.failed,
+                'in_flight': self.in_flight,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'documents_per_second': self.migrated / uptime,
+                'mean_latency': self.seconds / answered if answered else 0.0}
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    """Handles the requests of the service."""
+
+    # Keep connections open, so that a client can send many documents
+    # without a new connection each time
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        """Disables Nagle's algorithm on TCP connections. The headers and
+        the body of a response are sent separately, and with small
+        documents the delayed acknowledgement of the client would
+        otherwise stall every response on a kept-alive connection.
+        """
+        self.disable_nagle_algorithm = (
+            self.server.address_family != socket.AF_UNIX)
+        super().setup()
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Serves /health, /stats and /metrics."""
+        path = urllib.parse.urlsplit(self.path).path
+        if path == '/health':
+            self.send_json(200, {'status': 'ok',
+                                 'workers': self.server.workers})
+        elif path == '/stats':
+            self.send_json(200, self.server.stats.as_dict())
+        elif path == '/metrics':
+            body = self.server.metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_json(404, {'error': f"Not found: {path}"})
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Serves /migrate."""
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != '/migrate':
+            self.close_connection = True
+            self.send_json(404, {'error': f"Not found: {url.path}"})
+            return
+
+        stats = self.server.stats
+        stats.start()
+        start = time.monotonic()
+        data = b''
+        body = b''
+        result = None
+        error_name = None
+        try:
+            data = self.read_body()
+            options = parse_options(url.query)
+            result = self.server.migrate(data, options)
+            body = result.data
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/xml')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('X-Objid', header_value(result.objid))
+            self.send_header('X-Migration-Plan',
+                             header_value(result.plan.describe()))
+            self.send_header('X-Migration-Method',
+                             header_value(result.method))
+            self.send_header('X-Migration-Warnings',
+                             json.dumps(result.warnings))
+            self.end_headers()
+            self.wfile.write(body)
+            ok = True
+        except RequestError as error:
+            ok = False
+            error_name = error.error
+            self.send_json(error.status, {'error': error.message})
+        except Exception as error:  # pylint: disable=broad-except
+            ok = False
+            error_name = type(error).__name__
+            self.send_json(500,
+                           {'error': f"{type(error).__name__}: {error}"})
+        elapsed = time.monotonic() - start
+        stats.finish(ok, elapsed, len(data), len(body))
+        self.server.metrics.observe(
+            'ok' if ok else 'failed', elapsed,
+            version=result.plan.full_cur_catalog if result else None,
+            error=error_name, bytes_read=len(data), bytes_written=len(body),
+            profile=result.profile if result else None)
+
+    def read_body(self) -> bytes:
+        """Reads the request body.
+
+        :raises RequestError: If the body has no length or is too large
+        :returns: The request body
+        """
+        length = self.headers.get('Content-Length')
+        if length is None or not length.isdigit():
+            self.close_connection = True
+            raise RequestError(411, "Content-Length required.")
+        if int(length) > self.server.max_body:
+            # The body is not read, so the connection can not be reused
+            self.close_connection = True
+            raise RequestError(
+                413, f"Request body larger than {self.server.max_body} "
+                "bytes.")
+        return self.rfile.read(int(length))
+
+    def send_json(self, status: int, content: dict) -> None:
+        """Sends a JSON response.
+
+        :param status: HTTP status code
+        :param content: Content of the response
+        """
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        """Returns the client address for the log, also for clients of a
+        Unix socket, which have no address.
+        """
+        if isinstance(self.client_address, tuple) and self.client_address:
+            return self.client_address[0]
+        return 'local'
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Logs the requests unless the server is quiet."""
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+class MigrationServer(http.server.ThreadingHTTPServer):
+    """HTTP server passing the migrations to a pool of workers."""
+
+    daemon_threads = True
+
+    def __init__(self,
+                 address,
+                 executor: concurrent.futures.Executor,
+                 workers: int,
+                 max_body: int = MAX_BODY,
+                 quiet: bool = False):
+        """Initialize the server.
+
+        :param address: (host, port) tuple, or a path for a Unix socket
+                        server
+        :param executor: Executor to run the migrations in
+        :param workers: Number of workers of the executor
+        :param max_body: Largest accepted request body in bytes
+        :param quiet: Do not log the requests
+        """
+        self.executor = executor
+        self.workers = workers
+        self.max_body = max_body
+        self.quiet = quiet
+        self.stats = ServerStats()
+        self.metrics = Metrics()
+        self.executor_lock = threading.Lock()
+        super().__init__(address, RequestHandler)
+
+    def migrate(self, data: bytes, options: dict):
+        """Migrates a METS document in the pool of workers. If the pool
+        is broken, e.g. since a worker was killed by the out-of-memory
+        killer, a new pool is started for the next requests.
+
+        :param data: The METS document
+        :param options: Keyword arguments of Migrator
+
+        :raises RequestError: If the document can not be migrated, or
+                              with status 503 if the pool broke
+        :returns: api.MigrationResult object
+        """
+        executor = self.executor
+        try:
+            return executor.submit(migrate_document, data, options).result()
+        except BrokenProcessPool:
+            self.restart_executor(executor)
+            raise RequestError(
+                503, "A worker process of the service died, the request "
+                "can be retried.", 'BrokenProcessPool') from None
+
+    def restart_executor(self, broken: concurrent.futures.Executor) -> None:
+        """Replaces a broken pool of workers with a new one. Of the
+        requests that failed with the same pool, only the first one
+        starts a new pool.
+
+        :param broken: The broken executor
+        """
+        with self.executor_lock:
+            if self.executor is not broken:
+                return
+            self.executor = start_pool(self.workers)
+        broken.shutdown(wait=False)
+
+
+class UnixMigrationServer(MigrationServer):
+    """MigrationServer listening on a Unix socket."""
+
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        """Binds the socket, replacing the socket file of a previous
+        server.
+        """
+        path = self.server_address
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+        # HTTPServer.server_bind expects a host and port
+        http.server.socketserver.TCPServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+    def server_close(self):
+        """Closes the socket and removes the socket file."""
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+def start_pool(workers: int) -> concurrent.futures.ProcessPoolExecutor:
+    """Starts a warm pool of worker processes.
+
+    :param workers: Number of worker processes
+
+    :returns: The executor of the pool
+    """
+    executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, initializer=warm_up)
+    # Start the workers now rather than on the first requests
+    concurrent.futures.wait([executor.submit(os.getpid)
+                             for _ in range(workers)])
+    return executor
+
+
+def create_server(args: argparse.Namespace) -> MigrationServer:
+    """Creates the server and its warm pool of worker processes.
+
+    :param args: Parsed command line arguments
+
+    :returns: The server
+    """
+    workers = args.jobs
+    executor = start_pool(workers)
+    options = {'executor': executor, 'workers': workers,
+               'max_body': args.max_body, 'quiet': args.quiet}
+    try:
+        if args.socket:
+            return UnixMigrationServer(args.socket, **options)
+        return MigrationServer((args.host, args.port), **options)
+    except BaseException:
+        executor.shutdown()
+        raise
+
+
+def parse_arguments(arguments: list) -> argparse.Namespace:
+    """Create arguments parser and return parsed command line arguments.
+
+    :param arguments: List of arguments
+
+    :returns: Parsed arguments
+    """
+    parser = argparse.ArgumentParser(
+        prog='transform-mets serve',
+        description='Serve METS migrations over HTTP')
+    address = parser.add_mutually_exclusive_group()
+    address.add_argument('--port', dest='port', type=int, default=8080,
+                         help='TCP port to listen on')
+    address.add_argument('--socket', dest='socket', type=str,
+                         help='Path of a Unix socket to listen on instead '
+                         'of a TCP port')
+    parser.add_argument('--host', dest='host', type=str,
+                        default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--jobs', dest='jobs', type=positive_int, default=1,
+                        help='Number of worker processes')
+    parser.add_argument('--max_body', dest='max_body', type=int,
+                        default=MAX_BODY, help='Largest accepted METS '
+                        'document in bytes')
+    parser.add_argument('--quiet', dest='quiet', action='store_true',
+                        help='Do not log the requests')
+    return parser.parse_args(arguments)
+
+
+def _terminate(signum, frame):
+    """Stops the server on SIGTERM like on Ctrl-C."""
+    raise KeyboardInterrupt
+
+
+def main(arguments=None):
+    """The main method for the serve command."""
+    args = parse_arguments(arguments)
+    try:
+        server = create_server(args)
+    except OSError as error:
+        print(f"Error: {error}", file=sys.stderr)
+        return 117
+
+    signal.signal(signal.SIGTERM, _terminate)
+    if args.socket:
+        print(f"Serving on {args.socket} with {server.workers} workers")
+    else:
+        host, port = server.server_address[:2]
+        print(f"Serving on http://{host}:{port} with {server.workers} "
+              "workers")
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.executor.shutdown()
+    return 0
@@ -0,0 +1,387 @@
+"""Streaming migration of METS documents. The document is parsed with
+lxml.etree.iterparse and written with lxml.etree.xmlfile one section at
+a time, so the memory use is bounded by the largest single section
+instead of the size of the whole document.
+
+The METS root, amdSec, fileSec, fileGrp, structMap and div elements are
+containers: their start and end tags are written as they are parsed.
+Their other children, e.g. metsHdr, dmdSec, techMD and file elements,
+are migrated as complete subtrees, written and freed before the next
+one is parsed. Each subtree is serialized with the namespace prefixes of
+the output METS root, and the declarations already made on the METS root
+are removed from it, as they are in a document serialized as a whole.
+
+Catalog version 1.4 documents are restructured across sections, see
+transform_mets.fix_1_4_mets, and are migrated with the DOM path.
+"""
+
+from __future__ import annotations
+import datetime
+import re
+from uuid import uuid4
+
+import mets
+import lxml.etree as ET
+from dpres_specification_migrator import xpaths
+from dpres_specification_migrator.context import MigrationContext
+from dpres_specification_migrator.attributes import strip_attributes
+from dpres_specification_migrator.dicts import NAMESPACES
+from dpres_specification_migrator.fastpath import START_TAG
+from dpres_specification_migrator.plan import get_plan
+from dpres_specification_migrator.rewriter import NamespaceRewriter
+from dpres_specification_migrator.transform_mets import (
+    namespace_replacements, set_dip_root_attributes, update_dip_metshdr,
+    update_root_attributes)
+
+METSHDR = '{%s}metsHdr' % NAMESPACES['mets']
+DMDSEC = '{%s}dmdSec' % NAMESPACES['mets']
+AMDSEC = '{%s}amdSec' % NAMESPACES['mets']
+DIGIPROVMD = '{%s}digiprovMD' % NAMESPACES['mets']
+FILESEC = '{%s}fileSec' % NAMESPACES['mets']
+FILEGRP = '{%s}fileGrp' % NAMESPACES['mets']
+FILE = '{%s}file' % NAMESPACES['mets']
+STRUCTMAP = '{%s}structMap' % NAMESPACES['mets']
+DIV = '{%s}div' % NAMESPACES['mets']
+MDWRAP = '{%s}mdWrap' % NAMESPACES['mets']
+MDREF = '{%s}mdRef' % NAMESPACES['mets']
+
+# Namespace declaration in a start tag serialized by lxml
+DECLARATION = re.compile(rb'\s+(xmlns(?::[^\s=]+)?="[^"]*")')
+
+
+class StreamingNotSupported(Exception):
+    """Raised when the METS document can only be migrated with the DOM
+    path.
+    """
+
+
+def read_catalog_version(source) -> str:
+    """Reads the full catalog version from the METS root element without
+    parsing the rest of the document.
+
+    :param source: Path to the METS document or a binary file object
+
+    :returns: The current full catalog version of the METS document
+    """
+    if isinstance(source, str):
+        with open(source, 'rb') as infile:
+            return read_catalog_version(infile)
+    for _, root in _iterparse(source, events=('start',)):
+        return xpaths.CATALOG_VERSION(root)[0]
+    return None
+
+
+def migrate_stream(source,
+                   outfile,
+                   to_catalog: str,
+                   contract: str | None = None,
+                   dissemination: bool = False,
+                   objid: str | None = None,
+                   context: MigrationContext | None = None) -> str:
+    """Migrates a METS document from `source` to `outfile`. Makes the same
+    changes as transform_mets.migrate_mets, optionally followed by
+    transform_mets.transform_to_dip.
+
+    :param source: Path to the METS document or a binary file object
+    :param outfile: Binary file object to write the migrated document to
+    :param to_catalog: The intended catalog version of the METS document
+    :param contract: The CONTRACTID of the METS document
+    :param dissemination: Create a dissemination information package
+    :param objid: OBJID of the dissemination information package, a new
+                  one is generated if not given
+    :param context: Migration context, a new one is created if not
+                    given
+
+    :raises StreamingNotSupported: If the document is a catalog version
+                                   1.4 document. Nothing is written to
+                                   `outfile` in this case.
+
+    :returns: OBJID of the migrated METS document
+    """
+    if isinstance(source, str):
+        with open(source, 'rb') as infile:
+            return migrate_stream(infile, outfile, to_catalog,
+                                  contract=contract,
+                                  dissemination=dissemination, objid=objid,
+                                  context=context)
+
+    migration = _StreamMigration(outfile, to_catalog, contract,
+                                 dissemination, objid,
+                                 context or MigrationContext())
+    return migration.run(source)
+
+
+def _iterparse(source, events):
+    """Returns an iterparse iterator with the parser options used for
+    streaming.
+
+    :param source: Binary file object
+    :param events: Events to report
+    """
+    return ET.iterparse(source, events=events, huge_tree=True,
+                        resolve_entities=False, no_network=True)
+
+
+class _StreamMigration:
+    """State of a single streaming migration."""
+
+    def __init__(self, outfile, to_catalog, contract, dissemination, objid,
+                 context):
+        """Initialize the migration, see migrate_stream for the
+        parameters.
+        """
+        self.outfile = outfile
+        self.to_catalog = to_catalog
+        self.contract = contract
+        self.dissemination = dissemination
+        self.objid = objid
+        self.context = context
+        self.plan = None
+        self.xmlfile = None
+        # One entry per open element: (path, element writer) for
+        # containers, (path, None) for sections and None for elements
+        # within sections
+        self.stack = []
+        # The last completed child of the innermost open container,
+        # (element, written). It is freed, and written if it is a
+        # section, when the parser has moved past it.
+        self.pending = None
+        self.headers = 0
+        self.rewriter = None
+        # Namespace declarations of the output METS root, as written
+        self.declared = frozenset()
+        # Empty element with the namespaces of the output METS root.
+        # Sections are moved into it before they are serialized, so that
+        # they use the prefixes of the output, as in the DOM path.
+        self.holder = None
+
+    def run(self, source) -> str:
+        """Runs the migration.
+
+        :param source: Binary file object
+
+        :returns: OBJID of the migrated METS document
+        """
+        events = _iterparse(source, events=('start', 'end', 'comment', 'pi'))
+        for event, root in events:
+            if event == 'start':
+                break
+        new_root = self._migrate_root(root)
+
+        rewriter = NamespaceRewriter(
+            self.outfile,
+            namespace_replacements(xpaths.CATALOG_VERSION(new_root)[0]))
+        self.rewriter = rewriter
+        self.declared = frozenset(
+            self._rewrite(_declaration(prefix, uri))
+            for prefix, uri in new_root.nsmap.items())
+        self.holder = ET.Element(new_root.tag, nsmap=new_root.nsmap)
+        with ET.xmlfile(rewriter, encoding='UTF-8') as self.xmlfile:
+            self.xmlfile.write_declaration()
+            writer = self.xmlfile.element(new_root.tag,
+                                          attrib=dict(new_root.attrib),
+                                          nsmap=new_root.nsmap)
+            writer.__enter__()
+            self.stack.append(((), writer))
+
+            for event, elem in events:
+                if not self.stack:
+                    break
+                if event == 'start':
+                    self._start(elem)
+                elif event == 'end':
+                    self._end(elem)
+                elif self.stack[-1] is not None and \
+                        self.stack[-1][1] is not None:
+                    # Comment or processing instruction in a container
+                    self._flush()
+                    self.pending = (elem, False)
+
+        rewriter.write(b'\n')
+        rewriter.flush()
+        return self.objid
+
+    def _migrate_root(self, root: ET._Element) -> ET._Element:
+        """Migrates the attributes of the METS root.
+
+        :param root: The METS root being parsed, without children
+
+        :returns: A new METS root with the migrated attributes and the
+                  namespace declarations of the output
+        """
+        context = self.context
+        context.full_cur_catalog = xpaths.CATALOG_VERSION(root)[0]
+        context.to_catalog = self.to_catalog
+        context.contract = self.contract
+        self.plan = get_plan(context.full_cur_catalog, self.to_catalog)
+        if self.plan.fix_old:
+            raise StreamingNotSupported(
+                "Catalog version 1.4 documents can not be streamed.")
+
+        root_attribs = update_root_attributes(
+            root, self.to_catalog, context.full_cur_catalog, self.contract,
+            context=context)
+        new_root = mets.mets(profile=root_attribs['PROFILE'],
+                             namespaces=context.namespaces)
+        for attrib in root_attribs:
+            new_root.set(attrib, root_attribs[attrib])
+
+        if self.dissemination:
+            self.objid = self.objid or str(uuid4())
+            strip_attributes(new_root, ())
+            set_dip_root_attributes(new_root, context.cur_catalog,
+                                    self.to_catalog, self.objid)
+        else:
+            self.objid = root_attribs['OBJID']
+        return new_root
+
+    def _start(self, elem: ET._Element) -> None:
+        """Handles the start of an element.
+
+        :param elem: The element
+        """
+        parent = self.stack[-1]
+        if parent is None or parent[1] is None:
+            self.stack.append(None)
+            return
+
+        self._flush()
+        path = parent[0] + (elem.tag,)
+        if not _is_container(path):
+            self.stack.append((path, None))
+            return
+
+        if self.dissemination:
+            strip_attributes(elem, path, recursive=False)
+        self.xmlfile.write(_indent(len(path)))
+        writer = self.xmlfile.element(elem.tag, attrib=dict(elem.attrib))
+        writer.__enter__()
+        self.stack.append((path, writer))
+
+    def _end(self, elem: ET._Element) -> None:
+        """Handles the end of an element.
+
+        :param elem: The element
+        """
+        entry = self.stack[-1]
+        if entry is not None and entry[1] is not None:
+            self._flush()
+        self.stack.pop()
+        if entry is None:
+            return
+        path, writer = entry
+        if writer is None:
+            self.pending = (elem, False)
+            return
+
+        self.xmlfile.write(_indent(len(path) - 1))
+        writer.__exit__(None, None, None)
+        self.pending = (elem, True) if path else None
+
+    def _flush(self) -> None:
+        """Frees the pending element and writes it if it has not been
+        written yet. This is called only when the parser is past the
+        pending element, so that it can be safely removed from the tree.
+        """
+        if self.pending is None:
+            return
+        elem, written = self.pending
+        self.pending = None
+        depth = len(self.stack)
+        elem.getparent().remove(elem)
+        if written:
+            return
+        if isinstance(elem.tag, str):
+            self._migrate_section(elem, self.stack[-1][0] + (elem.tag,))
+        self.xmlfile.write(_indent(depth))
+        if not isinstance(elem.tag, str):
+            self.xmlfile.write(elem, with_tail=False)
+            return
+        self.holder.append(elem)
+        data = ET.tostring(elem, encoding='UTF-8', with_tail=False)
+        self.holder.remove(elem)
+        start_tag = START_TAG.match(data)
+        attributes = DECLARATION.sub(
+            lambda match: b'' if self._rewrite(match.group(1))
+            in self.declared else match.group(0), start_tag.group(2))
+        # The xmlfile is flushed, so that the section is written to the
+        # rewriter after the whitespace before it
+        self.xmlfile.flush()
+        self.rewriter.write(b'<%s%s%s>' % (start_tag.group(1), attributes,
+                                           start_tag.group(3)))
+        self.rewriter.write(data[start_tag.end():])
+
+    def _rewrite(self, declaration: bytes) -> bytes:
+        """Returns a namespace declaration as the rewriter writes it.
+
+        :param declaration: Namespace declaration
+        """
+        for old, new in self.rewriter.replacements:
+            declaration = declaration.replace(old, new)
+        return declaration
+
+    def _migrate_section(self, elem: ET._Element, path: tuple) -> None:
+        """Migrates a section of the METS document. These are the same
+        changes migrate_mets and transform_to_dip make to the section.
+
+        :param elem: The section
+        :param path: Tags of the section and its ancestors below the root
+        """
+        kdk = self.plan.to_kdk
+        if path == (METSHDR,):
+            if not self.headers:
+                elem.set('LASTMODDATE', datetime.datetime.now(
+                    datetime.timezone.utc).replace(microsecond=0).isoformat())
+            self.headers += 1
+        elif path == (DMDSEC,) and not kdk:
+            for mdwrap in elem.iterchildren(MDWRAP):
+                attr = mdwrap.attrib
+                if attr.get('MDTYPE') == 'MARC' and \
+                        'marc=finmarc' in attr['MDTYPEVERSION']:
+                    attr['MDTYPE'] = 'OTHER'
+                    attr['OTHERMDTYPE'] = 'MARC'
+        elif path == (AMDSEC, DIGIPROVMD) and not kdk:
+            for mdref in elem.iterchildren(MDREF):
+                if mdref.get('OTHERMDTYPE') == 'KDKPreservationPlan':
+                    mdref.set('OTHERMDTYPE', 'FiPreservationPlan')
+        elif path == (FILESEC, FILEGRP, FILE):
+            use = elem.get('USE')
+            if (use == 'no-file-format-validation' and
+                    self.plan.old_no_validation_key) or \
+                    use == 'fi-preservation-no-file-format-validation':
+                elem.set('USE', 'fi-dpres-no-file-format-validation')
+
+        if self.dissemination:
+            strip_attributes(elem, path)
+            if path == (METSHDR,):
+                update_dip_metshdr(elem)
+
+
+def _declaration(prefix: str | None, uri: str) -> bytes:
+    """Returns a namespace declaration as lxml serializes it.
+
+    :param prefix: Namespace prefix, or None for the default namespace
+    :param uri: Namespace URI
+    """
+    name = f'xmlns:{prefix}' if prefix else 'xmlns'
+    return f'{name}="{uri}"'.encode('utf-8')
+
+
+def _indent(depth: int) -> str:
+    """Returns the whitespace written before an element.
+
+    :param depth: Depth of the element below the METS root
+    """
+    return '\n' + '  ' * depth
+
+
+def _is_container(path: tuple) -> bool:
+    """Tells whether the element is written as separate start and end
+    tags, instead of a complete subtree.
+
+    :param path: Tags of the element and its ancestors below the root
+    """
+    if len(path) == 1:
+        return path[0] in (AMDSEC, FILESEC, STRUCTMAP)
+    return (path[0] == FILESEC and path[-1] == FILEGRP) or \
+        (path[0] == STRUCTMAP and path[-1] == DIV)
@@ -6,91 +6,472 @@ METS document to create a dissemination information package.
 
 from __future__ import annotations
 import argparse
-import copy
+import contextlib
 import datetime
+import functools
 import os
 import sys
+import time
 from uuid import uuid4
 
 import mets
-import xml_helpers.utils
 import lxml.etree as ET
-from dpres_specification_migrator.dicts import (ATTRIBS_TO_DELETE,
-                                                MDTYPEVERSIONS, NAMESPACES,
-                                                RECORD_STATUS_TYPES, VERSIONS)
+import xml_helpers.utils
+from dpres_specification_migrator.batch import (FileResult, collect_inputs,
+                                                positive_int, print_summary,
+                                                report_messages, run_tasks,
+                                                write_status)
+from dpres_specification_migrator import xpaths
+from dpres_specification_migrator.archive import (archive_stem,
+                                                  archive_suffix,
+                                                  migrate_archive)
+from dpres_specification_migrator.attributes import strip_attributes
+from dpres_specification_migrator.compression import \
+    SUFFIXES as COMPRESSION_SUFFIXES
+from dpres_specification_migrator.compression import open_output
+from dpres_specification_migrator.context import MigrationContext
+from dpres_specification_migrator.dicts import (
+    FI_NAMESPACE_VERSIONS, KDK_PROFILE, MDTYPEVERSIONS,
+    OLD_NO_VALIDATION_KEY_VERSIONS, RECORD_STATUS_TYPES, VERSIONS)
+from dpres_specification_migrator.index import AdmidIndex
+from dpres_specification_migrator.journal import (Journal, fingerprint,
+                                                  migration_options)
+from dpres_specification_migrator.metrics import Metrics, serve_metrics
+from dpres_specification_migrator.plan import get_plan, print_plans
+from dpres_specification_migrator.profiling import (DETAILS, span,
+                                                    write_profile)
+from dpres_specification_migrator.writer import (DURABILITIES, AtomicWriter,
+                                                 sync)
+
+# Seconds between the updates of the --metrics file during a run
+METRICS_INTERVAL = 15
+
+# Number of migrated METS documents flushed to stable storage at a time
+# with --durability batch
+SYNC_GROUP = 64
+
+# Size of the chunks write_mets writes the serialized document in
+WRITE_CHUNK = 1024 * 1024
+
+
+class MigrationError(Exception):
+    """Raised when a METS document can not be migrated with the given
+    options.
+    """
+
+
+class UnsupportedVersionError(MigrationError):
+    """Raised when the intended catalog version is not supported."""
+
+
+class DowngradeError(MigrationError):
+    """Raised when the intended catalog version is older than the
+    current catalog version of the METS document.
+    """
+
+
+class ContractIdRequiredError(MigrationError):
+    """Raised when the migration needs a CONTRACTID and none was given."""
 
 
 def main(arguments=None):
     """The main method for transform_mets."""
+    if arguments is None:
+        arguments = sys.argv[1:]
+    if arguments[:1] == ['inventory']:
+        # Imported here, since the inventory reuses the checks of this
+        # module
+        from dpres_specification_migrator import inventory
+        return inventory.main(arguments[1:])
+    if arguments[:1] == ['serve']:
+        from dpres_specification_migrator import server
+        return server.main(arguments[1:])
+
     args = parse_arguments(arguments)
 
-    root = xml_helpers.utils.readfile(args.filepath).getroot()
+    metrics = None
+    metrics_server = None
+    if args.metrics or args.metrics_port is not None:
+        metrics = Metrics()
+    try:
+        if args.metrics_port is not None:
+            try:
+                metrics_server = serve_metrics(metrics, args.metrics_port)
+            except OSError as error:
+                return _run_error(f"--metrics_port: {error}",
+                                  'MetricsPortError', metrics)
+        return run_batch(args, metrics)
+    finally:
+        if args.metrics:
+            metrics.write_textfile(args.metrics,
+                                   writer=AtomicWriter(args.durability))
+            if args.durability == 'batch':
+                sync([args.metrics])
+        if metrics_server is not None:
+            metrics_server.shutdown()
+            metrics_server.server_close()
+
+
+def run_batch(args: argparse.Namespace,
+              metrics: Metrics | None = None) -> int:
+    """Migrates the METS documents given on the command line.
+
+    :param args: Parsed command line arguments
+    :param metrics: Metrics updated with every migrated METS document,
+                    or None
+
+    :returns: Exit code of the run
+    """
+    inputs = collect_inputs(args.filepath, manifest=args.manifest,
+                            pattern=args.pattern)
+    journal = Journal(args.journal) if args.journal else None
+    options = migration_options(args)
+    if args.retry_failed:
+        inputs = [(filepath, outdir) for filepath, outdir in inputs
+                  if journal.failed(filepath)]
+        if not inputs:
+            print("No failed METS documents to retry.")
+            return 0
+    if not inputs:
+        return _run_error("No METS documents to migrate.", 'NoInputs',
+                          metrics)
+    if len(inputs) > 1 and (args.output is not None or
+                            any(filepath == '-' for filepath, _ in inputs)):
+        return _run_error("Standard input and --output take a single METS "
+                          "document.", 'SingleDocumentRequired', metrics)
+
+    # Status lines and the summary go to stderr while stdout carries the
+    # migrated METS document
+    info = sys.stdout
+    if output_path(args, inputs[0][0], inputs[0][1]) == '-':
+        if args.output_archive:
+            return _run_error("--output_archive can not write to stdout.",
+                              'ArchiveToStdout', metrics)
+        info = sys.stderr
+    status = None
+    if args.status_fd is not None:
+        try:
+            status = os.fdopen(args.status_fd, 'w', encoding='utf-8',
+                               closefd=False)
+        except OSError as error:
+            return _run_error(f"--status_fd: {error}", 'StatusFdError',
+                              metrics)
+
+    results = [None] * len(inputs)
+    tasks = []
+    outpaths = {}
+    for position, (filepath, outdir) in enumerate(inputs):
+        outpath = output_path(args, filepath, outdir)
+        if outpath in outpaths:
+            message = (f"Output path {outpath} is already used by "
+                       f"{outpaths[outpath]}.")
+            results[position] = FileResult(
+                filepath, status='failed', message=message,
+                error='OutputPathConflict',
+                messages=[('error', f"Error: {filepath}: {message}")])
+            continue
+        outpaths[outpath] = filepath
+        if args.resume:
+            entry = journal.finished(filepath, outpath, options)
+            if entry is not None:
+                results[position] = FileResult(
+                    filepath, outpath=outpath, objid=entry['objid'],
+                    status='skipped', messages=[(
+                        'info', f"Skipped {filepath}, already migrated as "
+                        f"{outpath}")])
+                continue
+        tasks.append((position, filepath, outpath))
+
+    # Results arrive in input order, so that the output of a parallel
+    # run can be compared line by line with a serial run
+    migrated = run_tasks(migrate_file, [task[1:] for task in tasks], args,
+                         jobs=args.jobs)
+    written = time.monotonic()
+    unsynced = []
+    try:
+        for position, result in enumerate(results):
+            if result is None:
+                results[position] = next(migrated)
+            report_messages(results[position], file=info)
+            if status is not None:
+                write_status(results[position], status)
+            if results[position].status == 'skipped':
+                continue
+            if args.durability == 'batch' and results[position].ok and \
+                    results[position].outpath != '-':
+                unsynced.append(results[position].outpath)
+                if len(unsynced) >= SYNC_GROUP:
+                    sync(unsynced)
+                    unsynced = []
+            if journal is not None:
+                journal.record(results[position], options)
+            if metrics is not None:
+                metrics.observe_result(results[position])
+                if args.metrics and \
+                        time.monotonic() - written > METRICS_INTERVAL:
+                    metrics.write_textfile(
+                        args.metrics, writer=AtomicWriter(args.durability))
+                    written = time.monotonic()
+    finally:
+        if unsynced:
+            sync(unsynced)
+        if journal is not None:
+            journal.close()
+        if status is not None:
+            status.close()
+    if args.cache and args.cache_size is not None:
+        from dpres_specification_migrator.cache import ResultCache
+        ResultCache(args.cache).evict(args.cache_size)
+
+    if len(results) > 1:
+        print_summary(results, file=info)
+    if args.show_plan:
+        print_plans(results, file=info)
+    if args.profile:
+        with open(args.profile, 'w', encoding='utf-8') as outfile:
+            write_profile(results, outfile)
+
+    if all(result.ok for result in results):
+        return 0
+    return 117
+
+
+def _run_error(message: str, error: str, metrics: Metrics | None) -> int:
+    """Reports an error that stops the whole run.
+
+    :param message: Error message
+    :param error: Name of the error, counted in the metrics
+    :param metrics: Metrics of the run, or None
+
+    :returns: Exit code of the run
+    """
+    print(f"Error: {message}", file=sys.stderr)
+    if metrics is not None:
+        metrics.observe_failure(error)
+    return 117
+
+
+def output_path(args: argparse.Namespace,
+                filepath: str,
+                outdir: str) -> str:
+    """Returns the output path of a METS document. The METS document of
+    a tar or zip package is written into a directory named after the
+    package, or with --output_archive into a copy of the package. With
+    --compress the suffix of the compression is added. The path given
+    with --output is used as it is, and '-' stands for stdout, which is
+    also the output of a METS document read from stdin.
+
+    :param args: Parsed command line arguments
+    :param filepath: Path to the METS document or package
+    :param outdir: Output directory relative to the workspace
+
+    :returns: The output path
+    """
+    if args.output is not None:
+        return args.output if args.output == '-' else os.path.normpath(
+            args.output)
+    if filepath == '-':
+        return '-'
+    if archive_suffix(filepath) is None:
+        path = os.path.join(args.workspace, outdir, args.filename)
+        if args.compress:
+            path += COMPRESSION_SUFFIXES[args.compress]
+    elif args.output_archive:
+        path = os.path.join(args.workspace, outdir,
+                            os.path.basename(filepath))
+    else:
+        path = os.path.join(args.workspace, outdir, archive_stem(filepath),
+                            args.filename)
+    return os.path.normpath(path)
+
+
+def migrate_file(filepath: str,
+                 outpath: str,
+                 args: argparse.Namespace
+                 ) -> FileResult:
+    """Migrates a single METS document and writes the result. Status
+    lines and warnings are collected into the result instead of being
+    printed, so that the caller can report them in input order also
+    when documents are migrated in worker processes.
+
+    :param filepath: Path to the METS document, or a tar or zip package,
+                     '-' reads the METS document from stdin
+    :param outpath: Path where the migrated METS document is written,
+                    '-' streams it to stdout
+    :param args: Parsed command line arguments
+
+    :returns: Result of the migration
+    """
+    # Imported here, since the API and the cache reuse the steps of this
+    # module
+    from dpres_specification_migrator.api import Migrator
+    from dpres_specification_migrator.cache import (ResultCache, cache_key,
+                                                    cache_options)
+
+    messages = []
+    start = time.perf_counter()
+    source = None
+    target = 'to stdout' if outpath == '-' else f'as {outpath}'
+    # Archives and compressed outputs are not cached, since the cache
+    # holds plain METS documents, and neither are the streams
+    cached = args.cache and archive_suffix(filepath) is None and \
+        not args.compress and '-' not in (filepath, outpath)
+    try:
+        if (args.journal or args.cache) and filepath != '-':
+            source = fingerprint(filepath)
+        if cached:
+            options = cache_options(args)
+            cache = ResultCache(args.cache,
+                                writer=AtomicWriter(args.durability))
+            key = cache_key(source['sha256'], options)
+            meta = cache.restore(key, outpath, options)
+            if meta is not None:
+                messages.extend(('warning', warning) for warning
+                                in meta['warnings'])
+                messages.append((
+                    'info', f"Wrote METS file {target} with OBJID: "
+                    f"{meta['objid']} (cached)"))
+                return FileResult(filepath, outpath=outpath,
+                                  objid=meta['objid'],
+                                  plan=tuple(meta['plan']),
+                                  elapsed=time.perf_counter() - start,
+                                  fingerprint=source, messages=messages,
+                                  bytes_written=os.path.getsize(outpath))
+        with _open_stdio(filepath, outpath, args.compress) as (
+                infile, outfile, stdout):
+            if archive_suffix(filepath) is None:
+                result = Migrator.from_arguments(args).migrate(
+                    infile, outfile=outfile)
+            else:
+                result = migrate_archive(
+                    Migrator.from_arguments(args), filepath, outfile,
+                    pattern=args.pattern, output_archive=args.output_archive)
+        if cached:
+            cache.store(key, outpath, {'objid': result.objid,
+                                       'plan': result.plan.key,
+                                       'warnings': result.warnings},
+                        options)
+        messages.extend(('warning', warning) for warning
+                        in result.warnings)
+        messages.append((
+            'info',
+            f"Wrote METS file {target} with OBJID: {result.objid}"))
+        written = stdout.written if stdout is not None else (
+            os.path.getsize(outpath))
+    except MigrationError as error:
+        messages.append(('error', f"Error: {error}"))
+        return FileResult(filepath, status='failed', message=str(error),
+                          error=type(error).__name__,
+                          elapsed=time.perf_counter() - start,
+                          fingerprint=source, messages=messages)
+    except Exception as error:  # pylint: disable=broad-except
+        message = f"{type(error).__name__}: {error}"
+        messages.append(('error', f"Error: {filepath}: {message}"))
+        return FileResult(filepath, status='failed', message=message,
+                          error=type(error).__name__,
+                          elapsed=time.perf_counter() - start,
+                          fingerprint=source, messages=messages)
+
+    return FileResult(filepath, outpath=outpath, objid=result.objid,
+                      plan=result.plan.key,
+                      elapsed=time.perf_counter() - start,
+                      timings=result.timings, profile=result.profile,
+                      fingerprint=source, messages=messages,
+                      bytes_written=written)
+
+
+class _CountingWriter:
+    """Binary file object counting the bytes written to another one."""
+
+    def __init__(self, outfile):
+        """Initialize the writer.
+
+        :param outfile: Binary file object to write to
+        """
+        self.outfile = outfile
+        self.written = 0
+
+    def write(self, data) -> int:
+        """Writes and counts the data."""
+        self.outfile.write(data)
+        size = memoryview(data).nbytes
+        self.written += size
+        return size
+
+    def flush(self) -> None:
+        """Flushes the file object written to."""
+        self.outfile.flush()
+
+
+@contextlib.contextmanager
+def _open_stdio(filepath: str, outpath: str, compress: str | None):
+    """Opens stdin and stdout in place of the paths '-'. Other paths
+    are returned as they are. The migrated document is written to stdout
+    as it is serialized, so that the next command of a pipeline can
+    start reading it at once. The bytes written to stdout are counted,
+    since the size of the output can not be read afterwards.
+
+    :param filepath: Path to the METS document
+    :param outpath: Path where the migrated METS document is written
+    :param compress: Compression of the output, or None
+
+    :returns: Tuple of the input and output, as paths or binary file
+              objects, and the _CountingWriter of stdout or None
+    """
+    infile = sys.stdin.buffer if filepath == '-' else filepath
+    if outpath != '-':
+        yield infile, outpath, None
+        return
+    stdout = _CountingWriter(sys.stdout.buffer)
+    if compress is None:
+        yield infile, stdout, stdout
+    else:
+        with open_output(stdout, compress) as outfile:
+            yield infile, outfile, stdout
+    stdout.flush()
+
+
+def check_versions(version: str,
+                   to_version: str,
+                   contractid: str | None) -> None:
+    """Checks that the METS document can be migrated to the requested
+    catalog version.
 
-    full_version = root.xpath('@*[local-name() = "CATALOG"] | '
-                              '@*[local-name() = "SPECIFICATION"]')[0]
-    version = full_version[:3]
+    :param version: The current catalog version of the METS document
+    :param to_version: The intended catalog version of the METS document
+    :param contractid: The CONTRACTID given for the migration
+
+    :raises MigrationError: If the migration is not possible
+    """
     supported_versions = []
     for key, value in VERSIONS.items():
         if value['supported']:
             supported_versions.append(key)
-    if args.to_version not in supported_versions:
-        print(
-            (
-                "Error: Unable to migrate METS document to METS catalog "
-                f"version {args.to_version}. Supported versions are "
-                f"{', '.join(supported_versions)}."
-            ),
-            file=sys.stderr
-        )
-        return 117
-
-    if VERSIONS[args.to_version]['order'] < VERSIONS[version]['order']:
-        print(
-            (
-                "Error: Unable to migrate METS document to an "
-                "older catalog version. Current METS catalog "
-                f"version is {version}, while version {args.to_version} was "
-                "requested."
-            ),
-            file=sys.stderr
-        )
-        return 117
-
-    if not VERSIONS[args.to_version]['KDK'] and VERSIONS[version]['KDK'] \
-            and not args.contractid:
-        print(
-            (
-                "Error: CONTRACTID required when migrating "
-                f"to catalog version {args.to_version}."
-            ),
-            file=sys.stderr
+    if to_version not in supported_versions:
+        raise UnsupportedVersionError(
+            "Unable to migrate METS document to METS catalog "
+            f"version {to_version}. Supported versions are "
+            f"{', '.join(supported_versions)}."
         )
-        return 117
 
-    if args.objid and args.record_status != 'dissemination':
-        print(
-                f"Warning: the argument objid with the value {args.objid} was "
-                "ignored. METS OBJID was not changed in the migration to a "
-                "newer version of the specifications."
-            )
-
-    (migrated_mets, objid) = migrate_mets(
-        root=root, full_cur_catalog=full_version,
-        to_catalog=args.to_version, contract=args.contractid)
-
-    if args.record_status == 'dissemination':
-        migrated_mets, objid = transform_to_dip(
-            migrated_mets, cur_catalog=version,
-            to_catalog=args.to_version, objid=args.objid)
-
-    mets_b = serialize_mets(migrated_mets)
+    if version not in VERSIONS:
+        raise UnsupportedVersionError(
+            f"Unknown METS catalog version {version}.")
 
-    filename = args.filename
-    with open(os.path.join(args.workspace, filename), 'wb+') as outfile:
-        outfile.write(mets_b)
-        print(f"Wrote METS file as {outfile.name} with OBJID: {objid}")
+    if VERSIONS[to_version]['order'] < VERSIONS[version]['order']:
+        raise DowngradeError(
+            "Unable to migrate METS document to an "
+            "older catalog version. Current METS catalog "
+            f"version is {version}, while version {to_version} was "
+            "requested."
+        )
 
-    return 0
+    if not VERSIONS[to_version]['KDK'] and VERSIONS[version]['KDK'] \
+            and not contractid:
+        raise ContractIdRequiredError(
+            "CONTRACTID required when migrating "
+            f"to catalog version {to_version}."
+        )
 
 
 def parse_arguments(arguments: list) -> argparse.Namespace:
@@ -102,7 +483,100 @@ def parse_arguments(arguments: list) -> argparse.Namespace:
     """
 
     parser = argparse.ArgumentParser(description='Transform METS')
-    parser.add_argument('filepath', type=str, help='Path to METS file')
+    parser.add_argument('filepath', type=str, nargs='*',
+                        help='Path to METS file, "-" for stdin, a tar or '
+                        'zip package '
+                        'with a METS file, a directory walked recursively '
+                        'for METS files or a glob pattern')
+    parser.add_argument('--manifest', dest='manifest', type=str,
+                        help='File listing one input path per line, '
+                        '"-" reads the list from stdin')
+    parser.add_argument('--jobs', dest='jobs', type=positive_int, default=1,
+                        help='Number of worker processes')
+    parser.add_argument('--pattern', dest='pattern', type=str,
+                        default='mets.xml', help='File name pattern of '
+                        'METS files when walking directories')
+    parser.add_argument('--streaming', dest='streaming',
+                        action='store_true', help='Migrate the METS '
+                        'documents section by section with bounded memory '
+                        'use. Catalog version 1.4 documents are always '
+                        'migrated in memory')
+    parser.add_argument('--fast_path', dest='fast_path',
+                        action='store_true', help='Migrate catalog version '
+                        '1.7 documents to the newest 1.7 specification by '
+                        'patching the METS root and metsHdr start tags, when '
+                        'no other migration step applies')
+    parser.add_argument('--mmap', dest='mmap', action='store_true',
+                        help='Parse the METS files, and read their catalog '
+                        'versions, from a memory mapping of the file '
+                        'instead of reading them through a file object')
+    parser.add_argument('--show_plan', dest='show_plan',
+                        action='store_true', help='Print the migration '
+                        'plans of the run and the number of METS documents '
+                        'migrated with each plan')
+    parser.add_argument('--profile', dest='profile', type=str,
+                        help='Record the time of every migration step and '
+                        'write the profiles of the METS documents as JSON '
+                        'to the given path')
+    parser.add_argument('--profile_detail', dest='profile_detail',
+                        choices=DETAILS, type=str, help='Also capture '
+                        'cProfile function statistics or the Python memory '
+                        'allocations of every migration with --profile')
+    parser.add_argument('--metrics', dest='metrics', type=str,
+                        help='Write Prometheus metrics of the run to the '
+                        'given path, e.g. a .prom file in the directory of '
+                        'the node exporter textfile collector. The file is '
+                        'updated during the run and replaced atomically')
+    parser.add_argument('--metrics_port', dest='metrics_port', type=int,
+                        help='Serve Prometheus metrics of the run on '
+                        'http://127.0.0.1:PORT/metrics while it lasts')
+    parser.add_argument('--journal', dest='journal', type=str,
+                        help='Append the outcome of every METS document '
+                        'to the given journal file as JSON lines, for '
+                        'resuming the run')
+    parser.add_argument('--resume', dest='resume', action='store_true',
+                        help='Skip the METS documents the --journal '
+                        'records as migrated with the same options, if '
+                        'neither the input nor the output has changed')
+    parser.add_argument('--retry_failed', dest='retry_failed',
+                        action='store_true', help='Migrate only the METS '
+                        'documents whose last migration in the --journal '
+                        'failed')
+    parser.add_argument('--cache', dest='cache', type=str,
+                        help='Cache directory of migrated METS documents. '
+                        'A METS document migrated earlier with the same '
+                        'content and options is copied from the cache')
+    parser.add_argument('--cache_size', dest='cache_size', type=int,
+                        help='Largest size of the --cache in bytes, the '
+                        'least recently used documents are removed at the '
+                        'end of the run')
+    parser.add_argument('--output_archive', dest='output_archive',
+                        action='store_true', help='Write the migrated METS '
+                        'file of a tar or zip package into a copy of the '
+                        'package in the workspace')
+    parser.add_argument('--compress', dest='compress',
+                        choices=list(COMPRESSION_SUFFIXES), type=str,
+                        help='Compress the migrated METS files and add the '
+                        'suffix of the compression to their names. '
+                        'Compressed input files are detected by their '
+                        'content')
+    parser.add_argument('--output', dest='output', type=str,
+                        help='Path of the migrated METS document of a '
+                        'single input, "-" writes it to stdout. A METS '
+                        'document read from stdin with the input path "-" '
+                        'is written to stdout by default. Status lines go '
+                        'to stderr while stdout carries the document')
+    parser.add_argument('--status_fd', dest='status_fd', type=int,
+                        help='Write the outcome of every METS document as '
+                        'a JSON line to the given open file descriptor')
+    parser.add_argument('--durability', dest='durability',
+                        choices=DURABILITIES, type=str, default='none',
+                        help='Flush the migrated METS files to stable '
+                        'storage: "file" fsyncs every file and its '
+                        'directory, "batch" fsyncs the files in groups and '
+                        'every directory once per group, "none" leaves it '
+                        'to the operating system. The files are always '
+                        'written under a temporary name and renamed')
     parser.add_argument('--output_filename', dest='filename',
                         type=str, default='mets.xml',
                         help='The file name of the transformed METS document')
@@ -118,15 +592,21 @@ def parse_arguments(arguments: list) -> argparse.Namespace:
                         help='list of record status types:%s' %
                         RECORD_STATUS_TYPES)
     parser.add_argument('--workspace', dest='workspace', type=str,
-                        default='./workspace', help='Workspace directory')
+                        default='./workspace', help='Workspace directory, '
+                        'outputs of a batch mirror the input directories '
+                        'below it')
 
-    return parser.parse_args(arguments)
+    args = parser.parse_args(arguments)
+    if (args.resume or args.retry_failed) and not args.journal:
+        parser.error("--resume and --retry_failed require --journal")
+    return args
 
 
 def migrate_mets(root: ET._Element,
                  to_catalog: str,
                  full_cur_catalog: str,
-                 contract: str | None = None
+                 contract: str | None = None,
+                 context: MigrationContext | None = None
                  ) -> tuple[ET._Element, str]:
     """Migrates the METS document from the METS data in XML.
     1) Migrates from catalog version 1.4 or 1.4.1 to newer
@@ -151,12 +631,89 @@ def migrate_mets(root: ET._Element,
     :param full_cur_catalog: The current full catalog version of the
                              METS document
     :param contract: The CONTRACTID of the METS document
+    :param context: Migration context, a new one is created if not
+                    given
 
     :returns: The METS root as xml
     """
+    context = context or MigrationContext()
+    context.full_cur_catalog = full_cur_catalog
+    context.to_catalog = to_catalog
+    context.contract = contract
+    plan = get_plan(full_cur_catalog, to_catalog)
+
     # 1
-    if VERSIONS[full_cur_catalog[:3]]['fix_old']:
-        root = fix_1_4_mets(root)
+    if plan.fix_old:
+        with span(context, 'fix_1_4_mets'):
+            root = fix_1_4_mets(root, context=context)
+    # 2-7
+    with span(context, 'update_root_attributes'):
+        root_attribs = update_root_attributes(
+            root, to_catalog, full_cur_catalog, contract, context=context)
+
+    # 8
+    with span(context, 'set_lastmoddate'):
+        xpaths.METSHDR(root)[0].set(
+            'LASTMODDATE', datetime.datetime.now(
+                datetime.timezone.utc).replace(microsecond=0).isoformat())
+
+    # 9
+    if not plan.to_kdk:
+        with span(context, 'set_mdtype'):
+            root = set_mdtype(to_catalog, root, context=context)
+
+    # 10
+    if plan.old_no_validation_key:
+        with span(context, 'update_no_file_format_validation_key'):
+            root = update_no_file_format_validation_key(
+                root, full_cur_catalog, context=context)
+
+    # 11
+    # Regardless of the version, we fix fi-preservation- prefix anyway.
+    with span(context, 'fix_preservation_prefix'):
+        for elem in xpaths.PRESERVATION_PREFIX_FILES(root):
+            elem.attrib['USE'] = 'fi-dpres-no-file-format-validation'
+
+    with span(context, 'build_root'):
+        # 12
+        elems = []
+        for elem in xpaths.CHILDREN(root):
+            elems.append(elem)
+
+        # 13
+        new_mets = mets.mets(profile=root_attribs['PROFILE'],
+                             child_elements=elems,
+                             namespaces=context.namespaces)
+
+        # 14
+        for attrib in root_attribs:
+            new_mets.set(attrib, root_attribs[attrib])
+
+    return new_mets, root_attribs['OBJID']
+
+
+def update_root_attributes(root: ET._Element,
+                           to_catalog: str,
+                           full_cur_catalog: str,
+                           contract: str | None = None,
+                           context: MigrationContext | None = None
+                           ) -> ET._Attrib:
+    """Migrates the attributes of the METS root element, steps 2-7 of
+    migrate_mets. Only the attributes of the root are needed, so the
+    streaming migration calls this with a root that has no children yet.
+
+    :param root: The mets root as xml
+    :param to_catalog: The intended catalog version of the METS document
+    :param full_cur_catalog: The current full catalog version of the
+                             METS document
+    :param contract: The CONTRACTID of the METS document
+    :param context: Migration context, a new one is created if not
+                    given
+
+    :returns: Attributes from the METS root element
+    """
+    context = context or MigrationContext()
+
     # 2
     fi_ns = get_fi_ns(full_cur_catalog[:3])
 
@@ -164,7 +721,8 @@ def migrate_mets(root: ET._Element,
     root_attribs = root.attrib
 
     # 4
-    if root_attribs['PROFILE'] == 'http://www.kdk.fi/kdk-mets-profile' \
+    context.profile = root_attribs.get('PROFILE')
+    if root_attribs['PROFILE'] == KDK_PROFILE \
             and not VERSIONS[to_catalog]['KDK']:
         root_attribs['PROFILE'] = 'http://digitalpreservation.fi/' \
                   'mets-profiles/cultural-heritage'
@@ -183,49 +741,19 @@ def migrate_mets(root: ET._Element,
             'http://www.loc.gov/METS/ '
             'http://digitalpreservation.fi/schemas/mets/mets.xsd')
     # 7
-    root_attribs = set_contractid(to_catalog,
-                                  root,
-                                  contract,
-                                  fi_ns,
-                                  root_attribs,
-                                  full_cur_catalog)
-    # 8
-    root.xpath('./mets:metsHdr', namespaces=NAMESPACES)[0].set(
-        'LASTMODDATE', datetime.datetime.now(datetime.timezone.utc).replace(
-            microsecond=0).isoformat())
-
-    # 9
-    root = set_mdtype(to_catalog, root)
-
-    # 10
-    root = update_no_file_format_validation_key(root, full_cur_catalog)
-
-    # 11
-    # Regardless of the version, we fix fi-preservation- prefix anyway.
-    for elem in root.xpath(
-            './mets:fileSec/mets:fileGrp/mets:file[@USE='
-            '"fi-preservation-no-file-format-validation"]',
-            namespaces=NAMESPACES):
-        elem.attrib['USE'] = 'fi-dpres-no-file-format-validation'
-
-    # 12
-    elems = []
-    for elem in root.xpath('./*'):
-        elems.append(elem)
-
-    # 13
-    new_mets = mets.mets(profile=root_attribs['PROFILE'],
-                         child_elements=elems,
-                         namespaces=NAMESPACES)
-
-    # 14
-    for attrib in root_attribs:
-        new_mets.set(attrib, root_attribs[attrib])
-
-    return new_mets, root_attribs['OBJID']
-
-
-def fix_1_4_mets(root: ET._Element) -> ET._Element:
+    with span(context, 'set_contractid'):
+        return set_contractid(to_catalog,
+                              root,
+                              contract,
+                              fi_ns,
+                              root_attribs,
+                              full_cur_catalog,
+                              context=context)
+
+
+def fix_1_4_mets(root: ET._Element,
+                 context: MigrationContext | None = None
+                 ) -> ET._Element:
     """Migrates from catalog version 1.4 or 1.4.1 to newer by writing
     the following changes into the mets file:
     1) Adds the @MDTYPEVERSION attribute to all mets:mdWrap elements
@@ -236,36 +764,45 @@ def fix_1_4_mets(root: ET._Element) -> ET._Element:
     4) Adds a new div as parent div if structmap has several child divs
     5) Sets METSRIGHTS as OTHERMDTYPE
 
+    The steps share an index of the fileSec ADMID references, built
+    once for the document.
+
     :param root: The mets root as xml
+    :param context: Migration context, a new one is created if not
+                    given
 
     :return root: The mets root as xml
    """
-
-    NAMESPACES['textmd'] = 'http://www.kdk.fi/standards/textmd'
-
-    root = add_mdtypeversion(root)  # 1
-    root = set_charset_from_textmd(root)  # 2
-    for premis_mix in root.xpath(  # 3
-            './mets:amdSec/mets:techMD/mets:mdWrap/mets:xmlData/premis:object/'
-            'premis:objectCharacteristics/'
-            'premis:objectCharacteristicsExtension/mix:mix',
-            namespaces=NAMESPACES):
-        root = move_mix(root, premis_mix)
-    root = update_divs(root)  # 4
-    root = update_metsrights(root)  # 5
+    context = context or MigrationContext()
+    context.use_1_4_namespaces()
+    context.admid_index = AdmidIndex(root)
+
+    with span(context, 'add_mdtypeversion'):
+        root = add_mdtypeversion(root, context=context)  # 1
+    with span(context, 'set_charset_from_textmd'):
+        root = set_charset_from_textmd(root, context=context)  # 2
+    with span(context, 'move_mix'):
+        for premis_mix in xpaths.PREMIS_MIX(root):  # 3
+            root = move_mix(root, premis_mix, context=context)
+    with span(context, 'update_divs'):
+        root = update_divs(root, context=context)  # 4
+    with span(context, 'update_metsrights'):
+        root = update_metsrights(root, context=context)  # 5
 
     return root
 
 
-def add_mdtypeversion(root: ET._Element) -> ET._Element:
+def add_mdtypeversion(root: ET._Element,
+                      context: MigrationContext | None = None
+                      ) -> ET._Element:
     """Adds the @MDTYPEVERSION attribute to all mets:mdWrap elements.
 
     :param root: The mets root as xml
+    :param context: Migration context
 
     :return root: The mets root as xml
     """
-    for elem in root.xpath("./mets:amdSec/*/mets:mdWrap | ./mets:dmdSec/"
-                           "mets:mdWrap", namespaces=NAMESPACES):
+    for elem in xpaths.MDWRAPS(root):
         mdtype = elem.get('MDTYPE')
         if mdtype == 'OTHER':
             mdtype = elem.get('OTHERMDTYPE')
@@ -273,15 +810,16 @@ def add_mdtypeversion(root: ET._Element) -> ET._Element:
         # MODS version has to comply with version given in MODS metadata
         # If missing, use the default value already given.
         if mdtype == "MODS":
-            mods_version = elem.xpath("./mets:xmlData/mods:mods/@version",
-                                      namespaces=NAMESPACES)
+            mods_version = xpaths.MODS_VERSION(elem)
             if mods_version and mods_version[0].strip():
                 version = mods_version[0].strip()
         elem.set('MDTYPEVERSION', version)
     return root
 
 
-def set_charset_from_textmd(root: ET._Element) -> ET._Element:
+def set_charset_from_textmd(root: ET._Element,
+                            context: MigrationContext | None = None
+                            ) -> ET._Element:
     """Appends the charset from textMD metadata to the
     premis:formatName element if it is missing.
     The function will search for textMD metadata both
@@ -290,69 +828,77 @@ def set_charset_from_textmd(root: ET._Element) -> ET._Element:
     metadata for the techMD in question.
 
     :param root: The mets root as xml
+    :param context: Migration context, a new one using the catalog
+                    version 1.4 namespaces is created if not given
 
     :return root: The mets root as xml
    """
+    if context is None:
+        context = MigrationContext()
+        context.use_1_4_namespaces()
 
-    textfiles = collect_textfiles(root)
+    textfiles = collect_textfiles(root, context=context)
 
-    for textfile in root.xpath('./mets:amdSec/mets:techMD',
-                               namespaces=NAMESPACES):
+    for textfile in xpaths.TECHMDS(root):
         if (textfile.get('ID') in textfiles.keys() and
-                textfile.xpath("./mets:mdWrap[@MDTYPE='PREMIS:OBJECT']",
-                               namespaces=NAMESPACES)):
+                xpaths.PREMIS_OBJECT_MDWRAP(textfile)):
             file_id = textfile.get('ID')
             charset = textfiles[file_id]
-            formatname = textfile.xpath('.//premis:formatName',
-                                        namespaces=NAMESPACES)[0]
+            formatname = xpaths.FORMAT_NAME(textfile)[0]
             if '; charset' not in formatname.text:
                 formatname.text = formatname.text + '; charset=' + charset
 
-    for premis_textmd in root.xpath(
-            './mets:amdSec/mets:techMD/mets:mdWrap/mets:xmlData/premis:object/'
-            'premis:objectCharacteristics/'
-            'premis:objectCharacteristicsExtension/textmd:textMD',
-            namespaces=NAMESPACES):
-        charset = premis_textmd.xpath(".//*[local-name() = 'charset']")[0].text
-        format_name = premis_textmd.xpath(
-            './ancestor::premis:objectCharacteristics//premis:formatName',
-            namespaces=NAMESPACES)[0]
+    premis_textmds = xpaths.premis_textmd(context.namespaces['textmd'])
+    for premis_textmd in premis_textmds(root):
+        charset = xpaths.CHARSET(premis_textmd)[0].text
+        format_name = xpaths.ANCESTOR_FORMAT_NAME(premis_textmd)[0]
         if '; charset' not in format_name.text:
             format_name.text = format_name.text + '; charset=' + charset
 
     return root
 
 
-def collect_textfiles(root: ET.Element) -> dict:
-    """Collects all textfiles from the METS document.
+def collect_textfiles(root: ET._Element,
+                      context: MigrationContext | None = None
+                      ) -> dict:
+    """Collects all textfiles from the METS document. A file referring
+    to several textMD blocks gets the charset of the last one in the
+    amdSec, and an ID referred to by several files the charset of the
+    last one of those files in the fileSec.
 
     :param root: The mets root as xml
+    :param context: Migration context holding the ADMID index
 
     :returns: dict of textfiles
     """
+    index = get_admid_index(root, context)
 
     textmds = {}
-    for techmd in root.xpath('./mets:amdSec/mets:techMD',
-                             namespaces=NAMESPACES):
-        if techmd.xpath("./mets:mdWrap[@MDTYPE='TEXTMD']",
-                        namespaces=NAMESPACES):
-            charset = techmd.xpath(".//*[local-name() = 'charset']")[0].text
+    for techmd in xpaths.TECHMDS(root):
+        if xpaths.TEXTMD_MDWRAP(techmd):
+            charset = xpaths.CHARSET(techmd)[0].text
             techmd_id = techmd.get('ID')
             textmds[techmd_id] = charset
 
+    charsets = {}
+    for key, charset in textmds.items():
+        for mets_file in index.files(key):
+            charsets[mets_file] = charset
+
+    # The files are visited in fileSec order, so that the charset of an
+    # ID shared by several files does not depend on the amdSec order
     textfiles = {}
-    for mets_file in root.xpath('./mets:fileSec//mets:file',
-                                namespaces=NAMESPACES):
-        for key in textmds:
-            if key in mets_file.get('ADMID'):
-                charset = textmds[key]
-                for admid in mets_file.get('ADMID').split(' '):
-                    textfiles[admid] = charset
+    if charsets:
+        for mets_file in xpaths.FILES(root):
+            if mets_file in charsets:
+                for admid in mets_file.get('ADMID').split():
+                    textfiles[admid] = charsets[mets_file]
     return textfiles
 
 
 def move_mix(root: ET._Element,
-             premis_mix: ET._Element
+             premis_mix: ET._Element,
+             context: MigrationContext | None = None
              ) -> ET._Element:
     """Moves current MIX metadata block from
     premis:objectCharacteristicsExtension to an own mets:techMD
@@ -361,53 +907,76 @@ def move_mix(root: ET._Element,
 
     :root: The METS data as XML
     :premis_mix: The MIX metadata within premis
+    :context: Migration context holding the ADMID index
 
     :returns: The METS data root
     """
+    index = get_admid_index(root, context)
     mix_id = '_' + str(uuid4())
-    techmd_id = premis_mix.xpath('./ancestor::mets:techMD',
-                                 namespaces=NAMESPACES)[0].get('ID')
-    amdsec = root.xpath('.//mets:amdSec', namespaces=NAMESPACES)[0]
+    techmd_id = xpaths.ANCESTOR_TECHMD(premis_mix)[0].get('ID')
+    premis_extension = xpaths.ANCESTOR_EXTENSION(premis_mix)[0]
+    amdsec = xpaths.AMDSEC(root)[0]
 
-    xml_data = mets.xmldata(child_elements=[copy.deepcopy(premis_mix)])
+    # The MIX element itself is moved to the new techMD block, instead
+    # of a copy of it
+    xml_data = mets.xmldata(child_elements=[premis_mix])
     md_wrap = mets.mdwrap('NISOIMG', '2.0', child_elements=[xml_data])
     techmd = mets.techmd(mix_id, child_elements=[md_wrap])
     amdsec.append(techmd)
 
-    for mets_file in root.xpath('./mets:fileSec//mets:file',
-                                namespaces=NAMESPACES):
-        if techmd_id in mets_file.get('ADMID'):
-            mets_file.set('ADMID', mets_file.get('ADMID') + ' ' + mix_id)
+    for mets_file in index.files(techmd_id):
+        index.add_admid(mets_file, mix_id)
 
-    premis_extension = premis_mix.xpath(
-        './ancestor::premis:objectCharacteristicsExtension',
-        namespaces=NAMESPACES)[0]
     premis_extension.getparent().remove(premis_extension)
 
     return root
 
 
-def update_divs(root: ET._Element) -> ET._Element:
-    """Adds a new div as parent div if structmap has several child divs.
+def get_admid_index(root: ET._Element,
+                    context: MigrationContext | None = None
+                    ) -> AdmidIndex:
+    """Returns the ADMID index of the METS document. The index kept in
+    the migration context is reused if it was built for the same root.
 
     :param root: The mets root as xml
+    :param context: Migration context
 
-    :return root: The mets root as xml
+    :returns: The ADMID index
     """
-    list_amdsec = []
-    mets_amdsec = root.xpath('./mets:amdSec', namespaces=NAMESPACES)[0]
-    for elem in mets_amdsec:
-        list_amdsec.append(copy.deepcopy(elem))
-        mets_amdsec.remove(elem)
+    if context is None:
+        return AdmidIndex(root)
+    if context.admid_index is None or context.admid_index.root is not root:
+        context.admid_index = AdmidIndex(root)
+    return context.admid_index
 
-    list_amdsec.sort(key=mets.order)
 
-    for elem in list_amdsec:
+def update_divs(root: ET._Element,
+                context: MigrationContext | None = None
+                ) -> ET._Element:
+    """Adds a new div as parent div if structmap has several child divs.
+
+    :param root: The mets root as xml
+    :param context: Migration context
+
+    :return root: The mets root as xml
+    """
+    mets_amdsec = xpaths.AMDSEC(root)[0]
+    list_amdsec = list(mets_amdsec)
+    sorted_amdsec = sorted(list_amdsec, key=mets.order)
+
+    # The sort is stable, so the sections of the same type keep their
+    # order. Appending an element moves it to the end of the amdSec, so
+    # the elements are reordered in place from the first one out of
+    # order onwards.
+    first = 0
+    while first < len(list_amdsec) and \
+            list_amdsec[first] is sorted_amdsec[first]:
+        first += 1
+    for elem in sorted_amdsec[first:]:
         mets_amdsec.append(elem)
 
-    structmap = root.xpath('./mets:structMap', namespaces=NAMESPACES)[0]
-    if len(root.xpath('./mets:structMap/mets:div',
-                      namespaces=NAMESPACES)) > 1:
+    structmap = xpaths.STRUCTMAP(root)[0]
+    if len(xpaths.STRUCTMAP_DIVS(root)) > 1:
         div_elements = []
 
         for div in structmap:
@@ -419,16 +988,18 @@ def update_divs(root: ET._Element) -> ET._Element:
     return root
 
 
-def update_metsrights(root: ET._Element) -> ET._Element:
+def update_metsrights(root: ET._Element,
+                      context: MigrationContext | None = None
+                      ) -> ET._Element:
     """Sets METSRIGHTS as OTHERMDTYPE.
 
     :param root: The mets root as xml
+    :param context: Migration context
 
     :return root: The mets root as xml
     """
-    for rightsmd in root.xpath('./mets:amdSec/mets:rightsMD',
-                               namespaces=NAMESPACES):
-        mdwrap = rightsmd.xpath("./mets:mdWrap", namespaces=NAMESPACES)[0]
+    for rightsmd in xpaths.RIGHTSMDS(root):
+        mdwrap = xpaths.MDWRAP(rightsmd)[0]
         if mdwrap.get('MDTYPE') == 'METSRIGHTS':
             mdwrap.set('MDTYPE', 'OTHER')
             mdwrap.set('OTHERMDTYPE', 'METSRIGHTS')
@@ -442,6 +1013,7 @@ def set_contractid(to_catalog: str,
                    fi_ns: str,
                    root_attribs: ET._Attrib,
                    full_cur_catalog: str,
+                   context: MigrationContext | None = None
                    ) -> ET._Attrib:
     """Adds CONTRACTID and migrates old KDK specific profile data if
     to_catalog specifies a newer non-KDK profile
@@ -453,15 +1025,18 @@ def set_contractid(to_catalog: str,
     :param root_attribs: Attributes from the METS root element
     :param full_cur_catalog: The current full catalog version of the
                              METS document
+    :param context: Migration context, a new one is created if not
+                    given
 
     :returns: Attributes from the METS root element
     """
+    context = context or MigrationContext()
     contractid = ''
     if not VERSIONS[to_catalog]['KDK']:
         if '{%s}CONTRACTID' % fi_ns in root.attrib:
             contractid = root.get('{%s}CONTRACTID' % fi_ns)
             if contract:
-                print(
+                context.warn(
                         "Warning: the argument contract with the value "
                         f"{contract} was ignored. The existing @CONTRACTID of "
                         f"the METS file,{contractid} was not overwritten."
@@ -470,39 +1045,37 @@ def set_contractid(to_catalog: str,
             contractid = contract
         root_attribs['{%s}CONTRACTID' % fi_ns] = contractid
 
-        for elem in root.xpath(
-                './mets:amdSec/mets:digiprovMD/'
-                'mets:mdRef[@OTHERMDTYPE="KDKPreservationPlan"]',
-                namespaces=NAMESPACES):
+        for elem in xpaths.KDK_PRESERVATION_PLANS(root):
             elem.set('OTHERMDTYPE', 'FiPreservationPlan')
 
     elif contract:
-        print(
+        context.warn(
                 f"Warning: the argument contract {contract} was ignored. "
                 f"The requested catalog version {to_catalog} does not support "
                 "@CONTRACTID."
             )
 
     if not VERSIONS[full_cur_catalog[:3]]['KDK']:
-        NAMESPACES['fi'] = ('http://digitalpreservation.fi/schemas'
-                            '/mets/fi-extensions')
+        context.namespaces['fi'] = ('http://digitalpreservation.fi/schemas'
+                                    '/mets/fi-extensions')
     else:
-        NAMESPACES['fi'] = 'http://www.kdk.fi/standards/mets/kdk-extensions'
+        context.namespaces['fi'] = ('http://www.kdk.fi/standards/mets/'
+                                    'kdk-extensions')
     return root_attribs
 
 
-def set_mdtype(to_catalog, root):
+def set_mdtype(to_catalog, root, context=None):
     """ Sets MDTYPE
 
     :param to_catalog: The intended catalog version of the METS document
     :param root: The mets root as xml
+    :param context: Migration context
 
     :returns: The mets root as xml
 
     """
     if not VERSIONS[to_catalog]['KDK']:
-        for elem in root.xpath('./mets:dmdSec/mets:mdWrap[./@MDTYPE="MARC"]',
-                               namespaces=NAMESPACES):
+        for elem in xpaths.MARC_MDWRAPS(root):
             attr = elem.attrib
             if 'marc=finmarc' in attr['MDTYPEVERSION']:
                 attr['MDTYPE'] = 'OTHER'
@@ -510,9 +1083,11 @@ def set_mdtype(to_catalog, root):
     return root
 
 
-def update_no_file_format_validation_key(root: ET._Element,
-                                         full_cur_catalog: str
-                                         ) -> ET._Element:
+def update_no_file_format_validation_key(
+        root: ET._Element,
+        full_cur_catalog: str,
+        context: MigrationContext | None = None
+) -> ET._Element:
     """If the old term no-file-format-validation (without prefix) is used in
     METS with specification 1.7.3 or newer, then it's there for other
     purposes not related to DPS.
@@ -520,22 +1095,35 @@ def update_no_file_format_validation_key(root: ET._Element,
     :param root: The mets root as xml
     :param full_cur_catalog: The current full catalog version of the
                              METS document
+    :param context: Migration context
 
     :returns: The mets root as xml
     """
-    versions = ['1.7.0', '1.7.1', '1.7.2']
-    if (VERSIONS[full_cur_catalog[:3]]['KDK'] or full_cur_catalog in versions):
-        for elem in root.xpath(
-                './mets:fileSec/mets:fileGrp/mets:file[@USE='
-                '"no-file-format-validation"]', namespaces=NAMESPACES):
+    if has_old_no_validation_key(full_cur_catalog):
+        for elem in xpaths.NO_VALIDATION_FILES(root):
             elem.attrib['USE'] = 'fi-dpres-no-file-format-validation'
     return root
 
 
+def has_old_no_validation_key(full_cur_catalog: str) -> bool:
+    """Tells whether the term no-file-format-validation (without prefix)
+    in the METS document means the DPS key, see
+    update_no_file_format_validation_key.
+
+    :param full_cur_catalog: The current full catalog version of the
+                             METS document
+
+    :returns: True if the key should be updated
+    """
+    return (VERSIONS[full_cur_catalog[:3]]['KDK'] or
+            full_cur_catalog in OLD_NO_VALIDATION_KEY_VERSIONS)
+
+
 def transform_to_dip(root: ET._Element,
                      cur_catalog: str,
                      to_catalog: str,
-                     objid: str = None
+                     objid: str = None,
+                     context: MigrationContext | None = None
                      ) -> tuple[ET._Element, str]:
     """ Migrates the METS document
     1) Sets an @OBJID for the METS document
@@ -547,25 +1135,46 @@ def transform_to_dip(root: ET._Element,
     :param cur_catalog: Mets document version
     :param to_catalog: The intended catalog version of the METS document
     :param objid: Object ID
+    :param context: Migration context, a new one is created if not
+                    given
 
     :returns: Updated `root` and `objid`
     """
-    fi_ns = get_fi_ns(cur_catalog)
+    context = context or MigrationContext()
 
     if not objid:
         objid = str(uuid4())
 
-    root = remove_attributes(root)
+    with span(context, 'remove_attributes'):
+        root = remove_attributes(root, context=context)
+
+    with span(context, 'set_dip_metshdr'):
+        root = set_dip_metshdr(root, context=context)
 
-    root = set_dip_metshdr(root)
+    with span(context, 'set_dip_root_attributes'):
+        set_dip_root_attributes(root, cur_catalog, to_catalog, objid)
 
+    return root, objid
+
+
+def set_dip_root_attributes(root: ET._Element,
+                            cur_catalog: str,
+                            to_catalog: str,
+                            objid: str) -> None:
+    """Sets the CATALOG attribute instead of SPECIFICATION and the new
+    OBJID to the METS root, step 4 of transform_to_dip.
+
+    :param root: The mets root as xml
+    :param cur_catalog: Mets document version
+    :param to_catalog: The intended catalog version of the METS document
+    :param objid: Object ID
+    """
+    fi_ns = get_fi_ns(cur_catalog)
     root.set('{%s}CATALOG' % fi_ns, VERSIONS[to_catalog]['catalog_version'])
     if '{%s}SPECIFICATION' % fi_ns in root.attrib:
         del root.attrib['{%s}SPECIFICATION' % fi_ns]
     root.set('OBJID', objid)
 
-    return root, objid
-
 
 def get_fi_ns(catalog: str) -> str:
     """Returns the namespace for the fi: extension. The value depends
@@ -584,52 +1193,60 @@ def get_fi_ns(catalog: str) -> str:
     return fi_ns
 
 
-def remove_attributes(root: ET._Element) -> ET._Element:
+def remove_attributes(root: ET._Element,
+                      context: MigrationContext | None = None
+                      ) -> ET._Element:
     """Removes unsupported attributes from the METS file.
 
     :param root: The mets root as xml
+    :param context: Migration context
 
     :return root: The mets root as xml
     """
-
-    for key in ATTRIBS_TO_DELETE:
-        for elem in root.xpath(f"./{key}", namespaces=NAMESPACES):
-            for value in ATTRIBS_TO_DELETE[key]:
-                if value in elem.attrib:
-                    del elem.attrib[value]
+    strip_attributes(root)
 
     return root
 
 
-def set_dip_metshdr(root: ET._Element) -> ET._Element:
+def set_dip_metshdr(root: ET._Element,
+                    context: MigrationContext | None = None
+                    ) -> ET._Element:
     """Sets the new mets metsHdr. Changes the CREATEDATE attribute and
     optionally the RECORDSTATUS attribute. Sets the agent responsible for
     the creation of the transformed mets file. Removes other attributes
     for the metsHdr element.
 
     :param root: The mets root as xlm
+    :param context: Migration context
 
     :returns: The mets root as xlm
     """
-
-    for hdr in root.xpath('./mets:metsHdr', namespaces=NAMESPACES):
-        for docid in hdr.xpath('./mets:metsDocumentID', namespaces=NAMESPACES):
-            hdr.remove(docid)
-        for agent in hdr.xpath('./mets:agent', namespaces=NAMESPACES):
-            hdr.remove(agent)
-        agent = mets.agent('CSC - IT Center for Science Ltd.')
-        hdr.append(agent)
-
-        hdr.set(
-            'CREATEDATE',
-            datetime.datetime.now(datetime.timezone.utc).replace(
-                microsecond=0).isoformat())
-        hdr.set('RECORDSTATUS', 'dissemination')
-        if 'LASTMODDATE' in hdr.attrib:
-            del hdr.attrib['LASTMODDATE']
+    for hdr in xpaths.METSHDR(root):
+        update_dip_metshdr(hdr)
     return root
 
 
+def update_dip_metshdr(hdr: ET._Element) -> None:
+    """Updates a single metsHdr element for set_dip_metshdr.
+
+    :param hdr: The metsHdr element
+    """
+    for docid in xpaths.METS_DOCUMENT_IDS(hdr):
+        hdr.remove(docid)
+    for agent in xpaths.AGENTS(hdr):
+        hdr.remove(agent)
+    agent = mets.agent('CSC - IT Center for Science Ltd.')
+    hdr.append(agent)
+
+    hdr.set(
+        'CREATEDATE',
+        datetime.datetime.now(datetime.timezone.utc).replace(
+            microsecond=0).isoformat())
+    hdr.set('RECORDSTATUS', 'dissemination')
+    if 'LASTMODDATE' in hdr.attrib:
+        del hdr.attrib['LASTMODDATE']
+
+
 def serialize_mets(root: ET._Element) -> bytes:
     """Serializes the METS XML data to byte string. Then replaces some
     namespace declarations, since that can't be done in lxml.
@@ -638,24 +1255,44 @@ def serialize_mets(root: ET._Element) -> bytes:
 
     :returns: METS data as byte string
     """
-
     mets_b = xml_helpers.utils.encode_utf8(xml_helpers.utils.serialize(root))
+    for old, new in namespace_replacements(xpaths.CATALOG_VERSION(root)[0]):
+        mets_b = mets_b.replace(old, new)
+    return mets_b
 
-    mets_b = mets_b.replace(
-        b'xmlns:textmd="http://www.kdk.fi/standards/textmd"',
-        b'xmlns:textmd="info:lc/xmlns/textMD-v3"')
 
-    version = root.xpath('@*[local-name() = "CATALOG"] | '
-                         '@*[local-name() = "SPECIFICATION"]')[0]
+def write_mets(root: ET._Element, outfile) -> None:
+    """Serializes the METS XML data with serialize_mets and writes it to
+    a file in chunks, so that a compressing or unbuffered output is
+    never handed the whole document at once.
 
-    if version in ['1.7.0', '1.7.1', '1.7.2', '1.7.3', '1.7.4', '1.7.5',
-                   '1.7.6', '1.7.7']:
-        mets_b = mets_b.replace(
+    :param root: The mets root as xml
+    :param outfile: Binary file object to write the METS data to
+    """
+    data = memoryview(serialize_mets(root))
+    for start in range(0, len(data), WRITE_CHUNK):
+        outfile.write(data[start:start + WRITE_CHUNK])
+
+
+@functools.lru_cache(maxsize=None)
+def namespace_replacements(version: str) -> tuple[tuple[bytes, bytes], ...]:
+    """Returns the namespace declarations to replace in the serialized
+    METS document. The result is cached per version.
+
+    :param version: The catalog version of the migrated METS document
+
+    :returns: Tuple of (old, new) byte strings
+    """
+    replacements = [(b'xmlns:textmd="http://www.kdk.fi/standards/textmd"',
+                     b'xmlns:textmd="info:lc/xmlns/textMD-v3"')]
+
+    if version in FI_NAMESPACE_VERSIONS:
+        replacements.append((
             b'xmlns:fi="http://www.kdk.fi/standards/mets/kdk-extensions"',
             b'xmlns:fi="http://digitalpreservation.fi/'
-            b'schemas/mets/fi-extensions"')
+            b'schemas/mets/fi-extensions"'))
 
-    return mets_b
+    return tuple(replacements)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,87 @@
+"""Precompiled XPath queries used by transform_mets. The queries are
+compiled once at import time and bound to the static prefixes of the
+NAMESPACES dict, so they are not parsed again for every document or
+every element in a loop.
+
+lxml serializes calls to a single XPath object with an internal lock,
+so the queries can be shared between threads.
+"""
+
+from __future__ import annotations
+import functools
+
+import lxml.etree as ET
+from dpres_specification_migrator.dicts import NAMESPACES
+
+
+def _compile(path: str) -> ET.XPath:
+    """Compiles an XPath query bound to the METS namespace prefixes.
+
+    :param path: XPath expression
+
+    :returns: Compiled XPath query
+    """
+    return ET.XPath(path, namespaces=NAMESPACES)
+
+
+# Catalog version of the METS root
+CATALOG_VERSION = _compile('@*[local-name() = "CATALOG"] | '
+                           '@*[local-name() = "SPECIFICATION"]')
+
+# Queries from the METS root
+CHILDREN = _compile('./*')
+METSHDR = _compile('./mets:metsHdr')
+AMDSEC = _compile('./mets:amdSec')
+STRUCTMAP = _compile('./mets:structMap')
+STRUCTMAP_DIVS = _compile('./mets:structMap/mets:div')
+TECHMDS = _compile('./mets:amdSec/mets:techMD')
+RIGHTSMDS = _compile('./mets:amdSec/mets:rightsMD')
+MDWRAPS = _compile('./mets:amdSec/*/mets:mdWrap | ./mets:dmdSec/mets:mdWrap')
+MARC_MDWRAPS = _compile('./mets:dmdSec/mets:mdWrap[./@MDTYPE="MARC"]')
+KDK_PRESERVATION_PLANS = _compile(
+    './mets:amdSec/mets:digiprovMD/'
+    'mets:mdRef[@OTHERMDTYPE="KDKPreservationPlan"]')
+FILES = _compile('./mets:fileSec//mets:file')
+NO_VALIDATION_FILES = _compile(
+    './mets:fileSec/mets:fileGrp/mets:file[@USE='
+    '"no-file-format-validation"]')
+PRESERVATION_PREFIX_FILES = _compile(
+    './mets:fileSec/mets:fileGrp/mets:file[@USE='
+    '"fi-preservation-no-file-format-validation"]')
+PREMIS_MIX = _compile(
+    './mets:amdSec/mets:techMD/mets:mdWrap/mets:xmlData/premis:object/'
+    'premis:objectCharacteristics/'
+    'premis:objectCharacteristicsExtension/mix:mix')
+
+# Queries from elements within the METS document
+MDWRAP = _compile('./mets:mdWrap')
+PREMIS_OBJECT_MDWRAP = _compile("./mets:mdWrap[@MDTYPE='PREMIS:OBJECT']")
+TEXTMD_MDWRAP = _compile("./mets:mdWrap[@MDTYPE='TEXTMD']")
+MODS_VERSION = _compile('./mets:xmlData/mods:mods/@version')
+FORMAT_NAME = _compile('.//premis:formatName')
+CHARSET = _compile(".//*[local-name() = 'charset']")
+METS_DOCUMENT_IDS = _compile('./mets:metsDocumentID')
+AGENTS = _compile('./mets:agent')
+ANCESTOR_TECHMD = _compile('./ancestor::mets:techMD')
+ANCESTOR_EXTENSION = _compile(
+    './ancestor::premis:objectCharacteristicsExtension')
+ANCESTOR_FORMAT_NAME = _compile(
+    './ancestor::premis:objectCharacteristics//premis:formatName')
+
+
+@functools.lru_cache(maxsize=None)
+def premis_textmd(textmd_ns: str) -> ET.XPath:
+    """Returns the query for textMD metadata within the PREMIS object
+    characteristics extension. The textmd prefix is the only one that
+    depends on the migration context, so the query is compiled once per
+    textMD namespace.
+
+    :param textmd_ns: The textMD namespace of the migration context
+
+    :returns: Compiled XPath query
+    """
+    return ET.XPath(
+        './mets:amdSec/mets:techMD/mets:mdWrap/mets:xmlData/premis:object/'
+        'premis:objectCharacteristics/'
+        'premis:objectCharacteristicsExtension/textmd:textMD',
+        namespaces=dict(NAMESPACES, textmd=textmd_ns))
@@ -10,7 +10,7 @@ def main():
     """Install dpres-specification-migrator"""
     setup(
         name='dpres-specification-migrator',
-        packages=find_packages(exclude=['tests', 'tests.*']),
+        packages=find_packages(exclude=['tests', 'tests.*', 'benchmarks']),
         include_package_data=True,
         version=get_version(),
         install_requires=[
@@ -0,0 +1,140 @@
+"""Tests for the aio module."""
+
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+import pytest
+
+import lxml.etree as ET
+
+from dpres_specification_migrator.aio import AsyncMigrator, migrate_async
+from dpres_specification_migrator.api import Migrator
+from dpres_specification_migrator.transform_mets import MigrationError
+
+TESTAIP_1_6 = 'tests/data/mets/mets_1_6.xml'
+TESTAIP_1_7 = 'tests/data/mets/mets_1_7.xml'
+
+
+class SlowMigrator(Migrator):
+    """Migrator that records how many migrations run at a time."""
+
+    def __init__(self, delay=0.05, **kwargs):
+        super().__init__(**kwargs)
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.started = []
+
+    def migrate(self, source, outfile=None):
+        """Migrates the document slowly."""
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            self.started.append(source)
+        try:
+            time.sleep(self.delay)
+            return super().migrate(source, outfile=outfile)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+def test_migrate_async():
+    """Tests migrating a single document without blocking the loop."""
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.001)
+
+        task = asyncio.ensure_future(ticker())
+        result = await migrate_async(
+            TESTAIP_1_6, migrator=SlowMigrator(contractid='urn:uuid:x'))
+        task.cancel()
+        return result, ticks
+
+    result, ticks = asyncio.run(run())
+    assert ET.fromstring(result.data).get('OBJID') == result.objid
+    assert ticks > 5
+
+
+def test_concurrency_limit():
+    """Tests that at most max_concurrency migrations are in flight and
+    that the results are in input order.
+    """
+    migrator = SlowMigrator(contractid='urn:uuid:x')
+    sources = [TESTAIP_1_6, TESTAIP_1_7] * 5
+
+    async def run():
+        async with AsyncMigrator(migrator, max_concurrency=3) as aio:
+            return [result async for result in aio.migrate_many(
+                (source, None) for source in sources)]
+
+    results = asyncio.run(run())
+    assert migrator.max_running == 3
+    assert [result.plan.full_cur_catalog for result in results] == [
+        '1.6.1', '1.7.0'] * 5
+
+
+def test_migrate_many_exceptions():
+    """Tests yielding or raising the exceptions of failed migrations."""
+    jobs = [(TESTAIP_1_6, None), (TESTAIP_1_7, None)]
+
+    async def run(return_exceptions):
+        async with AsyncMigrator(Migrator()) as aio:
+            return [result async for result in aio.migrate_many(
+                jobs, return_exceptions=return_exceptions)]
+
+    results = asyncio.run(run(True))
+    assert isinstance(results[0], MigrationError)
+    assert results[1].objid == 'b1d22c00-d28b-4a79-bfa1-b86c37cd10dd'
+
+    with pytest.raises(MigrationError):
+        asyncio.run(run(False))
+
+
+def test_cancellation():
+    """Tests that a cancelled migration that has not started is not run,
+    and that a running one keeps its slot until it is finished.
+    """
+    migrator = SlowMigrator(delay=0.2, contractid='urn:uuid:x')
+
+    async def run():
+        aio = AsyncMigrator(migrator, max_concurrency=1)
+        running = asyncio.ensure_future(aio.migrate(TESTAIP_1_6))
+        waiting = asyncio.ensure_future(aio.migrate(TESTAIP_1_7))
+        await asyncio.sleep(0.05)
+        running.cancel()
+        waiting.cancel()
+        await asyncio.sleep(0)
+        in_flight = aio.in_flight
+        await asyncio.sleep(0.3)
+        await aio.close()
+        return in_flight, aio.in_flight
+
+    in_flight, finally_in_flight = asyncio.run(run())
+    assert in_flight == 1
+    assert finally_in_flight == 0
+    assert migrator.started == [TESTAIP_1_6]
+
+
+def test_process_executor():
+    """Tests running the migrations in worker processes."""
+    with open(TESTAIP_1_7, 'rb') as infile:
+        mets_b = infile.read()
+
+    async def run():
+        with concurrent.futures.ProcessPoolExecutor(max_workers=2) as pool:
+            aio = AsyncMigrator(Migrator(), max_concurrency=2, executor=pool)
+            return await asyncio.gather(aio.migrate(mets_b),
+                                        aio.migrate(TESTAIP_1_7))
+
+    results = asyncio.run(run())
+    assert [result.method for result in results] == ['dom', 'dom']
+    assert results[0].objid == results[1].objid
@@ -0,0 +1,158 @@
+"""Tests for the api module."""
+
+import concurrent.futures
+import io
+import os
+
+import pytest
+
+import lxml.etree as ET
+
+from dpres_specification_migrator.api import Migrator
+from dpres_specification_migrator.context import MigrationContext
+from dpres_specification_migrator.transform_mets import (MigrationError,
+                                                         migrate_mets,
+                                                         serialize_mets)
+from tests.conftest import canonical
+
+TESTAIP_1_4 = 'tests/data/mets/mets_1_4.xml'
+TESTAIP_1_6 = 'tests/data/mets/mets_1_6.xml'
+TESTAIP_1_7 = 'tests/data/mets/mets_1_7.xml'
+
+
+def _read(path):
+    """Returns the contents of a file."""
+    with open(path, 'rb') as infile:
+        return infile.read()
+
+
+def _expected(path):
+    """Returns the document migrated with migrate_mets."""
+    root = ET.parse(path).getroot()
+    version = root.xpath('@*[local-name() = "CATALOG"] | '
+                         '@*[local-name() = "SPECIFICATION"]')[0]
+    migrated, _ = migrate_mets(root, '1.7', version,
+                               contract='urn:uuid:contract',
+                               context=MigrationContext(echo=False))
+    return canonical(serialize_mets(migrated))
+
+
+@pytest.mark.parametrize('source_type', ['bytes', 'file', 'tree', 'root',
+                                         'path'])
+def test_migrate_sources(source_type, capsys):
+    """Tests migrating the different kinds of sources in memory."""
+    source = {'bytes': lambda: _read(TESTAIP_1_6),
+              'file': lambda: io.BytesIO(_read(TESTAIP_1_6)),
+              'tree': lambda: ET.parse(TESTAIP_1_6),
+              'root': lambda: ET.parse(TESTAIP_1_6).getroot(),
+              'path': lambda: TESTAIP_1_6}[source_type]()
+
+    result = Migrator(contractid='urn:uuid:contract').migrate(source)
+
+    assert result.method == 'dom'
+    assert result.objid == 'b1d22c00-d28b-4a79-bfa1-b86c37cd10dd'
+    assert result.plan.key == ('1.6.1', '1.7', None, True)
+    assert 'update_profile' in result.plan.steps
+    assert set(result.timings) == {'read', 'migrate', 'write'}
+    assert canonical(result.data) == _expected(TESTAIP_1_6)
+    assert capsys.readouterr().out == ''
+
+
+def test_migrate_to_output(testpath):
+    """Tests writing the migrated document to a file object and to a
+    path in a new directory.
+    """
+    migrator = Migrator(contractid='urn:uuid:contract')
+    outfile = io.BytesIO()
+    result = migrator.migrate(_read(TESTAIP_1_6), outfile=outfile)
+    assert result.data is None
+    assert canonical(outfile.getvalue()) == _expected(TESTAIP_1_6)
+
+    outpath = os.path.join(testpath, 'new', 'mets.xml')
+    migrator.migrate(_read(TESTAIP_1_6), outfile=outpath)
+    assert canonical(_read(outpath)) == _expected(TESTAIP_1_6)
+
+
+def test_migrate_failure_writes_nothing(testpath):
+    """Tests that a document that can not be migrated raises
+    MigrationError and no output file is created.
+    """
+    outpath = os.path.join(testpath, 'mets.xml')
+    with pytest.raises(MigrationError):
+        Migrator().migrate(TESTAIP_1_6, outfile=outpath)
+    assert not os.path.exists(outpath)
+
+
+def test_migrate_warnings():
+    """Tests that the warnings are returned in the result."""
+    result = Migrator(contractid='urn:uuid:other', objid='new-id').migrate(
+        _read(TESTAIP_1_7))
+
+    assert len(result.warnings) == 2
+    assert result.warnings[0].startswith(
+        'Warning: the argument objid with the value new-id was ignored.')
+    assert 'urn:uuid:other was ignored' in result.warnings[1]
+
+
+def test_migrate_dissemination():
+    """Tests the OBJID policy of dissemination information packages."""
+    migrator = Migrator(contractid='urn:uuid:contract',
+                        record_status='dissemination')
+    first = migrator.migrate(_read(TESTAIP_1_6))
+    second = migrator.migrate(_read(TESTAIP_1_6))
+    assert first.objid != second.objid
+    assert ET.fromstring(first.data).get('OBJID') == first.objid
+
+    result = Migrator(contractid='urn:uuid:contract',
+                      record_status='dissemination',
+                      objid='dip-id').migrate(_read(TESTAIP_1_6))
+    assert result.objid == 'dip-id'
+    assert result.warnings == []
+
+
+def test_migrate_streaming_and_fast_path():
+    """Tests the streaming and fast path options. The fast path is only
+    used for paths, and 1.4 documents are not streamed.
+    """
+    streaming = Migrator(contractid='urn:uuid:contract', streaming=True)
+    result = streaming.migrate(io.BytesIO(_read(TESTAIP_1_6)))
+    assert result.method == 'streaming'
+    assert canonical(result.data) == _expected(TESTAIP_1_6)
+    assert streaming.migrate(_read(TESTAIP_1_4)).method == 'dom'
+
+    fast_path = Migrator(fast_path=True)
+    assert fast_path.migrate(TESTAIP_1_7).method == 'fast_path'
+    assert fast_path.migrate(_read(TESTAIP_1_7)).method == 'dom'
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_migrate_plan_profile(streaming):
+    """Tests that the plan of a migration updates the profile only if
+    the document has the KDK profile.
+    """
+    migrator = Migrator(contractid='urn:uuid:contract', streaming=streaming)
+    kdk = migrator.migrate(io.BytesIO(_read(TESTAIP_1_6)))
+    assert kdk.plan.kdk_profile
+    assert 'update_profile' in kdk.plan.steps
+
+    mets_b = _read(TESTAIP_1_6).replace(
+        b'http://www.kdk.fi/kdk-mets-profile',
+        b'http://digitalpreservation.fi/mets-profiles/cultural-heritage')
+    other = migrator.migrate(io.BytesIO(mets_b))
+    assert not other.plan.kdk_profile
+    assert 'update_profile' not in other.plan.steps
+
+    fast_path = Migrator(fast_path=True).migrate(TESTAIP_1_7)
+    assert fast_path.method == 'fast_path'
+    assert 'update_profile' not in fast_path.plan.steps
+
+
+def test_migrator_threads():
+    """Tests that a migrator can be shared between threads."""
+    migrator = Migrator(contractid='urn:uuid:contract')
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(
+            migrator.migrate, [_read(TESTAIP_1_6)] * 8))
+
+    assert {canonical(result.data) for result in results} == {
+        _expected(TESTAIP_1_6)}
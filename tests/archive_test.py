@@ -0,0 +1,157 @@
+"""Tests for the archive module."""
+
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+import lxml.etree as ET
+
+from dpres_specification_migrator.archive import (ArchiveError,
+                                                  archive_stem,
+                                                  find_member)
+from dpres_specification_migrator.transform_mets import main
+
+TESTAIP_1_6 = 'tests/data/mets/mets_1_6.xml'
+
+FI_PROFILE = 'http://digitalpreservation.fi/mets-profiles/cultural-heritage'
+
+MEMBERS = [('pkg/data/image.tif', b'\x00' * 1000),
+           ('pkg/mets.xml', None),
+           ('pkg/data/sub/mets.xml', b'<not-the-mets/>')]
+
+
+def read_file(path):
+    """Returns the contents of a file."""
+    with open(path, 'rb') as infile:
+        return infile.read()
+
+
+def make_tar(path, mode):
+    """Writes a tar package of MEMBERS, with the 1.6 test document as
+    the METS document.
+    """
+    with tarfile.open(path, mode) as package:
+        directory = tarfile.TarInfo('pkg/data')
+        directory.type = tarfile.DIRTYPE
+        package.addfile(directory)
+        for name, data in MEMBERS:
+            data = data or read_file(TESTAIP_1_6)
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            package.addfile(info, io.BytesIO(data))
+
+
+def make_zip(path):
+    """Writes a zip package of MEMBERS, with the 1.6 test document as
+    the METS document.
+    """
+    with zipfile.ZipFile(path, 'w') as package:
+        package.writestr('pkg/data/', b'')
+        for name, data in MEMBERS:
+            package.writestr(name, data or read_file(TESTAIP_1_6),
+                             compress_type=(zipfile.ZIP_STORED
+                                            if name.endswith('.tif')
+                                            else zipfile.ZIP_DEFLATED))
+
+
+def test_archive_stem():
+    """Tests removing the archive suffixes."""
+    assert archive_stem('/a/pkg.tar.gz') == 'pkg'
+    assert archive_stem('pkg.1.ZIP') == 'pkg.1'
+
+
+def test_find_member():
+    """Tests that the shallowest matching member is the METS
+    document.
+    """
+    assert find_member([name for name, _ in MEMBERS], 'mets.xml') == (
+        'pkg/mets.xml')
+    with pytest.raises(ArchiveError):
+        find_member(['pkg/data/image.tif'], 'mets.xml')
+
+
+@pytest.mark.parametrize('suffix', ['.tar', '.tar.gz', '.tar.xz', '.zip'])
+def test_output_archive(testpath, suffix):
+    """Tests migrating the METS document of a package into a copy of
+    the package.
+    """
+    path = os.path.join(testpath, 'pkg' + suffix)
+    if suffix == '.zip':
+        make_zip(path)
+    else:
+        make_tar(path, 'w:' + suffix[5:])
+    workspace = os.path.join(testpath, 'workspace')
+    assert main([path, '--workspace', workspace, '--contractid',
+                 'urn:uuid:contract', '--output_archive']) == 0
+
+    outpath = os.path.join(workspace, 'pkg' + suffix)
+    if suffix == '.zip':
+        with zipfile.ZipFile(outpath) as package:
+            names = package.namelist()
+            members = {name: package.read(name) for name in names}
+            assert package.getinfo('pkg/data/image.tif').compress_type == (
+                zipfile.ZIP_STORED)
+    else:
+        with tarfile.open(outpath) as package:
+            assert package.getmember('pkg/data').isdir()
+            names = package.getnames()
+            members = {member.name: package.extractfile(member).read()
+                       for member in package if member.isfile()}
+    assert [name.rstrip('/') for name in names] == ['pkg/data'] + [
+        name for name, _ in MEMBERS]
+    assert members['pkg/data/image.tif'] == MEMBERS[0][1]
+    assert members['pkg/data/sub/mets.xml'] == MEMBERS[2][1]
+    assert ET.fromstring(members['pkg/mets.xml']).get('PROFILE') == (
+        FI_PROFILE)
+
+
+def test_plain_output(testpath):
+    """Tests migrating the METS document of a package into a plain
+    file in a directory named after the package.
+    """
+    path = os.path.join(testpath, 'pkg.tar')
+    make_tar(path, 'w')
+    workspace = os.path.join(testpath, 'workspace')
+    assert main([path, '--workspace', workspace, '--contractid',
+                 'urn:uuid:contract']) == 0
+    root = ET.parse(os.path.join(workspace, 'pkg', 'mets.xml')).getroot()
+    assert root.get('PROFILE') == FI_PROFILE
+
+
+@pytest.mark.parametrize('suffix', ['.tar', '.zip'])
+def test_duplicate_member(testpath, capsys, suffix):
+    """Tests that a package with a repeated member name fails without
+    writing the new package.
+    """
+    path = os.path.join(testpath, 'pkg' + suffix)
+    data = read_file(TESTAIP_1_6)
+    if suffix == '.zip':
+        with zipfile.ZipFile(path, 'w') as package:
+            package.writestr('pkg/mets.xml', data)
+            with pytest.warns(UserWarning):
+                package.writestr('pkg/mets.xml', data)
+    else:
+        with tarfile.open(path, 'w') as package:
+            for _ in range(2):
+                info = tarfile.TarInfo('pkg/mets.xml')
+                info.size = len(data)
+                package.addfile(info, io.BytesIO(data))
+    workspace = os.path.join(testpath, 'workspace')
+    assert main([path, '--workspace', workspace, '--contractid',
+                 'urn:uuid:contract', '--output_archive']) == 117
+    assert 'ArchiveError: Duplicate member pkg/mets.xml' in (
+        capsys.readouterr().err)
+    assert os.listdir(workspace) == []
+
+
+def test_no_mets(testpath, capsys):
+    """Tests that a package without a METS document fails."""
+    path = os.path.join(testpath, 'pkg.zip')
+    with zipfile.ZipFile(path, 'w') as package:
+        package.writestr('image.tif', b'')
+    assert main([path, '--workspace', testpath]) == 117
+    assert 'ArchiveError: No member matching mets.xml' in (
+        capsys.readouterr().err)
@@ -0,0 +1,161 @@
+"""Tests for the attributes module."""
+
+import copy
+import sys
+
+import lxml.etree as ET
+import pytest
+
+from dpres_specification_migrator.attributes import (ENTRIES, NO_RULES,
+                                                     attribs_to_delete,
+                                                     get_entry, parse_path,
+                                                     strip_attributes)
+from dpres_specification_migrator.context import MigrationContext
+from dpres_specification_migrator.dicts import ATTRIBS_TO_DELETE, NAMESPACES
+from dpres_specification_migrator.transform_mets import migrate_mets
+
+METSFILES = ['tests/data/mets/mets_1_4.xml',
+             'tests/data/mets/mets_1_4_extensions.xml',
+             'tests/data/mets/mets_1_4_textmd.xml',
+             'tests/data/mets/mets_1_6.xml',
+             'tests/data/mets/mets_1_7.xml']
+
+METS = '{%s}' % NAMESPACES['mets']
+
+NESTED = b"""<mets:mets xmlns:mets="http://www.loc.gov/METS/"
+    xmlns:xlink="http://www.w3.org/1999/xlink" ID="r" TYPE="t">
+  <mets:fileSec ID="fs">
+    <mets:fileGrp ID="g1" VERSDATE="d">
+      <mets:fileGrp ID="g2" ADMID="a">
+        <mets:file ID="f1" SIZE="1" CHECKSUM="c">
+          <mets:FLocat ID="l1" xlink:role="r"/>
+        </mets:file>
+      </mets:fileGrp>
+      <!-- comment -->
+      <mets:file ID="f2" SIZE="2" CHECKSUM="c">
+        <mets:FLocat ID="l2" xlink:role="r"/>
+      </mets:file>
+    </mets:fileGrp>
+  </mets:fileSec>
+  <mets:structMap ID="s">
+    <mets:div xlink:label="a" ID="d1">
+      <mets:div xlink:label="b">
+        <mets:fptr ID="p1" CONTENTIDS="c" FILEID="f1"/>
+        <mets:div xlink:label="c">
+          <mets:mptr ID="p2" CONTENTIDS="c" xlink:role="r"/>
+        </mets:div>
+      </mets:div>
+    </mets:div>
+  </mets:structMap>
+</mets:mets>"""
+
+
+def _xpath_remove_attributes(root):
+    """The original implementation of transform_mets.remove_attributes,
+    one XPath search per path of ATTRIBS_TO_DELETE.
+    """
+    for key, attribs in ATTRIBS_TO_DELETE.items():
+        for elem in root.xpath(f'./{key}', namespaces=NAMESPACES):
+            for value in attribs:
+                if value in elem.attrib:
+                    del elem.attrib[value]
+
+
+def _documents():
+    """Yields the METS roots of the test corpus, both as they are and
+    migrated to the newest catalog version.
+    """
+    for metsfile in METSFILES:
+        root = ET.parse(metsfile).getroot()
+        yield metsfile, root
+        version = root.xpath('@*[local-name() = "CATALOG"] | '
+                             '@*[local-name() = "SPECIFICATION"]')[0]
+        migrated, _ = migrate_mets(copy.deepcopy(root), '1.7', version,
+                                   contract='urn:uuid:contract',
+                                   context=MigrationContext(echo=False))
+        yield metsfile + ' migrated', migrated
+    yield 'nested', ET.fromstring(NESTED)
+
+
+@pytest.mark.parametrize(('name', 'root'), list(_documents()))
+def test_strip_attributes_matches_xpath(name, root):
+    """Tests that the single walk removes exactly the same attributes as
+    the XPath searches.
+    """
+    expected = copy.deepcopy(root)
+    _xpath_remove_attributes(expected)
+    strip_attributes(root)
+
+    assert ET.tostring(root, method='c14n') == \
+        ET.tostring(expected, method='c14n'), name
+
+
+def test_nested_elements():
+    """Tests the descendant and child steps on nested structures."""
+    root = ET.fromstring(NESTED)
+    strip_attributes(root)
+
+    assert root.attrib == {}
+    assert root.xpath('//mets:fileGrp/@ID', namespaces=NAMESPACES) == ['g2']
+    assert root.xpath('//mets:file/@SIZE', namespaces=NAMESPACES) == ['1']
+    assert root.xpath('//mets:div/@xlink:label', namespaces=NAMESPACES) == []
+    assert root.xpath('//@CONTENTIDS') == []
+
+
+def test_attribs_to_delete():
+    """Tests resolving the attributes and the pruning of subtrees."""
+    assert parse_path('mets:structMap//mets:div') == (
+        (False, METS + 'structMap'), (True, METS + 'div'))
+
+    attribs, descend = attribs_to_delete((METS + 'amdSec', METS + 'techMD'))
+    assert attribs == ('ADMID', 'STATUS')
+    assert descend
+
+    attribs, descend = attribs_to_delete(
+        (METS + 'amdSec', METS + 'techMD', METS + 'mdWrap'))
+    assert 'CHECKSUM' in attribs
+    assert not descend
+
+    attribs, descend = attribs_to_delete(
+        (METS + 'structMap', METS + 'div', METS + 'div', METS + 'div'))
+    assert attribs == ('{http://www.w3.org/1999/xlink}label',)
+    assert descend
+
+
+def _deep_structmap(depth, other):
+    """Returns a METS root with a structMap of divs nested `depth` deep,
+    each with a child element of a distinct tag in another namespace.
+    """
+    root = ET.Element(METS + 'mets')
+    elem = ET.SubElement(root, METS + 'structMap')
+    for level in range(depth):
+        elem = ET.SubElement(elem, METS + 'div', {
+            '{http://www.w3.org/1999/xlink}label': str(level)})
+        ET.SubElement(elem, '{%s}tag%d' % (other, level), ID='x')
+    return root
+
+
+def test_deep_nesting():
+    """Tests that divs nested deeper than the recursion limit are
+    walked, and that the dispatch table does not grow with the nesting
+    or the tags of the documents.
+    """
+    depth = sys.getrecursionlimit() + 100
+    strip_attributes(_deep_structmap(10, 'urn:first'))
+    size = len(ENTRIES)
+
+    root = _deep_structmap(depth, 'urn:second')
+    strip_attributes(root)
+
+    assert root.xpath('//@xlink:label', namespaces=NAMESPACES) == []
+    assert len(root.xpath('//@ID')) == depth
+    assert len(ENTRIES) == size
+
+
+def test_unknown_paths():
+    """Tests that the paths no rule can match share one entry."""
+    assert get_entry(('{urn:x}a',)) is NO_RULES
+    assert get_entry((METS + 'amdSec', METS + 'techMD', METS + 'mdWrap',
+                      '{urn:x}a', '{urn:x}b')) is NO_RULES
+    assert get_entry((METS + 'structMap', '{urn:x}a')) is get_entry(
+        (METS + 'structMap', '{urn:x}b'))
@@ -0,0 +1,188 @@
+"""Tests for the batch module."""
+
+import argparse
+import io
+import os
+
+import pytest
+
+from dpres_specification_migrator.batch import (FileResult, collect_inputs,
+                                                positive_int, print_summary,
+                                                run_tasks)
+
+
+def _touch(path):
+    """Create an empty file and its parent directories."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w'):
+        pass
+
+
+def test_collect_inputs_directory(testpath):
+    """Tests that a directory is walked recursively in a stable order
+    and that the output directories mirror the input tree.
+    """
+    _touch(os.path.join(testpath, 'b', 'mets.xml'))
+    _touch(os.path.join(testpath, 'a', 'c', 'mets.xml'))
+    _touch(os.path.join(testpath, 'a', 'other.xml'))
+
+    inputs = collect_inputs([testpath])
+
+    assert inputs == [
+        (os.path.join(testpath, 'a', 'c', 'mets.xml'), os.path.join('a', 'c')),
+        (os.path.join(testpath, 'b', 'mets.xml'), 'b')]
+
+
+def test_collect_inputs_sibling_directories(testpath):
+    """Tests that package directories given side by side are mirrored
+    below their common directory, so that their documents are not
+    written to the same output directory.
+    """
+    _touch(os.path.join(testpath, 'pkgA', 'mets.xml'))
+    _touch(os.path.join(testpath, 'pkgB', 'mets.xml'))
+    _touch(os.path.join(testpath, 'pkgB', 'sub', 'mets.xml'))
+
+    inputs = collect_inputs([os.path.join(testpath, 'pkgA'),
+                             os.path.join(testpath, 'pkgB')])
+
+    assert inputs == [
+        (os.path.join(testpath, 'pkgA', 'mets.xml'), 'pkgA'),
+        (os.path.join(testpath, 'pkgB', 'mets.xml'), 'pkgB'),
+        (os.path.join(testpath, 'pkgB', 'sub', 'mets.xml'),
+         os.path.join('pkgB', 'sub'))]
+
+
+def test_collect_inputs_pattern(testpath):
+    """Tests walking a directory with a custom file name pattern."""
+    _touch(os.path.join(testpath, 'a', 'mets.xml'))
+    _touch(os.path.join(testpath, 'a', 'other.xml'))
+
+    inputs = collect_inputs([testpath], pattern='*.xml')
+
+    assert [os.path.basename(path) for path, _ in inputs] == [
+        'mets.xml', 'other.xml']
+
+
+def test_collect_inputs_glob_and_files(testpath):
+    """Tests that glob patterns are expanded, duplicates are dropped and
+    listed files mirror their location below the common directory.
+    """
+    _touch(os.path.join(testpath, 'x', 'mets.xml'))
+    _touch(os.path.join(testpath, 'y', 'mets.xml'))
+
+    inputs = collect_inputs([os.path.join(testpath, '*', 'mets.xml'),
+                             os.path.join(testpath, 'x', 'mets.xml')])
+
+    assert inputs == [(os.path.join(testpath, 'x', 'mets.xml'), 'x'),
+                      (os.path.join(testpath, 'y', 'mets.xml'), 'y')]
+
+
+def test_collect_inputs_single_file():
+    """Tests that a single METS file is written straight into the
+    workspace.
+    """
+    assert collect_inputs(['tests/data/mets/mets_1_7.xml']) == [
+        ('tests/data/mets/mets_1_7.xml', '.')]
+
+
+def test_collect_inputs_manifest(testpath, monkeypatch):
+    """Tests reading the input list from a manifest file and stdin."""
+    manifest = os.path.join(testpath, 'manifest.txt')
+    with open(manifest, 'w') as outfile:
+        outfile.write('tests/data/mets/mets_1_6.xml\n\n'
+                      'tests/data/mets/mets_1_7.xml\n')
+
+    assert [path for path, _ in collect_inputs([], manifest=manifest)] == [
+        'tests/data/mets/mets_1_6.xml', 'tests/data/mets/mets_1_7.xml']
+
+    monkeypatch.setattr('sys.stdin', io.StringIO(
+        'tests/data/mets/mets_1_7.xml\n'))
+    assert collect_inputs([], manifest='-') == [
+        ('tests/data/mets/mets_1_7.xml', '.')]
+
+
+def _square(number, args):
+    """Task function for run_tasks tests, must be picklable."""
+    return FileResult(str(number), objid=str(number * number + args))
+
+
+def _die(number, args):
+    """Task function killing its worker process at task 5."""
+    if number == 5:
+        os._exit(1)
+    return _square(number, args)
+
+
+@pytest.mark.parametrize("jobs", [1, 3, 2])
+def test_run_tasks(jobs):
+    """Tests that the results are returned in task order both from the
+    serial and the process pool runs.
+    """
+    results = list(run_tasks(_square, [(number,) for number in range(20)],
+                             1, jobs=jobs))
+
+    assert [result.objid for result in results] == [
+        str(number * number + 1) for number in range(20)]
+
+
+def test_run_tasks_jobs():
+    """Tests that less than one job is refused."""
+    with pytest.raises(ValueError):
+        list(run_tasks(_square, [(1,)], 1, jobs=0))
+    assert positive_int('4') == 4
+    for value in ['0', '-1', 'all']:
+        with pytest.raises(argparse.ArgumentTypeError):
+            positive_int(value)
+
+
+def test_run_tasks_broken_pool():
+    """Tests that the tasks left without a result by a dead worker
+    process are reported as failed, and the results before them are
+    kept.
+    """
+    results = list(run_tasks(_die, [(number,) for number in range(20)],
+                             1, jobs=2))
+
+    assert [str(result.filepath) for result in results] == [
+        str(number) for number in range(20)]
+    statuses = [result.status for result in results]
+    first = statuses.index('failed')
+    assert first <= 5
+    assert statuses == ['ok'] * first + ['failed'] * (20 - first)
+    assert results[5].error == 'BrokenProcessPool'
+    assert results[5].messages[0][1].startswith('Error: 5: BrokenProcessPool')
+
+
+def test_print_summary_plans():
+    """Tests that the summary counts the documents of each migration
+    plan.
+    """
+    output = io.StringIO()
+    print_summary([FileResult('a', outpath='w/a', objid='1',
+                              plan=('1.7.0', '1.7', None, False)),
+                   FileResult('b', outpath='w/b', objid='2',
+                              plan=('1.6.1', '1.7', None, True)),
+                   FileResult('c', outpath='w/c', objid='3',
+                              plan=('1.7.0', '1.7', None, False))],
+                  file=output)
+
+    lines = output.getvalue().splitlines()
+    assert lines[1:3] == [
+        'plan\t1.7.0 -> 1.7 (record status: unchanged)\t2 METS documents',
+        'plan\t1.6.1 -> 1.7 (record status: unchanged, KDK profile)\t'
+        '1 METS documents']
+    assert lines[3].startswith('ok\ta\t')
+
+
+def test_print_summary():
+    """Tests the per-file status summary."""
+    output = io.StringIO()
+    print_summary([FileResult('a/mets.xml', outpath='w/a/mets.xml',
+                              objid='id1'),
+                   FileResult('b/mets.xml', status='failed',
+                              message='broken')], file=output)
+
+    lines = output.getvalue().splitlines()
+    assert lines[0] == 'Summary: 2 METS documents, 1 migrated, 1 failed'
+    assert lines[1] == 'ok\ta/mets.xml\tw/a/mets.xml OBJID: id1'
+    assert lines[2] == 'failed\tb/mets.xml\tbroken'
@@ -0,0 +1,159 @@
+"""Tests for the cache module."""
+
+import os
+
+import lxml.etree as ET
+
+from dpres_specification_migrator import cache
+from dpres_specification_migrator.cache import ResultCache, cache_key
+from dpres_specification_migrator.transform_mets import main
+
+TESTAIP_1_7 = 'tests/data/mets/mets_1_7.xml'
+
+OPTIONS = {'to_version': '1.7', 'contractid': None, 'record_status': None,
+           'objid': None, 'streaming': False, 'fast_path': False}
+
+METSHDR = '{http://www.loc.gov/METS/}metsHdr'
+
+
+def test_cache_key():
+    """Tests that the key depends on the options that change the
+    migrated document.
+    """
+    key = cache_key('0' * 64, OPTIONS)
+    assert cache_key('0' * 64, dict(OPTIONS, objid='x')) == key
+    assert cache_key('1' * 64, OPTIONS) != key
+    assert cache_key('0' * 64, dict(OPTIONS, contractid='c')) != key
+    assert cache_key('0' * 64, dict(OPTIONS, record_status='dissemination',
+                                    objid='x')) != cache_key(
+        '0' * 64, dict(OPTIONS, record_status='dissemination'))
+    assert cache_key('0' * 64, dict(OPTIONS, streaming=True)) != key
+    assert cache_key('0' * 64, dict(OPTIONS, fast_path=True)) != key
+
+
+def test_cache_key_version(monkeypatch):
+    """Tests that the key changes with the version of the migrator."""
+    key = cache_key('0' * 64, OPTIONS)
+    monkeypatch.setattr(cache, 'migrator_version', lambda: '2.0+0')
+    assert cache_key('0' * 64, OPTIONS) != key
+
+
+def migrate(testpath, capsys, *arguments):
+    """Migrates the 1.7 test document with a cache.
+
+    :returns: Tuple of the output of the run and the migrated root
+    """
+    outdir = os.path.join(testpath, 'out')
+    assert main([TESTAIP_1_7, '--workspace', outdir, '--cache',
+                 os.path.join(testpath, 'cache')] + list(arguments)) == 0
+    out = capsys.readouterr().out
+    return out, ET.parse(os.path.join(outdir, 'mets.xml')).getroot()
+
+
+def test_cache_hit(testpath, capsys):
+    """Tests that a document migrated again is copied from the cache
+    with a new LASTMODDATE.
+    """
+    out, first = migrate(testpath, capsys)
+    assert '(cached)' not in out
+    first.find(METSHDR).set('LASTMODDATE', '2000-01-01T00:00:00')
+
+    out, second = migrate(testpath, capsys)
+    assert '(cached)' in out
+    assert second.find(METSHDR).get('LASTMODDATE') != '2000-01-01T00:00:00'
+    second.find(METSHDR).set('LASTMODDATE', '2000-01-01T00:00:00')
+    assert ET.tostring(first) == ET.tostring(second)
+
+
+def test_cache_hit_dissemination(testpath, capsys):
+    """Tests that a dissemination information package copied from the
+    cache gets a new OBJID and CREATEDATE, unless the OBJID is given.
+    """
+    _, first = migrate(testpath, capsys, '--record_status', 'dissemination')
+    out, second = migrate(testpath, capsys, '--record_status',
+                          'dissemination')
+    assert '(cached)' in out
+    assert second.get('OBJID') != first.get('OBJID')
+    assert f"OBJID: {second.get('OBJID')} (cached)" in out
+    assert second.find(METSHDR).get('CREATEDATE')
+    assert second.find(METSHDR).get('RECORDSTATUS') == 'dissemination'
+
+    migrate(testpath, capsys, '--record_status', 'dissemination', '--objid',
+            'dip-1')
+    out, third = migrate(testpath, capsys, '--record_status',
+                         'dissemination', '--objid', 'dip-1')
+    assert '(cached)' in out
+    assert third.get('OBJID') == 'dip-1'
+
+
+def test_cache_hit_objid_warning(testpath, capsys):
+    """Tests that the warning of an ignored OBJID tells the OBJID given
+    in the run that hits the cache.
+    """
+    out, _ = migrate(testpath, capsys, '--objid', 'first-id')
+    assert 'value first-id was ignored' in out
+
+    out, _ = migrate(testpath, capsys, '--objid', 'second-id')
+    assert '(cached)' in out
+    assert 'value second-id was ignored' in out
+    assert 'first-id' not in out
+
+    out, _ = migrate(testpath, capsys)
+    assert '(cached)' in out
+    assert 'was ignored' not in out
+
+
+def test_cache_several_metshdr(testpath, capsys):
+    """Tests that a document with several metsHdr elements is not
+    cached, since only the first one would be restamped on a hit.
+    """
+    with open(TESTAIP_1_7, 'rb') as infile:
+        mets_b = infile.read()
+    start = mets_b.index(b'<mets:metsHdr')
+    end = mets_b.index(b'</mets:metsHdr>') + len(b'</mets:metsHdr>')
+    metsfile = os.path.join(testpath, 'mets.xml')
+    with open(metsfile, 'wb') as outfile:
+        outfile.write(mets_b[:end] + mets_b[start:])
+
+    outdir = os.path.join(testpath, 'out')
+    for _ in range(2):
+        assert main([metsfile, '--workspace', outdir, '--cache',
+                     os.path.join(testpath, 'cache'), '--record_status',
+                     'dissemination']) == 0
+        assert '(cached)' not in capsys.readouterr().out
+    root = ET.parse(os.path.join(outdir, 'mets.xml')).getroot()
+    dates = [hdr.get('CREATEDATE') for hdr in root.iterfind(METSHDR)]
+    assert len(dates) == 2
+    assert dates[0] == dates[1]
+
+
+def test_cache_miss(testpath, capsys, monkeypatch):
+    """Tests that a new version of the migrator or other output options
+    miss the documents cached earlier.
+    """
+    migrate(testpath, capsys)
+    out, _ = migrate(testpath, capsys, '--streaming')
+    assert '(cached)' not in out
+    monkeypatch.setattr(cache, 'migrator_version', lambda: '2.0+0')
+    out, _ = migrate(testpath, capsys)
+    assert '(cached)' not in out
+    out, _ = migrate(testpath, capsys)
+    assert '(cached)' in out
+
+
+def test_evict(testpath):
+    """Tests that the least recently used entries are evicted first."""
+    cache = ResultCache(os.path.join(testpath, 'cache'))
+    size = os.path.getsize(TESTAIP_1_7)
+    keys = [cache_key(str(index), OPTIONS) for index in range(3)]
+    for age, key in enumerate(keys):
+        cache.store(key, TESTAIP_1_7, {'objid': 'x', 'plan': [],
+                                       'warnings': []})
+        path = os.path.join(testpath, 'cache', key[:2], key + '.xml')
+        os.utime(path, (1000 - age, 1000 - age))
+
+    assert cache.evict(2 * size) == 1
+    outpath = os.path.join(testpath, 'out.xml')
+    assert cache.restore(keys[2], outpath, OPTIONS) is None
+    assert cache.restore(keys[0], outpath, OPTIONS)['objid'] == 'x'
+    assert cache.evict(0) == 2
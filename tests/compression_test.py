@@ -0,0 +1,101 @@
+"""Tests for the compression module."""
+
+import bz2
+import gzip
+import lzma
+import os
+
+import pytest
+
+import lxml.etree as ET
+
+from dpres_specification_migrator.api import Migrator
+from dpres_specification_migrator.compression import detect, detect_file
+from dpres_specification_migrator.transform_mets import main
+
+TESTAIP_1_6 = 'tests/data/mets/mets_1_6.xml'
+TESTAIP_1_7 = 'tests/data/mets/mets_1_7.xml'
+
+FI_PROFILE = 'http://digitalpreservation.fi/mets-profiles/cultural-heritage'
+
+COMPRESS = {'gzip': gzip.compress, 'xz': lzma.compress,
+            'bz2': bz2.compress}
+DECOMPRESS = {'gzip': gzip.decompress, 'xz': lzma.decompress,
+              'bz2': bz2.decompress}
+
+
+def read_file(path):
+    """Returns the contents of a file."""
+    with open(path, 'rb') as infile:
+        return infile.read()
+
+
+def test_detect():
+    """Tests recognizing the compressions by their magic bytes."""
+    for compression, compress in COMPRESS.items():
+        assert detect(compress(b'<mets/>')) == compression
+    assert detect(b'<?xml version="1.0"?>') is None
+
+
+class ReadOnly:
+    """Binary file object with only a read method."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def read(self, size=-1):
+        """Reads at most `size` bytes."""
+        if size < 0:
+            size = len(self.data)
+        chunk, self.data = self.data[:size], self.data[size:]
+        return chunk
+
+
+def test_detect_file_read_only():
+    """Tests that a file object without seekable or peek is taken as not
+    compressed and can still be migrated.
+    """
+    source = ReadOnly(read_file(TESTAIP_1_7))
+    assert detect_file(source) is None
+    result = Migrator(contractid='urn:uuid:contract').migrate(source)
+    assert ET.fromstring(result.data).get('PROFILE') == FI_PROFILE
+
+
+@pytest.mark.parametrize('compression', ['gzip', 'xz', 'bz2'])
+@pytest.mark.parametrize('streaming', [False, True])
+def test_migrate_compressed(testpath, compression, streaming):
+    """Tests migrating compressed METS files into compressed output
+    files. The input is recognized by its content, not its name.
+    """
+    path = os.path.join(testpath, 'mets.xml')
+    with open(path, 'wb') as outfile:
+        outfile.write(COMPRESS[compression](read_file(TESTAIP_1_6)))
+    workspace = os.path.join(testpath, 'workspace')
+    arguments = [path, '--workspace', workspace, '--contractid',
+                 'urn:uuid:contract', '--compress', compression]
+    if streaming:
+        arguments.append('--streaming')
+    assert main(arguments) == 0
+
+    outpath = os.path.join(workspace, 'mets.xml' + {
+        'gzip': '.gz', 'xz': '.xz', 'bz2': '.bz2'}[compression])
+    root = ET.fromstring(DECOMPRESS[compression](read_file(outpath)))
+    assert root.get('PROFILE') == FI_PROFILE
+
+
+def test_fast_path_compressed(testpath):
+    """Tests that the fast path copies the unchanged ranges through the
+    compressor.
+    """
+    assert main([TESTAIP_1_7, '--workspace', testpath, '--fast_path',
+                 '--compress', 'gzip']) == 0
+    data = gzip.decompress(read_file(os.path.join(testpath, 'mets.xml.gz')))
+    assert ET.fromstring(data).get('OBJID') == (
+        'b1d22c00-d28b-4a79-bfa1-b86c37cd10dd')
+
+
+def test_migrate_compressed_bytes():
+    """Tests migrating a compressed METS document given as bytes."""
+    result = Migrator(contractid='urn:uuid:contract').migrate(
+        gzip.compress(read_file(TESTAIP_1_6)))
+    assert ET.fromstring(result.data).get('PROFILE') == FI_PROFILE
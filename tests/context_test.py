@@ -0,0 +1,37 @@
+"""Tests for the context module."""
+
+from dpres_specification_migrator.context import (TEXTMD_1_4_NS,
+                                                  MigrationContext)
+from dpres_specification_migrator.dicts import NAMESPACES
+
+
+def test_context_namespaces():
+    """Tests that every context has its own copy of the namespace map."""
+    context = MigrationContext()
+    context.use_1_4_namespaces()
+    context.namespaces['fi'] = 'urn:test'
+
+    assert context.namespaces['textmd'] == TEXTMD_1_4_NS
+    assert NAMESPACES['textmd'] == 'info:lc/xmlns/textMD-v3'
+    assert NAMESPACES['fi'] == \
+        'http://www.kdk.fi/standards/mets/kdk-extensions'
+    assert MigrationContext().namespaces == NAMESPACES
+
+
+def test_context_version():
+    """Tests the catalog version properties."""
+    assert MigrationContext(full_cur_catalog='1.6.1').cur_catalog == '1.6'
+    assert MigrationContext().cur_catalog is None
+
+
+def test_context_warn(capsys):
+    """Tests that warnings are collected and optionally printed."""
+    context = MigrationContext(echo=False)
+    context.warn('Warning: first')
+    assert context.warnings == ['Warning: first']
+    assert capsys.readouterr().out == ''
+
+    context = MigrationContext()
+    context.warn('Warning: second')
+    assert context.warnings == ['Warning: second']
+    assert capsys.readouterr().out == 'Warning: second\n'
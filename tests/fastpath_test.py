@@ -0,0 +1,124 @@
+"""Tests for the fastpath module."""
+
+import io
+import os
+
+import pytest
+
+import lxml.etree as ET
+
+from dpres_specification_migrator.context import MigrationContext
+from dpres_specification_migrator.fastpath import (FastPathNotApplicable,
+                                                   patch_start_tag, prepare)
+from dpres_specification_migrator.transform_mets import (main, migrate_mets,
+                                                         serialize_mets)
+from tests.conftest import canonical
+
+TESTAIP_1_6 = 'tests/data/mets/mets_1_6.xml'
+TESTAIP_1_7 = 'tests/data/mets/mets_1_7.xml'
+
+
+def _write_mets(testpath, replacements):
+    """Writes a modified copy of the 1.7 test METS document."""
+    with open(TESTAIP_1_7, 'rb') as infile:
+        mets_b = infile.read()
+    for old, new in replacements:
+        assert old in mets_b
+        mets_b = mets_b.replace(old, new, 1)
+    path = os.path.join(testpath, 'mets.xml')
+    with open(path, 'wb') as outfile:
+        outfile.write(mets_b)
+    return path
+
+
+@pytest.mark.parametrize('contract', [None, 'urn:uuid:contract'])
+def test_fast_path_matches_dom(contract):
+    """Tests that patching the start tags gives the same document as the
+    DOM migration, including the warnings.
+    """
+    root = ET.parse(TESTAIP_1_7).getroot()
+    dom_context = MigrationContext(echo=False)
+    migrated, objid = migrate_mets(root, '1.7', '1.7.0', contract=contract,
+                                   context=dom_context)
+
+    context = MigrationContext(echo=False)
+    patch = prepare(TESTAIP_1_7, '1.7', contract=contract, context=context)
+    outfile = io.BytesIO()
+    patch.write(outfile)
+
+    assert patch.objid == objid
+    assert context.warnings == dom_context.warnings
+    assert outfile.getvalue().startswith(
+        b"<?xml version='1.0' encoding='UTF-8'?>\n<mets:mets ")
+    assert canonical(outfile.getvalue(), exclusive=True) == canonical(
+        serialize_mets(migrated), exclusive=True)
+
+
+@pytest.mark.parametrize(('replacements', 'reason'), [
+    ([(b'<mets:mets ', b'<!-- comment --><mets:mets ')], 'METS root'),
+    ([(b'UTF-8', b'ISO-8859-15')], 'not UTF-8'),
+    ([(b'\t<mets:metsHdr', b'<!-- x --><mets:metsHdr')], 'first child'),
+    ([(b'</mets:mets>', b'</mets:mets><!-- comment -->')], 'after'),
+    ([(b'MDTYPE="DC"', b'MDTYPE="OTHER" OTHERMDTYPE="KDKPreservationPlan"')],
+     'KDKPreservationPlan'),
+    ([(b'USE="', b'USE="fi-preservation-no-file-format-validation')],
+     'fi-preservation'),
+    ([(b'USE="', b'USE="no-file-format-validation')],
+     'no-file-format-validation'),
+    ([(b'fi:CONTRACTID="urn:uuid:5c40bf16-42d1-438b-b103-9c16efb037be"',
+       b'')], 'CONTRACTID')])
+def test_fast_path_not_applicable(testpath, replacements, reason):
+    """Tests that the pre-scan refuses documents that need other
+    migration steps or can not be patched safely.
+    """
+    path = _write_mets(testpath, replacements)
+    with pytest.raises(FastPathNotApplicable) as error:
+        prepare(path, '1.7')
+    assert reason in str(error.value)
+
+
+def test_fast_path_other_versions():
+    """Tests that other catalog versions are refused."""
+    with pytest.raises(FastPathNotApplicable):
+        prepare(TESTAIP_1_6, '1.7', contract='urn:uuid:contract')
+    with pytest.raises(FastPathNotApplicable):
+        prepare(TESTAIP_1_7, '1.6')
+
+
+def test_patch_start_tag():
+    """Tests replacing and adding attributes in a start tag."""
+    tag = b"<mets:mets xmlns:mets='urn:mets' OBJID='a' LABEL=\"b\"  >"
+    patched = patch_start_tag(
+        tag, {'mets': 'urn:mets'},
+        [('OBJID', 'c&"d'), ('{urn:fi}CONTRACTID', 'e')],
+        {'fi': 'urn:fi'})
+
+    assert patched == (b"<mets:mets xmlns:mets='urn:mets' OBJID=\"c&amp;"
+                       b"&quot;d\" LABEL=\"b\" xmlns:fi=\"urn:fi\" "
+                       b"fi:CONTRACTID=\"e\"  >")
+    root = ET.fromstring(patched + b'</mets:mets>')
+    assert root.get('{urn:fi}CONTRACTID') == 'e'
+
+    with pytest.raises(FastPathNotApplicable):
+        patch_start_tag(b'<a xmlns:fi="urn:other">',
+                        {'fi': 'urn:other'}, [('{urn:fi}CONTRACTID', 'e')],
+                        {'fi': 'urn:fi'})
+
+
+@pytest.mark.parametrize('record_status', [None, 'dissemination'])
+def test_fast_path_main(testpath, record_status):
+    """Tests the --fast_path option. DIP migrations use the normal
+    path.
+    """
+    arguments = [TESTAIP_1_7, '--fast_path', '--workspace', testpath]
+    if record_status:
+        arguments += ['--record_status', record_status]
+    assert main(arguments) == 0
+
+    with open(os.path.join(testpath, 'mets.xml'), 'rb') as infile:
+        mets_b = infile.read()
+    with open(TESTAIP_1_7, 'rb') as infile:
+        original = infile.read()
+    patched = original[original.index(b'>', original.index(b'<mets:metsHdr'))
+                       + 1:].rstrip() + b'\n'
+    assert mets_b.endswith(patched) != bool(record_status)
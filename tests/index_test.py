@@ -0,0 +1,48 @@
+"""Tests for the index module."""
+
+import lxml.etree as ET
+
+from dpres_specification_migrator.index import AdmidIndex
+
+METS = (
+    '<mets:mets xmlns:mets="http://www.loc.gov/METS/">'
+    '<mets:fileSec><mets:fileGrp>'
+    '<mets:file ID="file1" ADMID="tech1 tech10"/>'
+    '<mets:file ID="file2" ADMID="tech10  event1 tech10"/>'
+    '<mets:file ID="file3"/>'
+    '</mets:fileGrp></mets:fileSec>'
+    '</mets:mets>'
+)
+
+
+def _ids(files):
+    """Returns the IDs of mets:file elements."""
+    return [mets_file.get('ID') for mets_file in files]
+
+
+def test_admid_index():
+    """Tests that ADMID values are indexed as whole tokens and that every
+    file is listed once per ID, in document order.
+    """
+    index = AdmidIndex(ET.fromstring(METS))
+
+    assert _ids(index.files('tech1')) == ['file1']
+    assert _ids(index.files('tech10')) == ['file1', 'file2']
+    assert _ids(index.files('event1')) == ['file2']
+    assert _ids(index.files('tech')) == []
+
+
+def test_add_admid():
+    """Tests that adding an ID updates both the ADMID attribute and the
+    index.
+    """
+    root = ET.fromstring(METS)
+    index = AdmidIndex(root)
+    file1, _, file3 = root.iter('{http://www.loc.gov/METS/}file')
+
+    index.add_admid(file1, 'mix1')
+    index.add_admid(file3, 'mix1')
+
+    assert file1.get('ADMID') == 'tech1 tech10 mix1'
+    assert file3.get('ADMID') == 'mix1'
+    assert _ids(index.files('mix1')) == ['file1', 'file3']
@@ -0,0 +1,108 @@
+"""Tests for the inventory module."""
+
+import csv
+import io
+import json
+import os
+
+import pytest
+
+from dpres_specification_migrator.inventory import (inventory_file,
+                                                    parse_arguments,
+                                                    read_header, write_report)
+from dpres_specification_migrator.transform_mets import main
+
+TESTAIP_1_4 = 'tests/data/mets/mets_1_4.xml'
+TESTAIP_1_6 = 'tests/data/mets/mets_1_6.xml'
+TESTAIP_1_7 = 'tests/data/mets/mets_1_7.xml'
+
+
+def test_read_header_stops_early():
+    """Tests that only the start tags of the root and the metsHdr are
+    parsed, so that errors later in the file are not reached.
+    """
+    with open(TESTAIP_1_7, 'rb') as infile:
+        mets_b = infile.read()
+    position = mets_b.index(b'<mets:dmdSec')
+    source = io.BytesIO(mets_b[:position] + b'<broken' + b' ' * 100000)
+
+    root, hdr = read_header(source)
+
+    assert root.get('OBJID') == 'b1d22c00-d28b-4a79-bfa1-b86c37cd10dd'
+    assert hdr.get('RECORDSTATUS') == 'submission'
+
+
+def test_inventory_file(testpath):
+    """Tests classifying documents, including documents that can not be
+    migrated.
+    """
+    args = parse_arguments([])
+    record = inventory_file(TESTAIP_1_6, args)
+    assert record.version == '1.6.1'
+    assert record.status == 'failed'
+    assert 'CONTRACTID required' in record.message
+
+    record = inventory_file(TESTAIP_1_6,
+                            parse_arguments(['--contractid', 'x']))
+    assert record.status == 'ok'
+    assert 'set_contractid' in record.steps
+
+    path = os.path.join(testpath, 'mets.xml')
+    with open(path, 'wb') as outfile:
+        outfile.write(b'<mets/>')
+    record = inventory_file(path, args)
+    assert record.status == 'failed'
+    assert record.message == 'No catalog version found.'
+
+
+@pytest.mark.parametrize('jobs', ['1', '2'])
+def test_inventory_main_json(testpath, jobs):
+    """Tests the JSON report of the inventory command."""
+    report = os.path.join(testpath, 'report.json')
+    returncode = main(['inventory', TESTAIP_1_4, TESTAIP_1_6, TESTAIP_1_7,
+                       '--contractid', 'urn:uuid:contract', '--jobs', jobs,
+                       '--report', report])
+    assert returncode == 0
+
+    with open(report, 'r', encoding='utf-8') as infile:
+        data = json.load(infile)
+    assert [entry['filepath'] for entry in data['files']] == [
+        TESTAIP_1_4, TESTAIP_1_6, TESTAIP_1_7]
+    assert data['counts']['versions'] == {'1.4': 1, '1.6.1': 1, '1.7.0': 1}
+    assert data['counts']['steps']['fix_1_4_mets'] == 1
+    assert data['counts']['steps']['update_profile'] == 2
+    assert 'transform_to_dip' not in data['counts']['steps']
+    assert data['counts']['statuses'] == {'ok': 3}
+
+
+def test_inventory_csv():
+    """Tests the CSV report."""
+    args = parse_arguments([])
+    records = [inventory_file(path, args) for path in [TESTAIP_1_6,
+                                                       TESTAIP_1_7]]
+    outfile = io.StringIO()
+    counts = write_report(iter(records), outfile, 'csv', '1.7')
+
+    rows = list(csv.DictReader(io.StringIO(outfile.getvalue())))
+    assert [row['version'] for row in rows] == ['1.6.1', '1.7.0']
+    assert rows[1]['steps'] == (
+        'update_root_attributes set_contractid set_lastmoddate set_mdtype '
+        'update_no_file_format_validation_key fix_preservation_prefix')
+    assert counts['statuses'] == {'failed': 1, 'ok': 1}
+
+
+def test_inventory_main_failed(testpath):
+    """Tests that the inventory command fails when a document can not
+    be migrated with the options, and still reports every document.
+    """
+    report = os.path.join(testpath, 'report.json')
+    assert main(['inventory', TESTAIP_1_6, TESTAIP_1_7,
+                 '--report', report]) == 117
+    with open(report, 'r', encoding='utf-8') as infile:
+        data = json.load(infile)
+    assert data['counts']['statuses'] == {'failed': 1, 'ok': 1}
+
+
+def test_inventory_no_inputs():
+    """Tests that the inventory command fails without inputs."""
+    assert main(['inventory']) == 117
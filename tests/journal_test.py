@@ -0,0 +1,119 @@
+"""Tests for the journal module."""
+
+import json
+import os
+import shutil
+
+import pytest
+
+from dpres_specification_migrator.batch import FileResult
+from dpres_specification_migrator.journal import Journal, fingerprint
+from dpres_specification_migrator.transform_mets import main
+
+TESTAIP_1_6 = 'tests/data/mets/mets_1_6.xml'
+TESTAIP_1_7 = 'tests/data/mets/mets_1_7.xml'
+
+OPTIONS = {'to_version': '1.7', 'contractid': None, 'record_status': None,
+           'objid': None}
+
+
+@pytest.fixture
+def migrated(testpath):
+    """Input and output METS documents of a migration recorded in a
+    journal.
+
+    :returns: Tuple of the journal path, the input path and the output
+              path
+    """
+    filepath = os.path.join(testpath, 'mets.xml')
+    outpath = os.path.join(testpath, 'out.xml')
+    shutil.copy(TESTAIP_1_7, filepath)
+    shutil.copy(TESTAIP_1_7, outpath)
+    path = os.path.join(testpath, 'journal.jsonl')
+    with Journal(path) as journal:
+        journal.record(FileResult(filepath, outpath=outpath, objid='x',
+                                  fingerprint=fingerprint(filepath)),
+                       OPTIONS)
+    return path, filepath, outpath
+
+
+def test_finished(migrated):
+    """Tests that an input is finished only while neither the input, the
+    output nor the options change.
+    """
+    path, filepath, outpath = migrated
+    journal = Journal(path)
+    assert journal.finished(filepath, outpath, OPTIONS)['objid'] == 'x'
+    assert journal.finished(filepath, outpath + '.2', OPTIONS) is None
+    assert journal.finished(filepath, outpath,
+                            dict(OPTIONS, contractid='c')) is None
+    assert not journal.failed(filepath)
+
+    os.utime(filepath, ns=(0, 0))
+    assert journal.finished(filepath, outpath, OPTIONS) is None
+
+
+def test_finished_output_removed(migrated):
+    """Tests that an input is migrated again if its output is gone."""
+    path, filepath, outpath = migrated
+    os.remove(outpath)
+    assert Journal(path).finished(filepath, outpath, OPTIONS) is None
+
+
+def test_partial_line(migrated):
+    """Tests that a line cut short by a killed run is ignored and the
+    next entry is not lost.
+    """
+    path, filepath, _ = migrated
+    with open(path, 'a', encoding='utf-8') as outfile:
+        outfile.write('{"key": "/cut')
+    with Journal(path) as journal:
+        journal.record(FileResult(filepath, status='failed',
+                                  error='DowngradeError'), OPTIONS)
+    assert Journal(path).failed(filepath)
+    with open(path, encoding='utf-8') as infile:
+        assert len(infile.read().splitlines()) == 3
+
+
+def test_resume(testpath, capsys):
+    """Tests resuming a batch run and retrying the failed METS
+    documents.
+    """
+    for name, source in [('a', TESTAIP_1_7), ('b', TESTAIP_1_6)]:
+        os.makedirs(os.path.join(testpath, 'in', name))
+        shutil.copy(source, os.path.join(testpath, 'in', name, 'mets.xml'))
+    path = os.path.join(testpath, 'journal.jsonl')
+    arguments = [os.path.join(testpath, 'in'), '--workspace',
+                 os.path.join(testpath, 'out'), '--journal', path]
+
+    assert main(arguments) == 117
+    with open(path, encoding='utf-8') as infile:
+        entries = [json.loads(line) for line in infile]
+    assert [entry['status'] for entry in entries] == ['ok', 'failed']
+    assert entries[0]['sha256'] == fingerprint(TESTAIP_1_7)['sha256']
+    assert entries[1]['error'] == 'ContractIdRequiredError'
+    capsys.readouterr()
+
+    assert main(arguments + ['--resume']) == 117
+    out = capsys.readouterr().out
+    assert 'Summary: 2 METS documents, 0 migrated, 1 skipped, 1 failed' in (
+        out)
+    assert f"Skipped {os.path.join(testpath, 'in', 'a', 'mets.xml')}" in out
+
+    assert main(arguments + ['--retry_failed', '--contractid', 'c']) == 0
+    out = capsys.readouterr().out
+    assert 'Skipped' not in out
+    assert out.count('Wrote METS file') == 1
+    assert Journal(path).finished(
+        os.path.join(testpath, 'in', 'b', 'mets.xml'),
+        os.path.join(testpath, 'out', 'b', 'mets.xml'),
+        dict(OPTIONS, contractid='c'))
+
+    assert main(arguments + ['--retry_failed']) == 0
+    assert 'No failed METS documents' in capsys.readouterr().out
+
+
+def test_resume_requires_journal():
+    """Tests that --resume is refused without --journal."""
+    with pytest.raises(SystemExit):
+        main([TESTAIP_1_7, '--resume'])
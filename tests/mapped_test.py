@@ -0,0 +1,70 @@
+"""Tests for the mapped module."""
+
+import glob
+import os
+
+import pytest
+
+import lxml.etree as ET
+
+from dpres_specification_migrator import mapped, streaming
+from dpres_specification_migrator.transform_mets import main
+
+TESTDATA = sorted(glob.glob('tests/data/mets/*.xml'))
+TESTAIP_1_6 = 'tests/data/mets/mets_1_6.xml'
+
+FI_PROFILE = 'http://digitalpreservation.fi/mets-profiles/cultural-heritage'
+
+
+@pytest.mark.parametrize('filepath', TESTDATA)
+def test_parse(filepath):
+    """Tests that the mapped document is parsed into the same tree as
+    the file.
+    """
+    tree = mapped.parse(filepath)
+    assert ET.tostring(tree, method='c14n') == ET.tostring(
+        ET.parse(filepath), method='c14n')
+    assert tree.docinfo.URL == filepath
+
+
+@pytest.mark.parametrize('filepath', TESTDATA)
+def test_read_catalog_version(filepath):
+    """Tests reading the catalog version from the mapped root start
+    tag.
+    """
+    assert mapped.read_catalog_version(filepath) == (
+        streaming.read_catalog_version(filepath))
+
+
+def test_read_catalog_version_after_comment(testpath):
+    """Tests that a document with a comment before the root is read by
+    parsing.
+    """
+    path = os.path.join(testpath, 'mets.xml')
+    with open(TESTAIP_1_6, 'rb') as infile:
+        data = infile.read()
+    root_start = data.index(b'<mets:mets')
+    with open(path, 'wb') as outfile:
+        outfile.write(data[:root_start] + b'<!-- comment -->\n' +
+                      data[root_start:])
+    assert mapped.read_catalog_version(path) == '1.6.1'
+
+
+def test_parse_empty(testpath):
+    """Tests that an empty file fails like with a file object."""
+    path = os.path.join(testpath, 'mets.xml')
+    open(path, 'wb').close()
+    with pytest.raises(ET.XMLSyntaxError):
+        mapped.parse(path)
+
+
+@pytest.mark.parametrize('streaming_', [False, True])
+def test_migrate_mmap(testpath, streaming_):
+    """Tests migrating with --mmap."""
+    arguments = [TESTAIP_1_6, '--workspace', testpath, '--contractid',
+                 'urn:uuid:contract', '--mmap']
+    if streaming_:
+        arguments.append('--streaming')
+    assert main(arguments) == 0
+    root = ET.parse(os.path.join(testpath, 'mets.xml')).getroot()
+    assert root.get('PROFILE') == FI_PROFILE
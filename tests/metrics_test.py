@@ -0,0 +1,217 @@
+"""Tests for the metrics module."""
+
+import os
+import shutil
+import urllib.request
+
+import pytest
+
+from dpres_specification_migrator.batch import FileResult
+from dpres_specification_migrator.metrics import (Histogram, Metrics,
+                                                  serve_metrics)
+from dpres_specification_migrator.transform_mets import main
+from dpres_specification_migrator.writer import AtomicWriter
+
+TESTAIP_1_6 = 'tests/data/mets/mets_1_6.xml'
+TESTAIP_1_7 = 'tests/data/mets/mets_1_7.xml'
+
+
+def samples(text):
+    """Returns the samples of a Prometheus text document as a
+    dictionary.
+    """
+    return dict(line.rsplit(' ', 1) for line in text.splitlines()
+                if line and not line.startswith('#'))
+
+
+def test_histogram():
+    """Tests that the histogram buckets are cumulative."""
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in [0.05, 0.1, 0.5, 5.0]:
+        histogram.observe(value)
+    lines = histogram.lines('latency', {'step': 'parse'})
+    assert lines == [
+        'latency_bucket{step="parse",le="0.1"} 2',
+        'latency_bucket{step="parse",le="1.0"} 3',
+        'latency_bucket{step="parse",le="+Inf"} 4',
+        'latency_sum{step="parse"} 5.65',
+        'latency_count{step="parse"} 4']
+
+
+def test_unknown_version_label():
+    """Tests that versions outside the known catalog versions are
+    counted as unknown.
+    """
+    metrics = Metrics()
+    for version in ['1.4', '1.6.1', '1.7.99', '1.7.0\nfoo', None]:
+        metrics.observe('ok', 0.01, version=version)
+    result = samples(metrics.render())
+
+    assert result['transform_mets_documents_total{version="1.4",'
+                  'status="ok"}'] == '1'
+    assert result['transform_mets_documents_total{version="1.6.1",'
+                  'status="ok"}'] == '1'
+    assert result['transform_mets_documents_total{version="unknown",'
+                  'status="ok"}'] == '3'
+    assert len([name for name in result
+                if name.startswith('transform_mets_documents_total')]) == 3
+
+
+def test_observe_result():
+    """Tests counting batch results."""
+    metrics = Metrics()
+    metrics.observe_result(FileResult(
+        TESTAIP_1_7, outpath=TESTAIP_1_7, plan=('1.7.0', '1.7', None),
+        elapsed=0.02, profile={'spans': [
+            {'name': 'parse', 'calls': 1, 'seconds': 0.003}]}))
+    metrics.observe_result(FileResult(
+        TESTAIP_1_6, status='failed', error='ContractIdRequiredError',
+        elapsed=0.01))
+    metrics.observe_failure('NoInputs')
+    result = samples(metrics.render())
+
+    size = os.path.getsize(TESTAIP_1_7)
+    assert result['transform_mets_documents_total{version="1.7.0",'
+                  'status="ok"}'] == '1'
+    assert result['transform_mets_documents_total{version="unknown",'
+                  'status="failed"}'] == '1'
+    assert result['transform_mets_failures_total'
+                  '{error="ContractIdRequiredError"}'] == '1'
+    assert result['transform_mets_failures_total{error="NoInputs"}'] == '1'
+    assert result['transform_mets_bytes_read_total'] == str(
+        size + os.path.getsize(TESTAIP_1_6))
+    assert result['transform_mets_bytes_written_total'] == str(size)
+    assert result['transform_mets_document_duration_seconds_count'] == '2'
+    assert result['transform_mets_step_duration_seconds_bucket'
+                  '{step="parse",le="0.005"}'] == '1'
+
+
+def test_label_escaping():
+    """Tests that quotes, backslashes and newlines in labels are
+    escaped.
+    """
+    metrics = Metrics()
+    metrics.observe_failure('a"b\\c\nd')
+    assert ('transform_mets_failures_total{error="a\\"b\\\\c\\nd"} 1'
+            in metrics.render())
+
+
+def test_write_textfile(testpath):
+    """Tests that the textfile is replaced without leaving temporary
+    files.
+    """
+    path = os.path.join(testpath, 'migrator.prom')
+    metrics = Metrics()
+    metrics.write_textfile(path)
+    metrics.observe_failure('NoInputs')
+    metrics.write_textfile(path)
+    assert os.listdir(testpath) == ['migrator.prom']
+    with open(path, encoding='utf-8') as infile:
+        assert 'transform_mets_failures_total{error="NoInputs"} 1' in (
+            infile.read())
+
+
+def test_write_textfile_durability(testpath, monkeypatch):
+    """Tests that the textfile is written with the durability of the
+    writer.
+    """
+    fsyncs = []
+    fsync = os.fsync
+    monkeypatch.setattr(os, 'fsync',
+                        lambda handle: fsyncs.append(fsync(handle)))
+    path = os.path.join(testpath, 'migrator.prom')
+    Metrics().write_textfile(path, writer=AtomicWriter('none'))
+    assert fsyncs == []
+    Metrics().write_textfile(path, writer=AtomicWriter('file'))
+    assert len(fsyncs) == 2
+
+
+def read_samples(path):
+    """Returns the samples of a metrics file."""
+    with open(path, encoding='utf-8') as infile:
+        return samples(infile.read())
+
+
+@pytest.mark.parametrize(('arguments', 'error'), [
+    (['--manifest', os.devnull], 'NoInputs'),
+    ([TESTAIP_1_6, TESTAIP_1_7, '--output', 'mets.xml'],
+     'SingleDocumentRequired'),
+    ([TESTAIP_1_7, '--output', '-', '--output_archive'], 'ArchiveToStdout'),
+    ([TESTAIP_1_7, '--status_fd', '999'], 'StatusFdError')
+])
+def test_run_failure_metrics(testpath, arguments, error):
+    """Tests that the errors stopping a whole run are counted."""
+    path = os.path.join(testpath, 'migrator.prom')
+    assert main(arguments + ['--workspace', testpath,
+                             '--metrics', path]) == 117
+    assert read_samples(path)[
+        f'transform_mets_failures_total{{error="{error}"}}'] == '1'
+
+
+def test_metrics_port_failure(testpath):
+    """Tests that a metrics port in use is counted in the metrics
+    file.
+    """
+    server = serve_metrics(Metrics(), 0)
+    path = os.path.join(testpath, 'migrator.prom')
+    try:
+        assert main([TESTAIP_1_7, '--workspace', testpath, '--metrics', path,
+                     '--metrics_port',
+                     str(server.server_address[1])]) == 117
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert read_samples(path)[
+        'transform_mets_failures_total{error="MetricsPortError"}'] == '1'
+
+
+@pytest.mark.parametrize('compress', [None, 'gzip'])
+def test_stdout_bytes_written(testpath, capsysbinary, compress):
+    """Tests that the bytes written to stdout are counted."""
+    path = os.path.join(testpath, 'migrator.prom')
+    arguments = [TESTAIP_1_7, '--output', '-', '--metrics', path]
+    if compress:
+        arguments += ['--compress', compress]
+    assert main(arguments) == 0
+    written = len(capsysbinary.readouterr().out)
+    assert written > 0
+    assert read_samples(path)['transform_mets_bytes_written_total'] == str(
+        written)
+
+
+def test_serve_metrics():
+    """Tests serving the metrics on /metrics."""
+    metrics = Metrics()
+    metrics.observe_failure('NoInputs')
+    server = serve_metrics(metrics, 0)
+    try:
+        url = 'http://127.0.0.1:%d/metrics' % server.server_address[1]
+        with urllib.request.urlopen(url) as response:
+            assert response.headers['Content-Type'].startswith(
+                'text/plain; version=0.0.4')
+            assert b'error="NoInputs"' in response.read()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_batch_metrics(testpath):
+    """Tests the metrics file of a batch run with a migrated and a failed
+    METS document.
+    """
+    for name, source in [('a', TESTAIP_1_7), ('b', TESTAIP_1_6)]:
+        os.makedirs(os.path.join(testpath, 'in', name))
+        shutil.copy(source, os.path.join(testpath, 'in', name, 'mets.xml'))
+    path = os.path.join(testpath, 'migrator.prom')
+    return_code = main([os.path.join(testpath, 'in'), '--workspace',
+                        os.path.join(testpath, 'out'), '--metrics', path])
+    assert return_code == 117
+    with open(path, encoding='utf-8') as infile:
+        result = samples(infile.read())
+    assert result['transform_mets_documents_total{version="1.7.0",'
+                  'status="ok"}'] == '1'
+    assert result['transform_mets_failures_total'
+                  '{error="ContractIdRequiredError"}'] == '1'
+    assert any(name.startswith('transform_mets_step_duration_seconds_count'
+                               '{step="migrate_mets/build_root"}')
+               for name in result)
@@ -0,0 +1,89 @@
+"""Tests for the plan module."""
+
+import io
+import os
+import shutil
+
+import pytest
+
+from dpres_specification_migrator.batch import FileResult
+from dpres_specification_migrator.plan import (MigrationPlan, get_plan,
+                                               print_plans)
+from dpres_specification_migrator.transform_mets import main
+
+
+@pytest.mark.parametrize(
+    ('version', 'to_version', 'record_status', 'kdk_profile', 'steps'),
+    [('1.4', '1.7', None, True,
+      ('fix_1_4_mets', 'update_profile', 'update_root_attributes',
+       'set_contractid', 'set_lastmoddate', 'set_mdtype',
+       'update_no_file_format_validation_key', 'fix_preservation_prefix')),
+     ('1.6.1', '1.7', None, False,
+      ('update_root_attributes', 'set_contractid', 'set_lastmoddate',
+       'set_mdtype', 'update_no_file_format_validation_key',
+       'fix_preservation_prefix')),
+     ('1.6.1', '1.6', 'submission', True,
+      ('update_root_attributes', 'set_lastmoddate',
+       'update_no_file_format_validation_key', 'fix_preservation_prefix')),
+     ('1.7.2', '1.7', None, False,
+      ('update_root_attributes', 'set_contractid', 'set_lastmoddate',
+       'set_mdtype', 'update_no_file_format_validation_key',
+       'fix_preservation_prefix')),
+     ('1.7.3', '1.7', 'dissemination', False,
+      ('update_root_attributes', 'set_contractid', 'set_lastmoddate',
+       'set_mdtype', 'fix_preservation_prefix', 'transform_to_dip'))])
+def test_plan_steps(version, to_version, record_status, kdk_profile, steps):
+    """Tests the steps planned for different versions and profiles. The
+    profile is updated only in documents with the KDK profile.
+    """
+    assert MigrationPlan(version, to_version, record_status,
+                         kdk_profile).steps == steps
+
+
+def test_get_plan_cached():
+    """Tests that plans are built once and shared."""
+    plan = get_plan('1.6.1', '1.7')
+    assert get_plan('1.6.1', '1.7') is plan
+    assert get_plan('1.6.1', '1.7', 'dissemination') is not plan
+    assert get_plan('1.6.1', '1.7', kdk_profile=True) is not plan
+    assert plan.key == ('1.6.1', '1.7', None, False)
+    assert plan.from_kdk and not plan.to_kdk
+    assert plan.catalog_version == '1.7.7'
+
+
+def test_print_plans():
+    """Tests printing the plans of a run grouped by plan."""
+    results = [FileResult('a', plan=('1.7.0', '1.7', None)),
+               FileResult('b', plan=('1.7.0', '1.7', None)),
+               FileResult('c', status='failed'),
+               FileResult('d', plan=('1.6.1', '1.7', 'dissemination'))]
+    output = io.StringIO()
+    print_plans(results, file=output)
+
+    lines = output.getvalue().splitlines()
+    assert len(lines) == 2
+    assert lines[0].startswith('Plan: 1.7.0 -> 1.7 (record status: '
+                               'unchanged): update_root_attributes')
+    assert lines[0].endswith('[2 METS documents]')
+    assert 'transform_to_dip [1 METS documents]' in lines[1]
+
+
+def test_show_plan(testpath, capsys):
+    """Tests the --show_plan option of transform_mets."""
+    inputs = os.path.join(testpath, 'inputs')
+    for name in ['a', 'b', 'c']:
+        os.makedirs(os.path.join(inputs, name))
+    for name, version in [('a', '1_6'), ('b', '1_7'), ('c', '1_7')]:
+        shutil.copy(f'tests/data/mets/mets_{version}.xml',
+                    os.path.join(inputs, name, 'mets.xml'))
+
+    assert main([inputs, '--contractid', 'urn:uuid:contract', '--show_plan',
+                 '--workspace', os.path.join(testpath, 'workspace')]) == 0
+
+    plans = [line for line in capsys.readouterr().out.splitlines()
+             if line.startswith('Plan: ')]
+    assert len(plans) == 2
+    assert plans[0].startswith('Plan: 1.6.1 -> 1.7 ')
+    assert plans[0].endswith('[1 METS documents]')
+    assert plans[1].startswith('Plan: 1.7.0 -> 1.7 ')
+    assert plans[1].endswith('[2 METS documents]')
@@ -0,0 +1,137 @@
+"""Tests for the profiling module."""
+
+import json
+import os
+
+import pytest
+
+from dpres_specification_migrator.api import Migrator
+from dpres_specification_migrator.context import MigrationContext
+from dpres_specification_migrator.profiling import (NULL_SPAN, Profiler,
+                                                    ProfilerBusyError, span)
+from dpres_specification_migrator.transform_mets import main
+
+TESTAIP_1_4 = 'tests/data/mets/mets_1_4.xml'
+TESTAIP_1_7 = 'tests/data/mets/mets_1_7.xml'
+
+
+def test_span_without_profiler():
+    """Tests that spans are no-ops without a profiler."""
+    assert span(None, 'step') is NULL_SPAN
+    assert span(MigrationContext(), 'step') is NULL_SPAN
+
+
+def test_profiler_spans():
+    """Tests recording nested spans and calling the callback."""
+    ended = []
+    profiler = Profiler(callback=lambda name, seconds: ended.append(name))
+    context = MigrationContext(profiler=profiler)
+    with span(context, 'outer'):
+        for _ in range(3):
+            with span(context, 'inner'):
+                pass
+
+    spans = profiler.as_dict()['spans']
+    assert [(entry['name'], entry['calls']) for entry in spans] == [
+        ('outer/inner', 3), ('outer', 1)]
+    assert spans[1]['seconds'] >= spans[0]['seconds']
+    assert ended == ['outer/inner'] * 3 + ['outer']
+
+
+@pytest.mark.parametrize('detail', ['cprofile', 'memory'])
+def test_profiler_details(detail):
+    """Tests capturing the function statistics and the memory
+    allocations of a migration.
+    """
+    result = Migrator(profile_detail=detail).migrate(TESTAIP_1_7)
+    if detail == 'cprofile':
+        functions = [entry['function'] for entry
+                     in result.profile['cprofile']]
+        assert any('migrate_mets' in function for function in functions)
+    else:
+        assert result.profile['memory']['peak'] > 0
+        assert result.profile['memory']['top']
+
+
+def test_profiler_details_exclusive():
+    """Tests that only one profiler at a time captures details, and
+    that profilers without details are not limited.
+    """
+    first = Profiler(detail='memory')
+    first.start()
+    try:
+        with pytest.raises(ProfilerBusyError):
+            Profiler(detail='cprofile').start()
+        with pytest.raises(ProfilerBusyError):
+            Migrator(profile_detail='memory').migrate(TESTAIP_1_7)
+        spans = Profiler()
+        spans.start()
+        spans.stop()
+    finally:
+        first.stop()
+
+    second = Profiler(detail='cprofile')
+    second.start()
+    second.stop()
+    assert second.as_dict()['cprofile']
+
+
+def test_profiler_start_failure(monkeypatch):
+    """Tests that a profiler failing to enable cProfile does not keep
+    the other profilers with details from starting.
+    """
+    class BusyProfile:
+        """cProfile.Profile failing as with another active tool."""
+
+        def enable(self):
+            """Fails to enable the profile."""
+            raise ValueError("Another profiling tool is already active")
+
+    monkeypatch.setattr('cProfile.Profile', BusyProfile)
+    with pytest.raises(ValueError):
+        Migrator(profile_detail='cprofile').migrate(TESTAIP_1_7)
+    monkeypatch.undo()
+
+    result = Migrator(profile_detail='memory').migrate(TESTAIP_1_7)
+    assert result.profile['memory']['peak'] > 0
+
+
+def test_profiler_unknown_detail():
+    """Tests that an unknown detail is refused."""
+    with pytest.raises(ValueError):
+        Profiler(detail='disk')
+
+
+def test_migrator_profile():
+    """Tests the spans of a profiled migration, and that migrations are
+    not profiled by default.
+    """
+    assert Migrator(contractid='x').migrate(TESTAIP_1_4).profile is None
+
+    ended = []
+    result = Migrator(contractid='x', record_status='dissemination',
+                      on_span=lambda name, _: ended.append(name)).migrate(
+                          TESTAIP_1_4)
+    names = [entry['name'] for entry in result.profile['spans']]
+    assert names == ended
+    for name in ['parse', 'migrate_mets/fix_1_4_mets/move_mix',
+                 'migrate_mets/update_root_attributes/set_contractid',
+                 'migrate_mets/build_root', 'migrate_mets',
+                 'transform_to_dip/set_dip_metshdr', 'serialize']:
+        assert name in names
+    assert result.profile['counts']['elements'] > 100
+
+
+def test_profile_argument(testpath):
+    """Tests writing the profiles of a run."""
+    profile = os.path.join(testpath, 'profile.json')
+    returncode = main([TESTAIP_1_7, '--workspace', testpath,
+                       '--profile', profile])
+    assert returncode == 0
+
+    with open(profile, 'r', encoding='utf-8') as infile:
+        data = json.load(infile)
+    assert data['documents'][0]['filepath'] == TESTAIP_1_7
+    assert data['documents'][0]['status'] == 'ok'
+    assert 'migrate_mets/build_root' in [
+        entry['name'] for entry in data['spans']]
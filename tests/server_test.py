@@ -0,0 +1,291 @@
+"""Tests for the server module."""
+
+import http.client
+import json
+import os
+import socket
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+import lxml.etree as ET
+
+from dpres_specification_migrator.server import (RequestError,
+                                                 create_server,
+                                                 header_value,
+                                                 parse_arguments,
+                                                 parse_options)
+
+TESTAIP_1_6 = 'tests/data/mets/mets_1_6.xml'
+TESTAIP_1_7 = 'tests/data/mets/mets_1_7.xml'
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a Unix socket."""
+
+    def __init__(self, path):
+        super().__init__('localhost')
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+def run_server(arguments):
+    """Starts a server in a thread.
+
+    :param arguments: Command line arguments of the serve command
+
+    :returns: The server
+    """
+    server = create_server(parse_arguments(arguments + ['--quiet']))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def stop_server(server):
+    """Stops a server started with run_server."""
+    server.shutdown()
+    server.server_close()
+    server.executor.shutdown()
+
+
+@pytest.fixture(scope='module')
+def server():
+    """Server on a free TCP port with two worker processes."""
+    server = run_server(['--port', '0', '--jobs', '2'])
+    yield server
+    stop_server(server)
+
+
+def request(server, method, path, body=None):
+    """Sends a request to the server.
+
+    :returns: Tuple of the response and its body
+    """
+    connection = http.client.HTTPConnection(*server.server_address[:2])
+    connection.request(method, path, body=body)
+    response = connection.getresponse()
+    data = response.read()
+    connection.close()
+    return response, data
+
+
+def read_file(path):
+    """Returns the contents of a file."""
+    with open(path, 'rb') as infile:
+        return infile.read()
+
+
+def test_parse_options():
+    """Tests parsing and validating the migration options."""
+    assert parse_options('contractid=urn:uuid:x&objid=') == {
+        'contractid': 'urn:uuid:x', 'objid': None}
+    for query in ['foo=bar', 'to_version=0.1', 'record_status=foo',
+                  'objid=dip%0D%0AX-Injected:%201', 'contractid=a%00b']:
+        with pytest.raises(RequestError) as error:
+            parse_options(query)
+        assert error.value.status == 400
+
+
+def test_migrate(server):
+    """Tests migrating a document."""
+    response, data = request(server, 'POST',
+                             '/migrate?contractid=urn:uuid:contract',
+                             read_file(TESTAIP_1_6))
+    assert response.status == 200
+    assert response.getheader('Content-Type') == 'application/xml'
+    assert response.getheader('X-Objid') == (
+        'b1d22c00-d28b-4a79-bfa1-b86c37cd10dd')
+    assert response.getheader('X-Migration-Plan').startswith('1.6.1 -> 1.7')
+    assert json.loads(response.getheader('X-Migration-Warnings')) == []
+    root = ET.fromstring(data)
+    assert root.get('PROFILE') == (
+        'http://digitalpreservation.fi/mets-profiles/cultural-heritage')
+
+
+def test_migrate_dissemination(server):
+    """Tests migrating a document into a DIP with the given OBJID."""
+    response, data = request(
+        server, 'POST', '/migrate?record_status=dissemination&objid=dip-1',
+        read_file(TESTAIP_1_7))
+    assert response.status == 200
+    assert response.getheader('X-Objid') == 'dip-1'
+    assert ET.fromstring(data).get('OBJID') == 'dip-1'
+
+
+def test_header_value():
+    """Tests that header values are left as they are, except for the
+    characters outside printable ASCII.
+    """
+    assert header_value('urn:uuid:1-2 a/b?c=d') == 'urn:uuid:1-2 a/b?c=d'
+    assert header_value('dip\r\nX-Injected: 1') == (
+        'dip%0D%0AX-Injected: 1')
+    assert header_value('100%\u00e4') == '100%25%C3%A4'
+
+
+def test_objid_header_injection(server):
+    """Tests that an OBJID with a line break from the query string is
+    refused and one from the document is encoded in the header.
+    """
+    response, data = request(
+        server, 'POST',
+        '/migrate?record_status=dissemination&objid=dip%0D%0AX-Injected:1',
+        read_file(TESTAIP_1_7))
+    assert response.status == 400
+    assert 'Control characters in option objid' in json.loads(data)['error']
+
+    document = read_file(TESTAIP_1_7).replace(
+        b'OBJID="b1d22c00-d28b-4a79-bfa1-b86c37cd10dd"',
+        b'OBJID="aip&#13;&#10;X-Injected: 1"')
+    response, data = request(server, 'POST', '/migrate', document)
+    assert response.status == 200
+    assert response.getheader('X-Injected') is None
+    assert response.getheader('X-Objid') == 'aip%0D%0AX-Injected: 1'
+
+
+def test_catalog_header_injection(server):
+    """Tests that a line break in the catalog version of the document
+    is encoded in the migration plan header.
+    """
+    document = read_file(TESTAIP_1_7).replace(
+        b'fi:CATALOG="1.7.0"', b'fi:CATALOG="1.7.0&#13;&#10;X-Injected: yes"')
+    response, _ = request(server, 'POST', '/migrate', document)
+    assert response.status == 200
+    assert response.getheader('X-Injected') is None
+    assert response.getheader('X-Migration-Plan').startswith(
+        '1.7.0%0D%0AX-Injected: yes -> 1.7')
+    assert response.getheader('X-Migration-Method') == 'dom'
+
+
+def test_unknown_catalog_version(server):
+    """Tests that a document with an unknown catalog version can not
+    be migrated.
+    """
+    document = read_file(TESTAIP_1_7).replace(b'fi:CATALOG="1.7.0"',
+                                              b'fi:CATALOG="9.9"')
+    response, data = request(server, 'POST', '/migrate', document)
+    assert response.status == 422
+    assert json.loads(data)['error'] == 'Unknown METS catalog version 9.9.'
+
+
+def test_broken_pool():
+    """Tests that a request failing since a worker died gets a 503
+    response and that the next request is served by a new pool.
+    """
+    server = run_server(['--port', '0'])
+    try:
+        broken = server.executor
+        with pytest.raises(BrokenProcessPool):
+            broken.submit(os._exit, 1).result()
+        response, data = request(server, 'POST', '/migrate',
+                                 read_file(TESTAIP_1_7))
+        assert response.status == 503
+        assert 'can be retried' in json.loads(data)['error']
+        assert server.executor is not broken
+
+        response, _ = request(server, 'POST', '/migrate',
+                              read_file(TESTAIP_1_7))
+        assert response.status == 200
+        text = request(server, 'GET', '/metrics')[1].decode('utf-8')
+        assert 'transform_mets_failures_total{error="BrokenProcessPool"}' \
+            in text
+    finally:
+        stop_server(server)
+
+
+@pytest.mark.parametrize(('path', 'body', 'status', 'message'), [
+    ('/migrate', TESTAIP_1_6, 422, 'CONTRACTID required'),
+    ('/migrate?to_version=1.6', TESTAIP_1_7, 422, 'older catalog version'),
+    ('/migrate?foo=bar', TESTAIP_1_7, 400, 'Unknown option foo.'),
+    ('/migrate', b'<mets', 400, 'Invalid METS document'),
+    ('/convert', TESTAIP_1_7, 404, 'Not found')
+])
+def test_migrate_errors(server, path, body, status, message):
+    """Tests the responses of requests that can not be served."""
+    if isinstance(body, str):
+        body = read_file(body)
+    response, data = request(server, 'POST', path, body)
+    assert response.status == status
+    assert response.getheader('Content-Type') == 'application/json'
+    assert message in json.loads(data)['error']
+
+
+def test_max_body():
+    """Tests that too large documents are refused without reading
+    them.
+    """
+    server = run_server(['--port', '0', '--max_body', '100'])
+    try:
+        response, data = request(server, 'POST', '/migrate',
+                                 read_file(TESTAIP_1_7))
+    finally:
+        stop_server(server)
+    assert response.status == 413
+    assert 'larger than 100 bytes' in json.loads(data)['error']
+
+
+def test_health_and_stats(server):
+    """Tests the health and statistics endpoints."""
+    response, data = request(server, 'GET', '/health')
+    assert response.status == 200
+    assert json.loads(data) == {'status': 'ok', 'workers': 2}
+
+    before = json.loads(request(server, 'GET', '/stats')[1])
+    request(server, 'POST', '/migrate', read_file(TESTAIP_1_7))
+    request(server, 'POST', '/migrate', read_file(TESTAIP_1_6))
+    after = json.loads(request(server, 'GET', '/stats')[1])
+
+    assert after['requests'] == before['requests'] + 2
+    assert after['migrated'] == before['migrated'] + 1
+    assert after['failed'] == before['failed'] + 1
+    assert after['in_flight'] == 0
+    assert after['bytes_in'] > before['bytes_in']
+    assert after['documents_per_second'] > 0
+    assert after['mean_latency'] > 0
+
+
+def test_metrics(server):
+    """Tests the Prometheus metrics endpoint."""
+    request(server, 'POST', '/migrate', read_file(TESTAIP_1_6))
+    request(server, 'POST', '/migrate?contractid=urn:uuid:contract',
+            read_file(TESTAIP_1_6))
+    response, data = request(server, 'GET', '/metrics')
+    assert response.status == 200
+    assert response.getheader('Content-Type').startswith('text/plain')
+    text = data.decode('utf-8')
+    assert 'transform_mets_documents_total{version="1.6.1",status="ok"}' in (
+        text)
+    assert 'transform_mets_failures_total{error="ContractIdRequiredError"}' \
+        in text
+    assert 'step="migrate_mets/build_root"' in text
+
+
+def test_keep_alive(server):
+    """Tests migrating several documents over one connection."""
+    connection = http.client.HTTPConnection(*server.server_address[:2])
+    objids = []
+    for _ in range(3):
+        connection.request('POST', '/migrate', body=read_file(TESTAIP_1_7))
+        response = connection.getresponse()
+        response.read()
+        objids.append(response.getheader('X-Objid'))
+    connection.close()
+    assert objids == ['b1d22c00-d28b-4a79-bfa1-b86c37cd10dd'] * 3
+
+
+def test_unix_socket(testpath):
+    """Tests serving on a Unix socket."""
+    path = os.path.join(testpath, 'migrator.sock')
+    server = run_server(['--socket', path])
+    try:
+        connection = UnixHTTPConnection(path)
+        connection.request('GET', '/health')
+        assert connection.getresponse().status == 200
+        connection.close()
+    finally:
+        stop_server(server)
+    assert not os.path.exists(path)
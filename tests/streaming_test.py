@@ -0,0 +1,157 @@
+"""Tests for the streaming module."""
+
+import io
+import os
+import re
+
+import pytest
+
+import lxml.etree as ET
+
+from dpres_specification_migrator.context import MigrationContext
+from dpres_specification_migrator.rewriter import NamespaceRewriter
+from dpres_specification_migrator.streaming import (StreamingNotSupported,
+                                                    migrate_stream,
+                                                    read_catalog_version)
+from dpres_specification_migrator.transform_mets import (main, migrate_mets,
+                                                         serialize_mets,
+                                                         transform_to_dip)
+from tests.conftest import canonical
+
+TESTAIP_1_4 = 'tests/data/mets/mets_1_4.xml'
+TESTAIP_1_6 = 'tests/data/mets/mets_1_6.xml'
+TESTAIP_1_7 = 'tests/data/mets/mets_1_7.xml'
+
+
+def _declarations(mets_b):
+    """Returns the namespace declarations of the serialized METS
+    document, which c14n would normalize away.
+    """
+    return sorted(re.findall(rb'xmlns(?::[^\s=]+)?="[^"]*"', mets_b))
+
+
+@pytest.mark.parametrize(
+    ('metsfile', 'catalog', 'dissemination'),
+    [(TESTAIP_1_6, '1.6', False),
+     (TESTAIP_1_6, '1.6', True),
+     (TESTAIP_1_6, '1.7', False),
+     (TESTAIP_1_6, '1.7', True),
+     (TESTAIP_1_7, '1.7', False),
+     (TESTAIP_1_7, '1.7', True)])
+def test_stream_matches_dom(metsfile, catalog, dissemination):
+    """Tests that the streaming migration produces the same document as
+    the DOM migration.
+    """
+    root = ET.parse(metsfile).getroot()
+    version = read_catalog_version(metsfile)
+    migrated, objid = migrate_mets(
+        root, catalog, version, contract='urn:uuid:contract',
+        context=MigrationContext(echo=False))
+    if dissemination:
+        migrated, objid = transform_to_dip(
+            migrated, version[:3], catalog, objid='dip-id',
+            context=MigrationContext(echo=False))
+    expected = serialize_mets(migrated)
+
+    outfile = io.BytesIO()
+    stream_objid = migrate_stream(
+        metsfile, outfile, catalog, contract='urn:uuid:contract',
+        dissemination=dissemination,
+        objid='dip-id' if dissemination else None,
+        context=MigrationContext(echo=False))
+
+    assert stream_objid == objid
+    assert canonical(outfile.getvalue()) == canonical(expected)
+    assert _declarations(outfile.getvalue()) == _declarations(expected)
+
+
+@pytest.mark.parametrize('dissemination', [False, True])
+def test_stream_default_namespace(dissemination):
+    """Tests that the sections of a METS document with a default
+    namespace are written with the prefixes of the output, as in the DOM
+    migration.
+    """
+    with open(TESTAIP_1_7, 'rb') as infile:
+        mets_b = infile.read()
+    mets_b = mets_b.replace(b'xmlns:mets=', b'xmlns=', 1)
+    mets_b = mets_b.replace(b'<mets:', b'<').replace(b'</mets:', b'</')
+
+    root = ET.fromstring(mets_b)
+    migrated, objid = migrate_mets(
+        root, '1.7', '1.7.0', contract='urn:uuid:contract',
+        context=MigrationContext(echo=False))
+    if dissemination:
+        migrated, objid = transform_to_dip(
+            migrated, '1.7', '1.7', objid='dip-id',
+            context=MigrationContext(echo=False))
+    expected = serialize_mets(migrated)
+
+    outfile = io.BytesIO()
+    migrate_stream(io.BytesIO(mets_b), outfile, '1.7',
+                   contract='urn:uuid:contract', dissemination=dissemination,
+                   objid='dip-id' if dissemination else None,
+                   context=MigrationContext(echo=False))
+
+    assert b'ns0:' not in outfile.getvalue()
+    assert canonical(outfile.getvalue()) == canonical(expected)
+    assert _declarations(outfile.getvalue()) == _declarations(expected)
+
+
+def test_stream_1_4_not_supported():
+    """Tests that catalog version 1.4 documents are refused before
+    anything is written.
+    """
+    outfile = io.BytesIO()
+    with pytest.raises(StreamingNotSupported):
+        migrate_stream(TESTAIP_1_4, outfile, '1.7', contract='urn:uuid:x')
+    assert outfile.getvalue() == b''
+
+
+def test_stream_comments():
+    """Tests that comments between the sections are kept and comments
+    before the root are dropped, as in the DOM migration.
+    """
+    with open(TESTAIP_1_7, 'rb') as infile:
+        mets_b = infile.read()
+    mets_b = mets_b.replace(b'<mets:amdSec>',
+                            b'<mets:amdSec><!-- section comment -->', 1)
+    mets_b = mets_b.replace(b'<mets:mets ', b'<!-- prolog --><mets:mets ', 1)
+
+    outfile = io.BytesIO()
+    migrate_stream(io.BytesIO(mets_b), outfile, '1.7')
+
+    assert b'<!-- section comment -->' in outfile.getvalue()
+    assert b'<!-- prolog -->' not in outfile.getvalue()
+
+
+@pytest.mark.parametrize('metsfile', [TESTAIP_1_4, TESTAIP_1_7])
+def test_streaming_main(testpath, metsfile):
+    """Tests the --streaming option. Catalog version 1.4 documents fall
+    back to the DOM migration.
+    """
+    returncode = main([metsfile, '--streaming', '--workspace', testpath,
+                       '--contractid', 'urn:uuid:contract'])
+    assert returncode == 0
+
+    root = ET.parse(os.path.join(testpath, 'mets.xml')).getroot()
+    assert root.xpath('@*[local-name() = "CATALOG"] | '
+                      '@*[local-name() = "SPECIFICATION"]') == ['1.7.7']
+
+
+@pytest.mark.parametrize('block_size', [1, 7, 65536])
+def test_namespace_rewriter(block_size):
+    """Tests that replacements are made also across write boundaries."""
+    data = (b'<a xmlns:textmd="http://www.kdk.fi/standards/textmd">'
+            b'<b xmlns:textmd="http://www.kdk.fi/standards/textmd"/></a>')
+    outfile = io.BytesIO()
+    rewriter = NamespaceRewriter(
+        outfile,
+        [(b'xmlns:textmd="http://www.kdk.fi/standards/textmd"',
+          b'xmlns:textmd="info:lc/xmlns/textMD-v3"')],
+        block_size=block_size)
+    for position in range(0, len(data), 5):
+        rewriter.write(data[position:position + 5])
+    rewriter.flush()
+
+    assert outfile.getvalue() == data.replace(
+        b'http://www.kdk.fi/standards/textmd', b'info:lc/xmlns/textMD-v3')
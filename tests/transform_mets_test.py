@@ -1,6 +1,13 @@
 """Tests for the transform_mets module."""
 
+import concurrent.futures
+import gzip
+import io
+import json
 import os
+import re
+import shutil
+import threading
 from uuid import uuid4
 import copy
 import pytest
@@ -14,8 +21,10 @@ import xml_helpers.utils as h
 from dpres_specification_migrator.transform_mets import main, \
         fix_1_4_mets, remove_attributes, parse_arguments, set_dip_metshdr, \
         migrate_mets, serialize_mets, get_fi_ns, move_mix, \
-        set_charset_from_textmd
-from dpres_specification_migrator.dicts import NAMESPACES
+        set_charset_from_textmd, update_divs, write_mets, collect_textfiles
+from dpres_specification_migrator.context import MigrationContext
+from dpres_specification_migrator.dicts import NAMESPACES, VERSIONS
+from tests.conftest import canonical
 
 
 TESTAIP_1_4 = 'tests/data/mets/mets_1_4.xml'
@@ -24,13 +33,16 @@ TESTAIP_1_4_EXTENSIONS = 'tests/data/mets/mets_1_4_extensions.xml'
 TESTAIP_1_6 = 'tests/data/mets/mets_1_6.xml'
 TESTAIP_1_7 = 'tests/data/mets/mets_1_7.xml'
 
+# ID generated with uuid4 for an element added in the migration
+GENERATED_ID = re.compile(rb'_[0-9a-f]{8}(?:-[0-9a-f]{4}){3}-[0-9a-f]{12}')
+
 
 def test_parse_arguments():
     """test for argument parser"""
     args = parse_arguments(
         [TESTAIP_1_4, '--output_filename=mets_1_5.xml', '--objid=testid',
          '--to_version=1.5', '--workspace=workspace'])
-    assert args.filepath == 'tests/data/mets/mets_1_4.xml'
+    assert args.filepath == ['tests/data/mets/mets_1_4.xml']
     assert args.filename == 'mets_1_5.xml'
     assert args.objid == 'testid'
     assert args.to_version == '1.5'
@@ -242,6 +254,89 @@ def test_dip_migration(testpath, metsfile, objid, catalog, valid):
         assert returncode == 117
 
 
+def test_batch_migration(testpath):
+    """Tests that a directory of METS documents is migrated in one run,
+    that the outputs mirror the input tree under the workspace and that
+    a failing document does not stop the run but sets the return code.
+    """
+    sources = os.path.join(testpath, 'sources')
+    workspace = os.path.join(testpath, 'workspace')
+    for name, metsfile in [('a', TESTAIP_1_4), ('b/c', TESTAIP_1_6),
+                           ('d', TESTAIP_1_7)]:
+        os.makedirs(os.path.join(sources, name))
+        shutil.copy(metsfile, os.path.join(sources, name, 'mets.xml'))
+    with open(os.path.join(sources, 'd', 'broken.xml'), 'w') as outfile:
+        outfile.write('<mets')
+
+    returncode = main([sources, '--workspace', workspace,
+                       '--contractid', 'urn:uuid:' + str(uuid4())])
+    assert returncode == 0
+    for name in ['a', 'b/c', 'd']:
+        root = ET.parse(os.path.join(workspace, name, 'mets.xml')).getroot()
+        assert root.xpath('@*[local-name() = "CATALOG"] | '
+                          '@*[local-name() = "SPECIFICATION"]') == ['1.7.7']
+
+    returncode = main([sources, '--workspace', workspace, '--pattern',
+                       '*.xml', '--contractid', 'urn:uuid:' + str(uuid4())])
+    assert returncode == 117
+
+
+def test_parallel_batch_migration(testpath, capsys):
+    """Tests that a parallel run reports the same statuses in the same
+    order and writes the same documents as a serial run.
+    """
+    sources = os.path.join(testpath, 'sources')
+    for index, metsfile in enumerate([TESTAIP_1_4, TESTAIP_1_6, TESTAIP_1_7,
+                                      TESTAIP_1_4_TEXTMD]):
+        os.makedirs(os.path.join(sources, str(index)))
+        shutil.copy(metsfile, os.path.join(sources, str(index), 'mets.xml'))
+    os.makedirs(os.path.join(sources, 'x'))
+    with open(os.path.join(sources, 'x', 'mets.xml'), 'w') as outfile:
+        outfile.write('<mets')
+
+    outputs = []
+    for jobs in ['1', '3']:
+        workspace = os.path.join(testpath, 'workspace' + jobs)
+        returncode = main([sources, '--workspace', workspace, '--jobs', jobs,
+                           '--contractid', 'urn:uuid:1'])
+        assert returncode == 117
+        captured = capsys.readouterr()
+        outputs.append((captured.out.replace(workspace, 'WS'),
+                        captured.err))
+        for index in range(4):
+            root = ET.parse(os.path.join(workspace, str(index),
+                                         'mets.xml')).getroot()
+            assert root.get('OBJID')
+
+    assert outputs[0] == outputs[1]
+    assert 'failed' in outputs[0][0].splitlines()[-1]
+
+
+@pytest.mark.parametrize('command', [[TESTAIP_1_7],
+                                     ['inventory', TESTAIP_1_7],
+                                     ['serve']])
+@pytest.mark.parametrize('jobs', ['0', '-1'])
+def test_invalid_jobs(capsys, command, jobs):
+    """Tests that less than one job is refused by every command."""
+    with pytest.raises(SystemExit) as error:
+        main(command + ['--jobs', jobs])
+    assert error.value.code == 2
+    assert f'must be at least 1, got {jobs}' in capsys.readouterr().err
+
+
+def test_batch_output_collision(testpath, capsys):
+    """Tests that two inputs mapped to the same output path are not
+    allowed to overwrite each other.
+    """
+    returncode = main([TESTAIP_1_6, TESTAIP_1_7, '--workspace', testpath,
+                       '--contractid', 'urn:uuid:' + str(uuid4())])
+
+    assert returncode == 117
+    assert 'is already used by %s' % TESTAIP_1_6 in capsys.readouterr().err
+    root = ET.parse(os.path.join(testpath, 'mets.xml')).getroot()
+    assert root.get('OBJID') == ET.parse(TESTAIP_1_6).getroot().get('OBJID')
+
+
 def test_fix_1_4_mets():
     """Tests the migrate_old_mets function by asserting that the
     function has modified the METS testdata properly.
@@ -334,6 +429,70 @@ def test_fix_1_4_premis_extensions():
         'text/plain; charset=UTF-8'
 
 
+def test_namespaces_not_modified():
+    """Tests that migrations do not modify the shared namespace map, so
+    that a catalog version 1.4 migration does not affect the next one.
+    """
+    namespaces = dict(NAMESPACES)
+    migrate_mets(ET.parse(TESTAIP_1_4).getroot(), '1.7', '1.4',
+                 contract='aaa')
+    migrate_mets(ET.parse(TESTAIP_1_7).getroot(), '1.7', '1.7.7')
+
+    assert NAMESPACES == namespaces
+
+
+def test_concurrent_migrations():
+    """Tests that migrations to different catalog versions running in
+    parallel threads produce the same documents as the migrations run
+    one at a time, each with the namespaces and attributes of its own
+    version, and leave the shared NAMESPACES unchanged.
+    """
+    namespaces = copy.deepcopy(NAMESPACES)
+
+    def _migrate(job):
+        metsfile, to_catalog = job
+        root = ET.parse(metsfile).getroot()
+        full_version = root.xpath('@*[local-name() = "CATALOG"] | '
+                                  '@*[local-name() = "SPECIFICATION"]')[0]
+        context = MigrationContext(echo=False)
+        migrated, _ = migrate_mets(root, to_catalog, full_version,
+                                   contract='aaa', context=context)
+        migrated.find('{%s}metsHdr' % NAMESPACES['mets']).set(
+            'LASTMODDATE', '2000-01-01T00:00:00+00:00')
+        return serialize_mets(migrated)
+
+    jobs = [(TESTAIP_1_4, '1.5'), (TESTAIP_1_4_TEXTMD, '1.6'),
+            (TESTAIP_1_4_EXTENSIONS, '1.7'), (TESTAIP_1_6, '1.6'),
+            (TESTAIP_1_6, '1.7'), (TESTAIP_1_7, '1.7'),
+            (TESTAIP_1_4, '1.7'), (TESTAIP_1_4_TEXTMD, '1.5')] * 8
+    serial = [_migrate(job) for job in jobs]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        parallel = list(executor.map(_migrate, jobs))
+
+    for (_, to_catalog), expected, result in zip(jobs, serial, parallel):
+        # The techMDs made of the MIX blocks of 1.4 documents get random
+        # IDs
+        assert GENERATED_ID.sub(b'_id', canonical(result)) == \
+            GENERATED_ID.sub(b'_id', canonical(expected))
+        result_root = ET.fromstring(result)
+        fi_ns = get_fi_ns(to_catalog)
+        assert result_root.nsmap['fi'] == fi_ns
+        assert result_root.nsmap['textmd'] == 'info:lc/xmlns/textMD-v3'
+        versions = {name: value for name, value in result_root.items()
+                    if name in ('{%s}CATALOG' % fi_ns,
+                                '{%s}SPECIFICATION' % fi_ns)}
+        assert versions
+        for name, value in versions.items():
+            assert value == VERSIONS[to_catalog][
+                'catalog_version' if name.endswith('CATALOG')
+                else 'newest_specification']
+        assert not [name for name in result_root.attrib
+                    if name.startswith('{') and 'extensions}' in name and
+                    not name.startswith('{%s}' % fi_ns)]
+
+    assert NAMESPACES == namespaces
+
+
 def test_remove_attributes():
     """Tests the remove_attributes function by running the function with
     testdata and asserting that selected attributes have been removed
@@ -519,6 +678,53 @@ def test_serialize_mets():
                            ET.fromstring(mets_outcome)) is True
 
 
+@pytest.mark.parametrize(('metsfile', 'to_version'), [
+    (TESTAIP_1_4, '1.6'),
+    (TESTAIP_1_4, '1.7'),
+    (TESTAIP_1_4_TEXTMD, '1.7'),
+    (TESTAIP_1_4_EXTENSIONS, '1.7'),
+    (TESTAIP_1_6, '1.6'),
+    (TESTAIP_1_6, '1.7'),
+    (TESTAIP_1_7, '1.7')])
+def test_write_mets(metsfile, to_version):
+    """Tests that the output of write_mets is byte for byte the same as
+    serializing the whole document with xml_helpers.utils.serialize and
+    replacing the namespace declarations in the result.
+    """
+    root = h.readfile(metsfile).getroot()
+    full_version = root.xpath('@*[local-name() = "CATALOG"] | '
+                              '@*[local-name() = "SPECIFICATION"]')[0]
+    migrated, _ = migrate_mets(root, to_version, full_version,
+                               contract='urn:uuid:contract',
+                               context=MigrationContext(echo=False))
+
+    expected = h.encode_utf8(h.serialize(migrated)).replace(
+        b'xmlns:textmd="http://www.kdk.fi/standards/textmd"',
+        b'xmlns:textmd="info:lc/xmlns/textMD-v3"')
+    if migrated.xpath('@*[local-name() = "CATALOG"] | '
+                      '@*[local-name() = "SPECIFICATION"]')[0] in [
+                          '1.7.0', '1.7.1', '1.7.2', '1.7.3', '1.7.4',
+                          '1.7.5', '1.7.6', '1.7.7']:
+        expected = expected.replace(
+            b'xmlns:fi="http://www.kdk.fi/standards/mets/kdk-extensions"',
+            b'xmlns:fi="http://digitalpreservation.fi/'
+            b'schemas/mets/fi-extensions"')
+
+    chunks = []
+
+    class Writer:
+        """File object recording the written chunks."""
+
+        def write(self, data):
+            """Records a chunk."""
+            chunks.append(bytes(data))
+
+    write_mets(migrated, Writer())
+
+    assert b''.join(chunks) == expected
+    assert serialize_mets(migrated) == expected
+
+
 def test_get_fi_ns():
     """Tests the get_fi_ns function by asserting that it outputs a
     different namespace for catalog version 1.7 than the rest.
@@ -572,6 +778,65 @@ def test_move_mix():
             assert elem.tag != '{http://www.loc.gov/mix/v20}mix'
 
 
+def test_move_mix_moves_element():
+    """Tests that move_mix moves the MIX element itself to the new techMD
+    block instead of a copy of it.
+    """
+    root = h.readfile(TESTAIP_1_4_EXTENSIONS).getroot()
+    premis_mix = root.xpath('.//mix:mix', namespaces=NAMESPACES)[0]
+
+    move_mix(root, premis_mix)
+
+    assert premis_mix.getparent().getparent().get('MDTYPE') == 'NISOIMG'
+    assert root.xpath('.//mix:mix', namespaces=NAMESPACES) == [premis_mix]
+
+
+def test_update_divs_in_place():
+    """Tests that update_divs sorts the amdSec children by their type,
+    keeps the order of the sections of the same type and moves the
+    existing elements.
+    """
+    root = h.readfile(TESTAIP_1_4).getroot()
+    amdsec = root.xpath('./mets:amdSec', namespaces=NAMESPACES)[0]
+    sections = list(amdsec.iterchildren(ET.Element))
+    for elem in reversed(sections):
+        amdsec.append(elem)
+
+    update_divs(root)
+
+    expected = sorted(reversed(sections), key=m.order)
+    assert expected != list(reversed(sections))
+    assert list(amdsec.iterchildren(ET.Element)) == expected
+
+
+def test_move_mix_admid_tokens():
+    """Tests that the ID of the moved MIX block is only appended to the
+    files referring to the techMD block as a whole ADMID token, not to
+    files with an ID starting with the same characters.
+    """
+    root = h.readfile(TESTAIP_1_4_EXTENSIONS).getroot()
+    premis_mix = root.xpath('.//mix:mix', namespaces=NAMESPACES)[0]
+    techmd_id = premis_mix.xpath('./ancestor::mets:techMD',
+                                 namespaces=NAMESPACES)[0].get('ID')
+    mets_files = root.xpath('./mets:fileSec//mets:file',
+                            namespaces=NAMESPACES)
+    for mets_file in mets_files:
+        if techmd_id not in mets_file.get('ADMID').split():
+            mets_file.set('ADMID', mets_file.get('ADMID') + ' ' +
+                          techmd_id + '0')
+    admids = [mets_file.get('ADMID') for mets_file in mets_files]
+
+    move_mix(root, premis_mix, context=MigrationContext())
+
+    mix_id = root.xpath(".//mets:mdWrap[@MDTYPE='NISOIMG']/..",
+                        namespaces=NAMESPACES)[0].get('ID')
+    for mets_file, admid in zip(mets_files, admids):
+        if techmd_id in admid.split():
+            assert mets_file.get('ADMID') == admid + ' ' + mix_id
+        else:
+            assert mets_file.get('ADMID') == admid
+
+
 def test_set_charset_from_textmd():
     """Tests the set_charset_from_textmd function by asserting that
     the charset from the textMD metadata as been appended to the
@@ -587,3 +852,151 @@ def test_set_charset_from_textmd():
     assert new_root.xpath('.//premis:formatName',
                           namespaces=NAMESPACES)[1].text == \
         'text/plain; charset=UTF-8'
+
+
+def _textmd_mets(techmds, files):
+    """Returns a METS root with textMD and PREMIS object techMD blocks
+    and files referring to them.
+
+    :param techmds: List of (ID, charset) tuples of the textMD blocks
+                    in amdSec order, where a charset of None stands for
+                    a PREMIS object
+    :param files: List of ADMID values of the files in fileSec order
+    """
+    blocks = []
+    for techmd_id, charset in techmds:
+        if charset is None:
+            blocks.append(
+                f'<mets:techMD ID="{techmd_id}"><mets:mdWrap '
+                'MDTYPE="PREMIS:OBJECT"><mets:xmlData><premis:object>'
+                '<premis:objectCharacteristics><premis:format>'
+                '<premis:formatDesignation><premis:formatName>text/plain'
+                '</premis:formatName></premis:formatDesignation>'
+                '</premis:format></premis:objectCharacteristics>'
+                '</premis:object></mets:xmlData></mets:mdWrap>'
+                '</mets:techMD>')
+        else:
+            blocks.append(
+                f'<mets:techMD ID="{techmd_id}"><mets:mdWrap MDTYPE="TEXTMD">'
+                '<mets:xmlData><textmd:textMD><textmd:encoding>'
+                f'<textmd:character_info><textmd:charset>{charset}'
+                '</textmd:charset></textmd:character_info></textmd:encoding>'
+                '</textmd:textMD></mets:xmlData></mets:mdWrap>'
+                '</mets:techMD>')
+    mets_files = ''.join(f'<mets:file ADMID="{admid}"/>' for admid in files)
+    return ET.fromstring(
+        f'<mets:mets xmlns:mets="{NAMESPACES["mets"]}" '
+        f'xmlns:premis="{NAMESPACES["premis"]}" '
+        f'xmlns:textmd="{NAMESPACES["textmd"]}"><mets:amdSec>'
+        f'{"".join(blocks)}</mets:amdSec><mets:fileSec><mets:fileGrp>'
+        f'{mets_files}</mets:fileGrp></mets:fileSec></mets:mets>')
+
+
+@pytest.mark.parametrize(('techmds', 'files', 'expected'), [
+    # One file with several textMD blocks: the last one in the amdSec
+    ([('t2', 'UTF-16'), ('t1', 'UTF-8'), ('p', None)], ['t1 t2 p'],
+     'UTF-8'),
+    ([('t1', 'UTF-8'), ('t2', 'UTF-16'), ('p', None)], ['t1 t2 p'],
+     'UTF-16'),
+    # A PREMIS object shared by files: the last file in the fileSec
+    ([('t2', 'UTF-16'), ('t1', 'UTF-8'), ('p', None)], ['t1 p', 't2 p'],
+     'UTF-16'),
+    ([('t1', 'UTF-8'), ('t2', 'UTF-16'), ('p', None)], ['t2 p', 't1 p'],
+     'UTF-8'),
+    # IDs are matched as whole tokens
+    ([('t1', 'UTF-8'), ('p', None)], ['t10 p'], None)
+])
+def test_charset_precedence(techmds, files, expected):
+    """Tests which charset is used when a file or a PREMIS object is
+    linked to several textMD blocks. The precedence is the same as
+    before the fileSec index: files in fileSec order, and the textMD
+    blocks of a file in amdSec order.
+    """
+    root = _textmd_mets(techmds, files)
+    assert collect_textfiles(root).get('p') == expected
+
+    set_charset_from_textmd(root)
+    formatname = root.xpath('.//premis:formatName', namespaces=NAMESPACES)[0]
+    assert formatname.text == (f'text/plain; charset={expected}' if expected
+                               else 'text/plain')
+
+
+def pipe_stdin(monkeypatch, data):
+    """Replaces stdin with the read end of a pipe, which is not
+    seekable, and writes `data` into the pipe in a thread.
+    """
+    read_fd, write_fd = os.pipe()
+
+    def write():
+        """Writes the data and closes the pipe."""
+        with open(write_fd, 'wb') as pipe:
+            pipe.write(data)
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    monkeypatch.setattr('sys.stdin', io.TextIOWrapper(open(read_fd, 'rb')))
+    return thread
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_stdin_to_stdout(monkeypatch, capsysbinary, streaming):
+    """Tests migrating a METS document piped to stdin. The migrated
+    document is written to stdout and the status line to stderr.
+    """
+    with open(TESTAIP_1_6, 'rb') as infile:
+        thread = pipe_stdin(monkeypatch, infile.read())
+    arguments = ['-', '--contractid', 'urn:uuid:contract']
+    if streaming:
+        arguments.append('--streaming')
+    assert main(arguments) == 0
+    thread.join()
+
+    captured = capsysbinary.readouterr()
+    root = ET.fromstring(captured.out)
+    assert root.get('PROFILE') == (
+        'http://digitalpreservation.fi/mets-profiles/cultural-heritage')
+    assert b'Wrote METS file to stdout with OBJID' in captured.err
+
+
+def test_compressed_stdin_to_stdout(monkeypatch, capsysbinary):
+    """Tests that a compressed stream on stdin is detected without
+    consuming it, and that the output to stdout is compressed.
+    """
+    with open(TESTAIP_1_7, 'rb') as infile:
+        thread = pipe_stdin(monkeypatch, gzip.compress(infile.read()))
+    assert main(['-', '--streaming', '--compress', 'gzip']) == 0
+    thread.join()
+
+    root = ET.fromstring(gzip.decompress(capsysbinary.readouterr().out))
+    assert root.get('OBJID') == 'b1d22c00-d28b-4a79-bfa1-b86c37cd10dd'
+
+
+def test_output_and_status_fd(testpath, capsys):
+    """Tests writing a single METS document to the --output path and its
+    outcome to the --status_fd file descriptor.
+    """
+    outpath = os.path.join(testpath, 'out', 'migrated.xml')
+    read_fd, write_fd = os.pipe()
+    try:
+        assert main([TESTAIP_1_7, '--output', outpath,
+                     '--status_fd', str(write_fd)]) == 0
+    finally:
+        os.close(write_fd)
+    with open(read_fd, 'r', encoding='utf-8') as status:
+        lines = status.read().splitlines()
+
+    assert ET.parse(outpath).getroot().get('OBJID') == (
+        'b1d22c00-d28b-4a79-bfa1-b86c37cd10dd')
+    assert f'Wrote METS file as {outpath}' in capsys.readouterr().out
+    assert len(lines) == 1
+    assert json.loads(lines[0]) == {
+        'filepath': TESTAIP_1_7, 'outpath': outpath,
+        'objid': 'b1d22c00-d28b-4a79-bfa1-b86c37cd10dd', 'status': 'ok',
+        'error': None, 'message': None, 'warnings': []}
+
+
+def test_output_single_input(testpath, capsys):
+    """Tests that --output is refused for more than one input."""
+    assert main([TESTAIP_1_6, TESTAIP_1_7, '--output',
+                 os.path.join(testpath, 'mets.xml')]) == 117
+    assert 'take a single METS document' in capsys.readouterr().err
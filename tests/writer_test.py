@@ -0,0 +1,124 @@
+"""Tests for the writer module."""
+
+import gzip
+import os
+import shutil
+
+import pytest
+
+import lxml.etree as ET
+
+from dpres_specification_migrator.api import Migrator
+from dpres_specification_migrator.transform_mets import main
+from dpres_specification_migrator.writer import AtomicWriter, sync
+
+TESTAIP_1_7 = 'tests/data/mets/mets_1_7.xml'
+
+
+@pytest.fixture
+def fsyncs(monkeypatch):
+    """Records the paths of the files and directories fsynced.
+
+    :returns: List of paths
+    """
+    paths = []
+    fsync = os.fsync
+
+    def record(handle):
+        """Records the path of the file descriptor and fsyncs it."""
+        paths.append(os.readlink(f'/proc/self/fd/{handle}'))
+        fsync(handle)
+
+    monkeypatch.setattr(os, 'fsync', record)
+    return paths
+
+
+def test_write_file(testpath):
+    """Tests that the file is created in a new directory with the mode
+    of a plain open, and that no temporary file is left behind.
+    """
+    path = os.path.join(testpath, 'out', 'mets.xml')
+    AtomicWriter().write_file(path, b'<mets/>')
+
+    with open(path, 'rb') as infile:
+        assert infile.read() == b'<mets/>'
+    umask = os.umask(0)
+    os.umask(umask)
+    assert os.stat(path).st_mode & 0o777 == 0o666 & ~umask
+    assert os.listdir(os.path.dirname(path)) == ['mets.xml']
+
+
+def test_failed_write(testpath):
+    """Tests that a failed write leaves the earlier file as it was."""
+    path = os.path.join(testpath, 'mets.xml')
+    AtomicWriter().write_file(path, b'old')
+    with pytest.raises(RuntimeError):
+        with AtomicWriter().open(path) as outfile:
+            outfile.write(b'partial')
+            raise RuntimeError("Killed")
+
+    with open(path, 'rb') as infile:
+        assert infile.read() == b'old'
+    assert os.listdir(testpath) == ['mets.xml']
+
+
+def test_compressed_write(testpath):
+    """Tests writing a compressed file."""
+    path = os.path.join(testpath, 'mets.xml.gz')
+    with AtomicWriter().open(path, 'gzip') as outfile:
+        outfile.write(b'<mets/>')
+    with open(path, 'rb') as infile:
+        assert gzip.decompress(infile.read()) == b'<mets/>'
+
+
+@pytest.mark.parametrize(('durability', 'expected'), [
+    ('none', []),
+    ('batch', []),
+    ('file', ['file', 'directory'])])
+def test_durability(testpath, fsyncs, durability, expected):
+    """Tests that only the 'file' durability fsyncs while writing."""
+    path = os.path.join(testpath, 'mets.xml')
+    AtomicWriter(durability).write_file(path, b'<mets/>')
+    assert [('directory' if synced == os.path.realpath(testpath)
+             else 'file') for synced in fsyncs] == expected
+
+
+def test_sync(testpath, fsyncs):
+    """Tests that every directory is fsynced once after its files."""
+    paths = [os.path.join(testpath, name) for name in ('a.xml', 'b.xml')]
+    for path in paths:
+        AtomicWriter('batch').write_file(path, b'<mets/>')
+    sync(paths)
+    assert fsyncs == [os.path.realpath(path) for path in paths] + [
+        os.path.realpath(testpath)]
+
+
+def test_failed_migration(testpath):
+    """Tests that a streaming migration failing halfway leaves no
+    output behind.
+    """
+    with open(TESTAIP_1_7, 'rb') as infile:
+        data = infile.read()
+    path = os.path.join(testpath, 'mets.xml')
+    with pytest.raises(ET.XMLSyntaxError):
+        Migrator(streaming=True).migrate(data[:len(data) // 2],
+                                         outfile=path)
+    assert os.listdir(testpath) == []
+
+
+def test_batch_durability(testpath, monkeypatch):
+    """Tests that the outputs of a run with --durability batch are
+    flushed together at the end of the run.
+    """
+    groups = []
+    monkeypatch.setattr(
+        'dpres_specification_migrator.transform_mets.sync',
+        lambda paths: groups.append(sorted(paths)))
+    for name in ('a', 'b'):
+        os.makedirs(os.path.join(testpath, 'in', name))
+        shutil.copy(TESTAIP_1_7, os.path.join(testpath, 'in', name))
+    workspace = os.path.join(testpath, 'workspace')
+    assert main([os.path.join(testpath, 'in'), '--pattern', 'mets_1_7.xml',
+                 '--workspace', workspace, '--durability', 'batch']) == 0
+    assert groups == [[os.path.join(workspace, name, 'mets.xml')
+                       for name in ('a', 'b')]]
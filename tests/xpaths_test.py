@@ -0,0 +1,42 @@
+"""Tests for the xpaths module."""
+
+import lxml.etree as ET
+import pytest
+
+from dpres_specification_migrator import xpaths
+from dpres_specification_migrator.context import TEXTMD_1_4_NS
+from dpres_specification_migrator.dicts import NAMESPACES
+
+METSFILES = ['tests/data/mets/mets_1_4.xml',
+             'tests/data/mets/mets_1_4_extensions.xml',
+             'tests/data/mets/mets_1_4_textmd.xml',
+             'tests/data/mets/mets_1_6.xml',
+             'tests/data/mets/mets_1_7.xml']
+
+
+@pytest.mark.parametrize("metsfile", METSFILES)
+def test_compiled_queries(metsfile):
+    """Tests that the precompiled queries return the same elements as
+    the same expressions evaluated from strings, both from the root and
+    from every element of the document.
+    """
+    root = ET.parse(metsfile).getroot()
+    for name in dir(xpaths):
+        query = getattr(xpaths, name)
+        if not isinstance(query, ET.XPath):
+            continue
+        for elem in root.iter(ET.Element):
+            assert query(elem) == elem.xpath(query.path,
+                                             namespaces=NAMESPACES)
+
+
+def test_premis_textmd():
+    """Tests that the textMD query follows the namespace it is compiled
+    for and that the compiled query is reused.
+    """
+    root = ET.parse('tests/data/mets/mets_1_4_extensions.xml').getroot()
+
+    assert len(xpaths.premis_textmd(TEXTMD_1_4_NS)(root)) == 1
+    assert not xpaths.premis_textmd(NAMESPACES['textmd'])(root)
+    assert xpaths.premis_textmd(TEXTMD_1_4_NS) is \
+        xpaths.premis_textmd(TEXTMD_1_4_NS)